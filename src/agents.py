@@ -1,4 +1,6 @@
+import copy
 import json
+import numpy as np
 import simpy
 import random
 
@@ -7,11 +9,12 @@ from abc import ABC, abstractmethod
 from datetime import datetime, timedelta
 from functools import partial
 from typing import Any, Callable, Dict, List, Sequence, Tuple
-from uuid import uuid4
 
 from enum import Enum, auto
-from enums import AccountStage, AccountType, Industry, Country, LeadSource
+from enums import AccountStage, AccountType, Industry, Country, LeadSource, OpportunityStage
 from enums import MktgIntents, SalesIntents, OpsIntents, Actions, BusinessValues, InternalMessages
+from enums import enum_codes
+from tables import Column
 
 # Global parameters (can be tweaked)
 LEAD_CONVERSION_RATES = {
@@ -38,16 +41,18 @@ class BaseAgent(ABC):
 
     _category = "baseagent" 
     
-    def __init__(self, crm):
+    def __init__(self, crm, created_at=None):
         self.crm = crm
         # Define aliases for convenience
         self.env = self.crm.env
+        self.created_at = self.env.now if created_at is None else created_at
 
         # call property method to check that category was defined the this class
         self.category 
 
         # Create agent standard attributes
         self.inbox = simpy.Store(self.env)
+        self.resume = None  # process to complete before handling the inbox, set when restoring a checkpoint
 
         # Register agent to collection crm.agents:dict
         self.crm.register_agent_to_crm(self, self.category)
@@ -66,6 +71,9 @@ class BaseAgent(ABC):
     # Agent Standard Processes
     def handle_inbox(self):
         """Process: handle incoming messages and triger relevant further process"""
+        if self.resume is not None:
+            yield from self.resume
+            self.resume = None
         while True:
             json_msg = yield self.inbox.get()
             self.log(f"Received message: {json_msg}")
@@ -93,12 +101,13 @@ class BaseAgent(ABC):
     def record_instance_creation(self):
         self.crm.record_transaction(
             msg={
-                'suid': self.crm.uid,
-                'ruid': self.uid,
+                'suid': self.crm.aid,
+                'ruid': self.aid,
                 'intent': f"new {self.category} instance",
                 'action': 'create',
             },
             transaction_type='system',
+            timestamp=self.created_at,
         )
     
     @property
@@ -115,10 +124,9 @@ class BaseAgent(ABC):
         pass
 
     @property
-    @abstractmethod
     def uid(self) -> str:
-        """Unique identifier for the agent"""
-        pass
+        """Unique identifier string of the agent, materialized from its integer id `aid` on first use"""
+        return self.crm.registry.uid(self.aid)
 
     @property
     @abstractmethod
@@ -141,16 +149,31 @@ class MarketingDpt(BaseAgent):
 
     Outgoing processes:
     - sending email campaigns
+    - onboarding leads from industry events (when `industry_events` is True)
     Incoming processes, triggered upon related message:
     - move accounts to MQL stage and assign SalesRep to the account
     """
 
     _category = 'marketing'
+
+    default_marketing_parameters = {
+        MktgIntents.EMAIL_CAMPAIGN.value: {
+            'nb_targetted_accounts': 10, # Number of accounts to target in each campaign
+            'nb_yearly_campaigns': 52 / 3,
+        },
+        MktgIntents.INDUSTRY_EVENT.value: {
+            'nb_leads_per_event': 280, # Number of accounts to target in each event
+            'industry_event_conversion_rate': 0.6,
+            'nb_yearly_events': 12,
+        }
+    }
     
-    def __init__(self, crm):
+    def __init__(self, crm, industry_events=False):
         """Initialize the Marketing Department Agent"""
         self._name:str = 'Marketing Dpt'
-        self._uid:str = 'mktg-' + str(uuid4())
+        self.industry_events = industry_events
+        self.next_campaign_at = 0
+        self.next_industry_event_at = None
 
         # Define process parameters
         self._loprocesses = [
@@ -159,17 +182,7 @@ class MarketingDpt(BaseAgent):
         self._process_map = {
             MktgIntents.EMAIL_CAMPAIGN.value: self.process_email_campaign_replies,
         }
-        self.marketing_parameters = {
-            MktgIntents.EMAIL_CAMPAIGN.value: {
-                'nb_targetted_accounts': 10, # Number of accounts to target in each campaign
-                'nb_yearly_campaigns': 52 / 3,
-            },
-            MktgIntents.INDUSTRY_EVENT.value: {
-                'nb_leads_per_event': 280, # Number of accounts to target in each event
-                'industry_event_conversion_rate': 0.6,
-                'nb_yearly_events': 12,
-            }
-        }
+        self.marketing_parameters = copy.deepcopy(self.default_marketing_parameters)
 
         super().__init__(crm)
 
@@ -178,7 +191,7 @@ class MarketingDpt(BaseAgent):
         """Analyse reply to email campain and takes appropriate action"""
         # self.log(f"Processing email campaign reply: {msg}")
         # Steps when action accounts is ACCEPT
-        account = next((a for a in self.crm.agents['account'] if a.uid == msg['suid']), None)
+        account = self.crm.registry.get(msg['suid'])
         if account:
             if msg['action'] == Actions.ACCEPT.value:
                 # Retrieve account from its suid
@@ -193,38 +206,67 @@ class MarketingDpt(BaseAgent):
  
     def send_email_campaign(self):
         while True:
+            yield self.env.timeout(max(self.next_campaign_at - self.env.now, 0))
             targetted = self.pick_targetted_accounts()
             msg = {
-                'suid': self.uid,
+                'suid': self.aid,
                 'intent': MktgIntents.EMAIL_CAMPAIGN.value,
                 'action': Actions.REQUEST.value,
             }
             for account in targetted:
-                msg.update(ruid=account.uid)
+                msg.update(ruid=account.aid)
                 yield account.inbox.put(json.dumps(msg))
                 self.crm.record_transaction(msg, transaction_type='external')
             time_to_next_campaign = self.compute_time_to_next_campaign()
-            self.log(f"Next campaign at {self.env.now + time_to_next_campaign:.2f}")
-            yield self.env.timeout(time_to_next_campaign)
+            self.next_campaign_at = self.env.now + time_to_next_campaign
+            self.log(f"Next campaign at {self.next_campaign_at:.2f}")
+
+    def run_industry_events(self):
+        """Onboard the leads of each industry event in one batch, `nb_yearly_events` times a year"""
+        while True:
+            if self.next_industry_event_at is None:
+                self.next_industry_event_at = self.env.now + self.compute_time_to_next_event()
+            yield self.env.timeout(max(self.next_industry_event_at - self.env.now, 0))
+            self.next_industry_event_at = None
+            self.onboard_industry_event_leads()
+
+    def onboard_industry_event_leads(self):
+        """Create the accounts of all leads from one industry event in bulk.
+
+        Contacts qualify as leads with `industry_event_conversion_rate`, and leads qualify directly
+        as SQL with the account's industry event conversion rate, the others as MQL.
+        """
+        params = self.marketing_parameters[MktgIntents.INDUSTRY_EVENT.value]
+        nb_leads = np.random.binomial(params['nb_leads_per_event'], params['industry_event_conversion_rate'])
+        nb_sql = np.random.binomial(nb_leads, Account.mktg_conversion_rates[MktgIntents.INDUSTRY_EVENT.value])
+        mql = self.crm.add_accounts(nb_leads - nb_sql, stage=AccountStage.MQL, lead_source=LeadSource.INDUSTRY_EVENT)
+        sql = self.crm.add_accounts(nb_sql, stage=AccountStage.SQL, lead_source=LeadSource.INDUSTRY_EVENT)
+        self.crm.record_transactions(
+            msgs=[
+                {'suid': self.aid, 'ruid': account.aid, 'intent': MktgIntents.INDUSTRY_EVENT.value, 'action': Actions.ACCEPT.value}
+                for account in mql + sql
+            ],
+            transaction_type='external',
+        )
+        self.log(f"Industry event: onboarded {nb_leads - nb_sql} MQL and {nb_sql} SQL accounts")
 
     # Utility functions
     def pick_targetted_accounts(self):
         nb_accts = self.marketing_parameters[MktgIntents.EMAIL_CAMPAIGN.value]['nb_targetted_accounts']
-        mql = self.crm.get_accounts(stage=AccountStage.MQL)
-        nb_mql = len(mql)
-        # self.log(f"Found {nb_mql} MQL accounts")
-        return random.sample(mql, min(nb_accts, nb_mql))
+        return self.crm.sample_accounts(self.crm.account_table.rows(AccountStage.MQL), nb_accts)
 
     def compute_time_to_next_campaign(self):
         """Compute the time in weeks to the next campaign"""
         n = self.marketing_parameters[MktgIntents.EMAIL_CAMPAIGN.value]['nb_yearly_campaigns']
         return int(52 / max(n, 1))
 
-    @property
-    def name(self) -> str: return self._name
+    def compute_time_to_next_event(self):
+        """Compute the time in weeks to the next industry event"""
+        n = self.marketing_parameters[MktgIntents.INDUSTRY_EVENT.value]['nb_yearly_events']
+        return 52 / max(n, 1)
 
     @property
-    def uid(self) -> str: return self._uid
+    def name(self) -> str: return self._name
 
     @property
     def process_map(self) -> Dict[str, Callable]:
@@ -237,16 +279,24 @@ class MarketingDpt(BaseAgent):
 
         each process is defined as a tuple of (function, kwargs)
         """
-        return [(self.send_email_campaign, {})]
+        loprocesses = [(self.send_email_campaign, {})]
+        if self.industry_events:
+            loprocesses.append((self.run_industry_events, {}))
+        return loprocesses
 
 
 class SalesRep(BaseAgent):
 
     _category = 'salesrep'
 
+    # Export schema: column -> (attribute path, kind), see utils.snapshot_df
+    export_schema = {
+        'name': ('name', None),
+        'uid': ('uid', None),
+    }
+
     def __init__(self, crm, name):
         self._name = name
-        self._uid = 'srep-' + str(uuid4())
         self.assigned_accounts = []
 
         # Define process parameters   
@@ -282,17 +332,14 @@ class SalesRep(BaseAgent):
             ref_stage = AccountStage.SQL
             # self.log(f"queue: {sorted([a.name for a in self.crm.requests_in_progress])}")
             # self.log(f"Entering 'request_user_need_discovery' for {self.wkly_review_needs} accounts")
-            accts = [a for a in self.crm.accounts_per_stage(ref_stage) if a not in self.crm.requests_in_progress]
-            nb_accts = len(accts)
-            # self.log(f"{ref_stage.name}: {nb_accts}, {[a.name for a in accts]}")
-            targetted = random.sample(accts,min(nb_accts, self.wkly_review_needs))
+            rows = self.crm.account_table.rows(ref_stage, exclude_in_progress=True)
+            targetted = self.crm.sample_accounts(rows, self.wkly_review_needs)
             # queue targetted accounts to avoid sending them a new request before their reply
-            self.crm.requests_in_progress.extend(targetted)
-            self.log(f"Added to queue: {sorted([a.name for a in targetted])}")
+            self.crm.start_requests(targetted)
             for account in targetted:
                 msg = {
-                    'suid': self.uid,
-                    'ruid': account.uid,
+                    'suid': self.aid,
+                    'ruid': account.aid,
                     'intent': SalesIntents.USER_NEED.value,
                     'action': Actions.REQUEST.value,
                 }
@@ -310,18 +357,15 @@ class SalesRep(BaseAgent):
         while True:
             ref_stage = AccountStage.PROSPECT
             # self.log(f"Entering 'request_user_need_discovery' for {self.wkly_review_needs} accounts")
-            accts = [a for a in self.crm.accounts_per_stage(ref_stage) if a not in self.crm.requests_in_progress]
-            accts = accts + self.crm.accounts_per_stage(AccountStage.ACTIVE)
-            nb_accts = len(accts)
-            # self.log(f"{ref_stage.name}: {nb_accts}, {[a.name for a in accts]}")
-            targetted = random.sample(accts,min(nb_accts, self.wkly_request_for_presentation))
+            rows = self.crm.account_table.rows(ref_stage, exclude_in_progress=True)
+            rows = np.concatenate([rows, self.crm.account_table.rows(AccountStage.ACTIVE)])
+            targetted = self.crm.sample_accounts(rows, self.wkly_request_for_presentation)
             # queue targetted accounts to avoid sending them a new request before their reply
-            self.crm.requests_in_progress.extend(targetted)
-            self.log(f"Added to queue: {sorted([a.name for a in targetted])}")
+            self.crm.start_requests(targetted)
             for account in targetted:
                 msg = {
-                    'suid': self.uid,
-                    'ruid': account.uid,
+                    'suid': self.aid,
+                    'ruid': account.aid,
                     'intent': SalesIntents.PRESENTATION.value,
                     'action': Actions.REQUEST.value,
                 }
@@ -338,17 +382,14 @@ class SalesRep(BaseAgent):
         while True:
             ref_stage = AccountStage.PITCHED
             # self.log(f"Entering 'request_user_need_discovery' for {self.wkly_review_needs} accounts")
-            accts = [a for a in self.crm.accounts_per_stage(ref_stage) if a not in self.crm.requests_in_progress]
-            nb_accts = len(accts)
-            # self.log(f"{ref_stage.name}: {nb_accts}, {[a.name for a in accts]}")
-            targetted = random.sample(accts,min(nb_accts, self.wkly_request_for_bid))
+            rows = self.crm.account_table.rows(ref_stage, exclude_in_progress=True)
+            targetted = self.crm.sample_accounts(rows, self.wkly_request_for_bid)
             # queue targetted accounts to avoid sending them a new request before their reply
-            self.crm.requests_in_progress.extend(targetted)
-            self.log(f"Added to queue: {sorted([a.name for a in targetted])}")
+            self.crm.start_requests(targetted)
             for account in targetted:
                 msg = {
-                    'suid': self.uid,
-                    'ruid': account.uid,
+                    'suid': self.aid,
+                    'ruid': account.aid,
                     'intent': SalesIntents.BID.value,
                     'action': Actions.REQUEST.value,
                 }
@@ -365,17 +406,14 @@ class SalesRep(BaseAgent):
         while True:
             ref_stage = AccountStage.BIDDED
             # self.log(f"Entering 'request_user_need_discovery' for {self.wkly_review_needs} accounts")
-            accts = [a for a in self.crm.accounts_per_stage(ref_stage) if a not in self.crm.requests_in_progress]
-            nb_accts = len(accts)
-            # self.log(f"{ref_stage.name}: {nb_accts}, {[a.name for a in accts]}")
-            targetted = random.sample(accts,min(nb_accts, self.wkly_request_for_nego))
+            rows = self.crm.account_table.rows(ref_stage, exclude_in_progress=True)
+            targetted = self.crm.sample_accounts(rows, self.wkly_request_for_nego)
             # queue targetted accounts to avoid sending them a new request before their reply
-            self.crm.requests_in_progress.extend(targetted)
-            self.log(f"Added to queue: {sorted([a.name for a in targetted])}")
+            self.crm.start_requests(targetted)
             for account in targetted:
                 msg = {
-                    'suid': self.uid,
-                    'ruid': account.uid,
+                    'suid': self.aid,
+                    'ruid': account.aid,
                     'intent': SalesIntents.NEGO.value,
                     'action': Actions.REQUEST.value,
                 }
@@ -392,17 +430,14 @@ class SalesRep(BaseAgent):
         while True:
             ref_stage = AccountStage.SIGNED
             # self.log(f"Entering 'request_user_need_discovery' for {self.wkly_review_needs} accounts")
-            accts = [a for a in self.crm.accounts_per_stage(ref_stage) if a not in self.crm.requests_in_progress]
-            nb_accts = len(accts)
-            # self.log(f"{ref_stage.name}: {nb_accts}, {[a.name for a in accts]}")
-            targetted = random.sample(accts,min(nb_accts, self.wkly_completion_handover))
+            rows = self.crm.account_table.rows(ref_stage, exclude_in_progress=True)
+            targetted = self.crm.sample_accounts(rows, self.wkly_completion_handover)
             # queue targetted accounts to avoid sending them a new request before their reply
-            self.crm.requests_in_progress.extend(targetted)
-            self.log(f"Added to queue: {sorted([a.name for a in targetted])}")
+            self.crm.start_requests(targetted)
             for account in targetted:
                 msg = {
-                    'suid': self.uid,
-                    'ruid': account.uid,
+                    'suid': self.aid,
+                    'ruid': account.aid,
                     'intent': OpsIntents.FEEDBACK_AT_COMPLETION.value,
                     'action': Actions.REQUEST.value,
                 }
@@ -443,7 +478,7 @@ class SalesRep(BaseAgent):
             }
         }
 
-        account = next((a for a in self.crm.agents['account'] if a.uid == msg['suid']), None)
+        account = self.crm.registry.get(msg['suid'])
         if account:
             intent, action = msg['intent'], msg['action']
             fr,to = action_mapping[intent][action]
@@ -451,24 +486,21 @@ class SalesRep(BaseAgent):
             account.transition(fr=fr, to=to)
             self.crm.record_transaction(
                 msg={
-                    'suid': self.uid,
-                    'ruid': account.uid,
+                    'suid': self.aid,
+                    'ruid': account.aid,
                     'intent': f"{fr.name} to {to.name}",
                     'action': 'transition',
                 },
                 transaction_type='internal',
             )
-            self.crm.requests_in_progress.remove(account)
-            self.log(f"Removed {account.name} from queue, remaining: {sorted([a.name for a in self.crm.requests_in_progress])}")
+            self.crm.end_request(account)
+            self.log(f"Removed {account.name} from queue, {len(self.crm.requests_in_progress)} remaining")
 
         yield self.env.timeout(0)
 
     @property
     def name(self) -> str: return self._name
 
-    @property
-    def uid(self) -> str: return self._uid
-
     @property
     def process_map(self) -> Dict[str, Callable]: return self._process_map
 
@@ -480,13 +512,7 @@ class SalesRep(BaseAgent):
 
     def __call__(self) -> dict:
         """Return a dictionary representation of the sales rep."""
-        # a2drop = ['crm', 'env', 'inbox', 'marketing','category', 'assigned_salesrep', 'sales_conversion_rates', 'mktg_conversion_rates', 'account_parameters', 'loprocesses',  'ops_conversion_delays', 'process_map', 'sales_conversion_delays', 'mktg_conversion_delays', 'ops_conversion_rates']
-        a2drop = ['crm', 'env', 'inbox', 'marketing','category','process_map', 'wkly_completion_handover', 'wkly_request_for_nego', 'wkly_request_for_presentation', 'loprocesses', 'assigned_accounts','wkly_review_needs', 'wkly_request_for_bid']
-        a2keep = []
-        attrs = [a for a in dir(self) if not a.startswith('_') and not callable(getattr(self, a))]
-        aoi = set(attrs).difference(set(a2drop)).union(set(a2keep))
-        # print(aoi)
-        return {a:getattr(self,a) for a in dir(self) if a in list(aoi)}
+        return {col:getattr(self, col) for col in self.export_schema}
 
 
 class Account(BaseAgent):
@@ -526,27 +552,87 @@ class Account(BaseAgent):
         OpsIntents.FEEDBACK_AT_COMPLETION.value: 4 * 2, # 2 months for implementation
     }
 
+    # Conversion factors per account attribute, and attribute used as factor for each intent
+    conversion_factors = {
+        'country': {
+            Country.EU: 1,
+            Country.US: 0.75,
+            Country.CN: 0.66,
+        },
+        'industry': {
+            Industry.FoodnBeverage: 1,
+            Industry.ConsumerGoods: 1,
+            Industry.Chemicals: 0.75,
+            Industry.Pharmaceuticals: 0.75
+        },
+        'account_type': {
+            AccountType.SMALL: 0.50,
+            AccountType.MEDIUM: 1.0,
+            AccountType.LARGE: 1.0
+        },
+    }
+    conversion_factor_dimensions = {
+        SalesIntents.USER_NEED.value: 'country',
+        SalesIntents.PRESENTATION.value: 'country',
+        SalesIntents.BID.value: 'industry',
+        SalesIntents.NEGO.value: 'account_type',
+        OpsIntents.FEEDBACK_AT_COMPLETION.value: 'country',
+    }
+    conversion_factor_table: np.ndarray         # built by build_conversion_factor_table
+    conversion_intent_codes: Dict[str, int]     # intent -> index in last axis of conversion_factor_table
+
     opportunity_sizes = {
         AccountType.SMALL: (10_000,50_000),
         AccountType.MEDIUM: (50_000,250_000),
         AccountType.LARGE: (250_000,1_000_000),
     }
+
+    # Export schema: column -> (attribute path, kind), see utils.snapshot_df
+    export_schema = {
+        'account_type': ('account_type', AccountType),
+        'assigned_salesrep': ('assigned_salesrep.uid', None),
+        'country': ('country', Country),
+        'cumulative_opportunity_value': ('cumulative_opportunity_value', 'int64'),
+        'cumulative_purchase_value': ('cumulative_purchase_value', 'int64'),
+        'industry': ('industry', Industry),
+        'lead_source': ('lead_source', LeadSource),
+        'name': ('name', None),
+        'nb_opportunities': ('nb_opportunities', 'int64'),
+        'nb_purchases': ('nb_purchases', 'int64'),
+        'stage': ('stage', AccountStage),
+        'uid': ('uid', None),
+    }
     
 
-    def __init__(self, crm, name, marketing, **kwargs):
-        """Initialize the Account Agent"""
+    # State stored in the row `idx` of crm.account_table, see tables.AccountTable.
+    # The name is also kept as a plain attribute, as it is read in every log message.
+    _stage = Column('account_table', 'stage', AccountStage)
+    _salesrep = Column('account_table', 'salesrep')
+    country = Column('account_table', enum_cls=Country)
+    industry = Column('account_table', enum_cls=Industry)
+    account_type = Column('account_table', enum_cls=AccountType)
+    lead_source = Column('account_table', enum_cls=LeadSource)
+    nb_opportunities = Column('account_table')
+    cumulative_opportunity_value = Column('account_table')
+    active_opportunity = Column('account_table')
+    nb_purchases = Column('account_table')
+    cumulative_purchase_value = Column('account_table')
+    active_purchase = Column('account_table')
+
+    def __init__(self, crm, name, marketing, created_at=None, idx=None, **kwargs):
+        """Initialize the Account Agent, in a new row of `crm.account_table`, or over the existing row `idx`
+        when restoring a checkpoint"""
+        self.crm = crm
         self._name = name
-        self._uid = f"acct-{uuid4()}"
-        self.store_kwargs(**kwargs)
-        self.stage = AccountStage.MQL
+        if idx is None:
+            self.idx = crm.account_table.add(name)
+            self.store_kwargs(**kwargs)
+        else:
+            self.idx = idx
+        # Index of the account in the conversion factor table
+        self._factor_idx = (enum_codes(Country)[self.country], enum_codes(Industry)[self.industry], enum_codes(AccountType)[self.account_type])
         self.marketing:MarketingDpt = marketing
-        self.assigned_salesrep:SalesRep|None = None
-        self.nb_opportunities = 0
-        self.cumulative_opportunity_value = 0
-        self.active_opportunity = 0
-        self.nb_purchases = 0
-        self.cumulative_purchase_value = 0
-        self.active_purchase = 0
+        self.opportunity_id = -1  # row of the active opportunity in crm.opportunities
 
         # Define process parameters        
         self._loprocesses = []
@@ -560,7 +646,7 @@ class Account(BaseAgent):
             OpsIntents.FEEDBACK_AT_COMPLETION.value: self.reply_to_ops_request,
         }
 
-        super().__init__(crm)
+        super().__init__(crm, created_at=created_at)
 
     def reply_to_email_campaign(self, msg):
         """Reply with an 'accept' or 'deny' action to the email campaign message"""
@@ -569,13 +655,13 @@ class Account(BaseAgent):
             # Make decision whether to accept of deny
             convrate = self.mktg_conversion_rates[MktgIntents.EMAIL_CAMPAIGN.value]
             # self.log(f"Conversion Rate of {convrate}")
-            if random.random() <= convrate:
+            if self.draw(msg['intent']) <= convrate:
                 action = Actions.ACCEPT.value
             else:
                 action = Actions.REJECT.value
             # Build reply message
             reply_msg = {
-                'suid': self.uid,
+                'suid': self.aid,
                 'ruid': msg['suid'],
                 'intent': MktgIntents.EMAIL_CAMPAIGN.value,
                 'action': action,
@@ -583,47 +669,36 @@ class Account(BaseAgent):
             # Define the delay to reply
             delay = self.mktg_conversion_delays[MktgIntents.EMAIL_CAMPAIGN.value]
             self.log(f"Will reply to email at {self.env.now + delay:.2f} ({delay} weeks)")
-            yield self.env.timeout(delay)
             # Send reply to marketing inbox
-            yield self.marketing.inbox.put(json.dumps(reply_msg))
-            self.crm.record_transaction(
-                msg=reply_msg,
-                transaction_type='external',
-            )
+            yield from self.deliver_reply(reply_msg, recipient=self.marketing, delay=delay)
             self.log(f"Replied to email campaign with {reply_msg}")
         else:
             yield self.env.timeout(0)
 
     def conversion_rate_factor(self, msg):
-        factor_country = {
-            Country.EU: 1,
-            Country.US: 0.75,
-            Country.CN: 0.66,
-        }
-        factor_industry = {
-            Industry.FoodnBeverage: 1,
-            Industry.ConsumerGoods: 1,
-            Industry.Chemicals: 0.75,
-            Industry.Pharmaceuticals: 0.75
-        }
-        factor_type = {
-            AccountType.SMALL: 0.50,
-            AccountType.MEDIUM: 1.0,
-            AccountType.LARGE: 1.0
-        }
+        """Factor applied to the conversion rate of the request in `msg`, looked up in `conversion_factor_table`"""
+        return self.conversion_factor_table[self._factor_idx + (self.conversion_intent_codes.get(msg['intent'], -1),)]
 
-        if msg['intent'] == SalesIntents.USER_NEED.value:
-            return factor_country.get(self.country, 1)
-        elif msg['intent'] == SalesIntents.PRESENTATION.value:
-            return factor_country.get(self.country, 1)
-        elif msg['intent'] == SalesIntents.BID.value:
-            return  factor_industry.get(self.industry, 1)
-        elif msg['intent'] == SalesIntents.NEGO.value:
-            return  factor_type.get(self.account_type,1)
-        elif msg['intent'] == OpsIntents.FEEDBACK_AT_COMPLETION.value:
-            return  factor_country.get(self.country, 1)
-        else:
-            return 1
+    @classmethod
+    def build_conversion_factor_table(cls):
+        """(Re)build the table of conversion factors from `conversion_factors` and `conversion_factor_dimensions`.
+
+        The table is indexed by country, industry, account type and intent codes. The last intent column
+        is for intents without factor and is always 1. Call after changing the factors, e.g. in a scenario.
+        """
+        intents = list(cls.conversion_factor_dimensions)
+        table = np.ones((len(Country), len(Industry), len(AccountType), len(intents) + 1))
+        for k, intent in enumerate(intents):
+            dimension = cls.conversion_factor_dimensions[intent]
+            axis = {'country': 0, 'industry': 1, 'account_type': 2}[dimension]
+            enum_cls = {'country': Country, 'industry': Industry, 'account_type': AccountType}[dimension]
+            factors = np.array([cls.conversion_factors[dimension].get(m, 1) for m in enum_cls], dtype=float)
+            shape = [1, 1, 1]
+            shape[axis] = len(enum_cls)
+            table[..., k] = factors.reshape(shape)
+        cls.conversion_factor_table = table
+        cls.conversion_intent_codes = {intent: k for k, intent in enumerate(intents)}
+        return table
 
     def reply_to_salesrep_request(self, msg):
         self.log(f"Received sales rep request: {msg}")
@@ -632,25 +707,23 @@ class Account(BaseAgent):
             factor =  self.conversion_rate_factor(msg)
             self.log(f"{convrate} {factor}")
             convrate = min(convrate * factor, 1)
-            if random.random() <= convrate:
-                reply_msg = {'suid': self.uid, 'ruid': msg['suid'], 'intent': msg['intent'], 'action': Actions.ACCEPT.value}
+            if self.draw(msg['intent']) <= convrate:
+                reply_msg = {'suid': self.aid, 'ruid': msg['suid'], 'intent': msg['intent'], 'action': Actions.ACCEPT.value}
                 if msg['intent'] in [SalesIntents.BID.value, SalesIntents.NEGO.value]:
                     self.update_business_value(msg)
             else:
-                reply_msg = {'suid': self.uid, 'ruid': msg['suid'], 'intent': msg['intent'], 'action': Actions.REJECT.value}
+                reply_msg = {'suid': self.aid, 'ruid': msg['suid'], 'intent': msg['intent'], 'action': Actions.REJECT.value}
+                if msg['intent'] == SalesIntents.NEGO.value and self.opportunity_id >= 0:
+                    self.crm.opportunities.close(self.opportunity_id, OpportunityStage.CLOSED_LOST, t=self.env.now)
+                    self.opportunity_id = -1
 
             # Define the delay to reply
             delay = self.sales_conversion_delays.get(msg['intent'], 0.0)
             self.log(f"Will reply to email at {self.env.now + delay:.2f} ({delay} weeks)")
-            yield self.env.timeout(delay)
 
             # Send reply to SalesRep inbox
-            srep = next(sr for sr in self.crm.agents['salesrep'] if sr.uid == msg['suid'])
-            yield srep.inbox.put(json.dumps(reply_msg))
-            self.crm.record_transaction(
-                msg=reply_msg,
-                transaction_type='external',
-            )
+            srep = self.crm.registry[msg['suid']]
+            yield from self.deliver_reply(reply_msg, recipient=srep, delay=delay)
             self.log(f"Replied to {msg['intent']} with {reply_msg}")
         yield self.env.timeout(0)
 
@@ -659,26 +732,45 @@ class Account(BaseAgent):
         if msg['action'] == Actions.REQUEST.value:
             convrate = self.ops_conversion_rates.get(msg['intent'], 0)
             # self.log(f"{convrate}")
-            if random.random() <= convrate:
-                reply_msg = {'suid': self.uid, 'ruid': msg['suid'], 'intent': msg['intent'], 'action': Actions.POSITIVE.value}
+            if self.draw(msg['intent']) <= convrate:
+                reply_msg = {'suid': self.aid, 'ruid': msg['suid'], 'intent': msg['intent'], 'action': Actions.POSITIVE.value}
             else:
-                reply_msg = {'suid': self.uid, 'ruid': msg['suid'], 'intent': msg['intent'], 'action': Actions.NEGATIVE.value}
+                reply_msg = {'suid': self.aid, 'ruid': msg['suid'], 'intent': msg['intent'], 'action': Actions.NEGATIVE.value}
 
             # Define the delay to reply
             delay = self.ops_conversion_delays.get(msg['intent'], 0.0)
             self.log(f"Will reply to email at {self.env.now + delay:.2f} ({delay} weeks)")
-            yield self.env.timeout(delay)
 
             # Send reply to SalesRep inbox
-            srep = next(sr for sr in self.crm.agents['salesrep'] if sr.uid == msg['suid'])
-            yield srep.inbox.put(json.dumps(reply_msg))
-            self.crm.record_transaction(
-                msg=reply_msg,
-                transaction_type='external',
-            )
+            srep = self.crm.registry[msg['suid']]
+            yield from self.deliver_reply(reply_msg, recipient=srep, delay=delay)
             self.log(f"Replied to {msg['intent']} with {reply_msg}")
         yield self.env.timeout(0)
 
+    def draw(self, decision:str, low:float=0.0, high:float=1.0) -> float:
+        """Uniform draw in [low, high] for a decision of the account, e.g. its reply to an intent.
+
+        With common random numbers on (`crm.streams`), each decision of each account has its own stream,
+        so that paired scenarios take the same draws at the same decision points.
+        """
+        if self.crm.streams is None:
+            return random.random() if (low, high) == (0.0, 1.0) else random.uniform(low, high)
+        return self.crm.streams.uniform((self.idx, decision), low, high)
+
+    def deliver_reply(self, reply_msg, recipient, delay):
+        """Send `reply_msg` to the inbox of `recipient` after `delay` weeks.
+
+        The reply is tracked in `crm.pending_replies` until delivered, so that checkpoints can capture it.
+        """
+        self.crm.pending_replies[self.aid] = (self.env.now + delay, recipient.aid, reply_msg)
+        yield self.env.timeout(delay)
+        yield recipient.inbox.put(json.dumps(reply_msg))
+        del self.crm.pending_replies[self.aid]
+        self.crm.record_transaction(
+            msg=reply_msg,
+            transaction_type='external',
+        )
+
     def transition(self, fr:AccountStage, to:AccountStage):
         """Transition the account from one stage to another"""
         if self.stage == fr:
@@ -686,8 +778,8 @@ class Account(BaseAgent):
             self.stage = to
             self.crm.record_transaction(
                 msg={
-                    'suid': self.crm.uid,
-                    'ruid': self.uid,
+                    'suid': self.crm.aid,
+                    'ruid': self.aid,
                     'intent': f"{fr.name} to {to.name}",
                     'action': 'transition',
                 },
@@ -702,17 +794,20 @@ class Account(BaseAgent):
             # Add opportunity value
             self.log(f"Entering add_business_value: {msg['intent']}|{SalesIntents.BID.value}|{SalesIntents.NEGO.value}")
             self.log(f"Current business values: {self.cumulative_opportunity_value:,d} {self.cumulative_purchase_value:,d}")
+            self.crm.dirty_accounts.add(self.aid)
             if msg['intent'] == SalesIntents.BID.value:
                 val_min, val_max = self.opportunity_sizes[self.account_type]
-                val = int(random.uniform(val_min, val_max)/1000)*1000
+                val = int(self.draw(BusinessValues.OPPORTUNITY.value, val_min, val_max)/1000)*1000
                 self.active_opportunity = val
                 self.cumulative_opportunity_value += val
                 self.nb_opportunities += 1
+                salesrep = self.assigned_salesrep.idx if self.assigned_salesrep is not None else -1
+                self.opportunity_id = int(self.crm.opportunities.create(self.idx, val, t=self.env.now, salesreps=salesrep)[0])
                 self.log(f"New opportunity value of {val:,d} of {self.nb_opportunities} adding to {self.cumulative_opportunity_value:,d}")
                 self.crm.record_transaction(
                     msg={
-                        'suid': self.uid,
-                        'ruid': self.assigned_salesrep.uid,
+                        'suid': self.aid,
+                        'ruid': self.assigned_salesrep.aid,
                         'intent': BusinessValues.OPPORTUNITY.value,
                         'action': Actions.FORECAST.value
                     },
@@ -724,10 +819,13 @@ class Account(BaseAgent):
                 self.active_purchase = self.active_opportunity
                 self.cumulative_purchase_value += self.active_purchase
                 self.active_opportunity = 0
+                if self.opportunity_id >= 0:
+                    self.crm.opportunities.close(self.opportunity_id, OpportunityStage.CLOSED_WON, t=self.env.now)
+                    self.opportunity_id = -1
                 self.crm.record_transaction(
                     msg={
-                        'suid': self.uid,
-                        'ruid': self.assigned_salesrep.uid,
+                        'suid': self.aid,
+                        'ruid': self.assigned_salesrep.aid,
                         'intent': BusinessValues.PURCHASE.value,
                         'action': Actions.PURCHASE.value
                     },
@@ -737,12 +835,14 @@ class Account(BaseAgent):
                     
     def store_kwargs(self, **kwargs):
         """Store keyword arguments for account creation."""
-        self.country = kwargs.get("country", Country.EU)
-        if isinstance(self.country, str):
-            self.country = getattr(Country, self.country, Country.EU)
-        self.industry = kwargs.get("industry", Industry.ConsumerGoods)
-        if isinstance(self.industry, str):
-            self.industry = getattr(Industry, self.industry, Industry.ConsumerGoods)
+        country = kwargs.get("country", Country.EU)
+        if isinstance(country, str):
+            country = getattr(Country, country, Country.EU)
+        self.country = country
+        industry = kwargs.get("industry", Industry.ConsumerGoods)
+        if isinstance(industry, str):
+            industry = getattr(Industry, industry, Industry.ConsumerGoods)
+        self.industry = industry
         self.account_type = kwargs.get("account_type", random.choice(list(AccountType)))
         self.lead_source = kwargs.get("lead_source", LeadSource.WEBSITE_CTA)
 
@@ -751,20 +851,30 @@ class Account(BaseAgent):
 
     def __call__(self) -> dict:
         """Return a dictionary representation of the account."""
-        a2drop = ['crm', 'env', 'inbox', 'marketing','category', 'assigned_salesrep', 'sales_conversion_rates']
-        a2drop.extend(['mktg_conversion_rates', 'account_parameters', 'loprocesses',  'ops_conversion_delays'])
-        a2drop.extend(['process_map', 'sales_conversion_delays', 'mktg_conversion_delays', 'ops_conversion_rates'])
-        a2drop.extend(['active_opportunity', 'active_purchase', 'cumulative_opportunities', 'cumulative_purchases','opportunity_sizes'])
-        a2keep = ['assigned_salesrep']
-        attrs = [a for a in dir(self) if not a.startswith('_') and not callable(getattr(self, a))]
-        aoi = set(attrs).difference(set(a2drop)).union(set(a2keep))
-        return {a:getattr(self,a) for a in dir(self) if a in list(aoi)}
+        return {col:getattr(self, col) for col in self.export_schema}
 
     @property
     def name(self) -> str: return self._name
 
     @property
-    def uid(self) -> str: return self._uid
+    def stage(self) -> AccountStage: return self._stage
+
+    @stage.setter
+    def stage(self, stage:AccountStage):
+        self._stage = stage
+        self.crm.account_counters.update(self)
+        self.crm.dirty_accounts.add(self.aid)
+
+    @property
+    def assigned_salesrep(self) -> 'SalesRep|None':
+        idx = self._salesrep
+        return self.crm.get_salesreps()[idx] if idx >= 0 else None
+
+    @assigned_salesrep.setter
+    def assigned_salesrep(self, salesrep:'SalesRep|None'):
+        self._salesrep = salesrep.idx if salesrep is not None else -1
+        self.crm.account_counters.update(self)
+        self.crm.dirty_accounts.add(self.aid)
 
     @property
     def loprocesses(self): return self._loprocesses
@@ -773,6 +883,8 @@ class Account(BaseAgent):
     def process_map(self): return self._process_map
 
 
+Account.build_conversion_factor_table()
+
 
 def accounts_created_before(t, env):
     return [acc for acc in env.accounts if acc.created_at <= t]
@@ -0,0 +1,190 @@
+import math
+import numpy as np
+
+from collections import Counter
+from typing import Optional, Sequence, Tuple
+
+
+class RunningStats:
+    """Mean and variance of a stream of arrays, updated one observation at a time (Welford's algorithm).
+
+    Observations all have the same shape, and NaN values are skipped element-wise. Two instances
+    updated on different streams can be merged, e.g. after running replications in parallel workers.
+    """
+
+    def __init__(self):
+        self.n:Optional[np.ndarray] = None        # nb of observations per element
+        self.mean:Optional[np.ndarray] = None
+        self._m2:Optional[np.ndarray] = None       # sum of squared deviations from the mean
+
+    def _init(self, shape):
+        self.n = np.zeros(shape, dtype=np.int64)
+        self.mean = np.zeros(shape)
+        self._m2 = np.zeros(shape)
+
+    def update(self, x):
+        """Add one observation"""
+        x = np.asarray(x, dtype=float)
+        if self.n is None:
+            self._init(x.shape)
+        elif x.shape != self.mean.shape:
+            raise ValueError(f"Observation of shape {x.shape} does not match shape {self.mean.shape}")
+        valid = ~np.isnan(x)
+        x = np.where(valid, x, 0)
+        self.n = self.n + valid
+        delta = np.where(valid, x - self.mean, 0)
+        self.mean = self.mean + np.divide(delta, self.n, out=np.zeros_like(delta), where=self.n > 0)
+        self._m2 = self._m2 + np.where(valid, delta * (x - self.mean), 0)
+
+    def merge(self, other:'RunningStats') -> 'RunningStats':
+        """Combine the observations of `other` into this instance"""
+        if other.n is None:
+            return self
+        if self.n is None:
+            self.n, self.mean, self._m2 = other.n.copy(), other.mean.copy(), other._m2.copy()
+            return self
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        w = np.divide(other.n, n, out=np.zeros(n.shape), where=n > 0)
+        self.mean = self.mean + delta * w
+        self._m2 = self._m2 + other._m2 + delta**2 * self.n * w
+        self.n = n
+        return self
+
+    @property
+    def variance(self) -> np.ndarray:
+        """Sample variance, NaN where there are less than two observations"""
+        return np.divide(self._m2, self.n - 1, out=np.full(self._m2.shape, np.nan), where=self.n > 1)
+
+    @property
+    def std(self) -> np.ndarray:
+        return np.sqrt(self.variance)
+
+    def ci(self, confidence:float=0.95) -> Tuple[np.ndarray, np.ndarray]:
+        """Student t confidence interval (low, high) of the mean"""
+        from scipy import stats
+
+        n = np.maximum(self.n, 2)
+        half_width = stats.t.ppf((1 + confidence) / 2, n - 1) * self.std / np.sqrt(n)
+        return self.mean - half_width, self.mean + half_width
+
+
+class QuantileSketch:
+    """Mergeable sketch of a stream of values, answering quantile queries with a bounded relative error.
+
+    Values are counted in logarithmic buckets, so that any quantile is estimated within `relative_accuracy`
+    of its true value, in memory growing with the log of the value range rather than with the stream length.
+    Values with a magnitude below `min_value` are counted as 0. NaN values are skipped.
+    """
+
+    def __init__(self, relative_accuracy:float=0.01, min_value:float=1e-9):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.positive = Counter()   # bucket key -> count, for values > 0
+        self.negative = Counter()   # bucket key -> count, for values < 0, keyed by magnitude
+        self.zero = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _key(self, magnitude:float) -> int:
+        return math.ceil(math.log(magnitude) / self._log_gamma)
+
+    def _value(self, key:int) -> float:
+        return 2 * self.gamma**key / (self.gamma + 1)
+
+    def add(self, x:float, weight:int=1):
+        """Add a value `weight` times"""
+        if x != x:
+            return
+        if x > self.min_value:
+            self.positive[self._key(x)] += weight
+        elif x < -self.min_value:
+            self.negative[self._key(-x)] += weight
+        else:
+            self.zero += weight
+        self.count += weight
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+
+    def update(self, values:Sequence[float]):
+        """Add each value of `values`"""
+        for x in values:
+            self.add(float(x))
+
+    def merge(self, other:'QuantileSketch') -> 'QuantileSketch':
+        """Combine the values of `other` into this sketch"""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different relative accuracies")
+        self.positive.update(other.positive)
+        self.negative.update(other.negative)
+        self.zero += other.zero
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q:float) -> float:
+        """Estimate of the `q` quantile, NaN when the sketch is empty"""
+        if self.count == 0:
+            return math.nan
+        rank = q * (self.count - 1)
+        cumulative = 0
+        for key in sorted(self.negative, reverse=True):
+            cumulative += self.negative[key]
+            if cumulative > rank:
+                return max(-self._value(key), self.min)
+        cumulative += self.zero
+        if cumulative > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            cumulative += self.positive[key]
+            if cumulative > rank:
+                return min(self._value(key), self.max)
+        return self.max
+
+    def __len__(self):
+        return self.count
+
+
+class Histogram:
+    """Counts of a stream of arrays of values per bin, for each element of the arrays.
+
+    Bins are delimited by `edges`: bin 0 counts values below edges[0], bin i values in [edges[i-1], edges[i])
+    and the last bin values from edges[-1] on. Histograms with the same edges can be merged.
+    """
+
+    def __init__(self, edges:Sequence[float]):
+        self.edges = np.asarray(edges, dtype=float)
+        self.counts:Optional[np.ndarray] = None     # (*shape, nb of bins)
+
+    def update(self, x):
+        """Add one observation"""
+        x = np.asarray(x, dtype=float)
+        if self.counts is None:
+            self.counts = np.zeros(x.shape + (len(self.edges) + 1,), dtype=np.int64)
+        bins = np.searchsorted(self.edges, x, side='right')
+        valid = ~np.isnan(x)
+        np.add.at(self.counts, tuple(np.nonzero(valid)) + (bins[valid],), 1)
+
+    def merge(self, other:'Histogram') -> 'Histogram':
+        """Combine the counts of `other` into this histogram"""
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("Cannot merge histograms with different edges")
+        if other.counts is not None:
+            self.counts = other.counts.copy() if self.counts is None else self.counts + other.counts
+        return self
+
+    def quantile(self, q:float) -> np.ndarray:
+        """Estimate of the `q` quantile per element, as the upper edge of the bin where it falls
+        (edges[0] below the first bin and edges[-1] past the last one)"""
+        cumulative = np.cumsum(self.counts, axis=-1)
+        rank = q * (cumulative[..., -1:] - 1)
+        idx = (cumulative <= rank).sum(axis=-1)
+        return self.edges[np.clip(idx, 0, len(self.edges) - 1)]
+
+
+if __name__ == "__main__":
+    pass
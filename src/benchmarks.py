@@ -0,0 +1,372 @@
+import importlib
+import io
+import json
+import multiprocessing
+import random
+import resource
+import subprocess
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from contextlib import redirect_stdout
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from enums import AccountStage
+from utils import ROOT
+
+SCALES = (1_000, 10_000, 100_000)
+ENGINES = ('abm', 'stepped', 'sd')
+REFERENCE = 'abm'
+STAGES = [s.name for s in AccountStage]
+BASELINE = ROOT / 'data/benchmark-baseline.json'
+
+# Stocks of the system dynamics model 04-crm and the account stage they hold
+SD_STOCKS = {
+    'mql': AccountStage.MQL,
+    'sql': AccountStage.SQL,
+    'prospects': AccountStage.PROSPECT,
+    'pitched': AccountStage.PITCHED,
+    'bidded': AccountStage.BIDDED,
+    'signed': AccountStage.SIGNED,
+    'active': AccountStage.ACTIVE,
+    'stale': AccountStage.STALE,
+}
+WEEKS_PER_MONTH = 52 / 12
+
+# Bias accepted in the stage shares of the engines meant to reproduce the reference engine, as a mean total variation
+# distance over weeks (see `accuracy_limit`). The SD model has its own calibration (monthly steps, its own rates and
+# decays), so it is only checked against its own baseline.
+ACCURACY_BIAS = {'stepped': 0.02}
+
+
+# =============================================================================
+# Engines
+# =============================================================================
+def book(nb_accounts:int) -> Dict[str, int]:
+    """Settings of a book of about `nb_accounts` accounts, half MQL and SQL, half in later stages
+    (see `setup_accounts`), with one sales rep per 100 accounts"""
+    nb_mql = nb_sql = nb_accounts // 4
+    nb_others = round((nb_accounts - nb_mql - nb_sql) / 2.65)
+    return {'nb_salesreps': max(nb_accounts // 100, 1), 'nb_mql': nb_mql, 'nb_sql': nb_sql, 'nb_others': nb_others}
+
+def _run_abm(nb_accounts:int, until:int, seed:int):
+    from crm import CustomerRelationManagerSimulator
+
+    random.seed(seed)
+    np.random.seed(seed)
+    with redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        crm = CustomerRelationManagerSimulator(**book(nb_accounts))
+        setup = time.perf_counter() - start
+        start = time.perf_counter()
+        crm.run(until=until)
+        wall = time.perf_counter() - start
+    return crm.account_stats_to_df(int_idx=True), len(crm.transactions), setup, wall
+
+def _run_stepped(nb_accounts:int, until:int, seed:int):
+    from stepped import SteppedCRMSimulator
+
+    start = time.perf_counter()
+    sim = SteppedCRMSimulator(seed=seed, **book(nb_accounts))
+    setup = time.perf_counter() - start
+    start = time.perf_counter()
+    sim.run(until=until)
+    wall = time.perf_counter() - start
+    return sim.account_stats_to_df(int_idx=True), sim.nb_events, setup, wall
+
+def _run_sd(nb_accounts:int, until:int, seed:int):
+    """Run the SD model from the same initial book as the other engines, for the months covering `until` weeks,
+    and interpolate its stocks at each week. Its events are the time steps of the model."""
+    from sdmodel import SDModel
+    from stepped import SteppedCRMSimulator
+
+    per_stage = SteppedCRMSimulator(seed=seed, **book(nb_accounts)).account_table.per_stage()
+    start = time.perf_counter()
+    model = SDModel(final_time=int(np.ceil(until / WEEKS_PER_MONTH)))
+    setup = time.perf_counter() - start
+    start = time.perf_counter()
+    results = model.run(initial_condition={stock: per_stage.get(stage, 0) for stock, stage in SD_STOCKS.items()})
+    wall = time.perf_counter() - start
+
+    weeks = np.arange(1, until)
+    months = results.index.to_numpy(dtype=float)
+    df = pd.DataFrame(0.0, index=range(len(weeks)), columns=['timestamp', 'nb_accounts'] + STAGES)
+    df['timestamp'] = weeks
+    for stock, stage in SD_STOCKS.items():
+        df[stage.name] = np.interp(weeks / WEEKS_PER_MONTH, months, results[stock].to_numpy(dtype=float))
+    df['nb_accounts'] = df[STAGES].sum(axis=1)
+    return df, len(results) - 1, setup, wall
+
+# Modules of each engine, imported before measuring the memory of a run
+ENGINE_MODULES = {'abm': ['crm'], 'stepped': ['stepped'], 'sd': ['pysd', 'sdmodel', 'stepped']}
+RUNNERS = {
+    'abm': _run_abm,
+    'stepped': _run_stepped,
+    'sd': _run_sd,
+}
+
+def _peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _in_new_process(func, *args):
+    """Call `func(*args)` in a newly spawned process, so that its memory measures are its own"""
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(processes=1, maxtasksperchild=1) as pool:
+        return pool.apply(func, args)
+
+def _measure(engine:str, nb_accounts:int, until:int, seed:int):
+    """Run `engine` in the current (fresh) process and measure it"""
+    for module in ENGINE_MODULES[engine]:
+        importlib.import_module(module)
+    rss_before = _peak_rss_mb()
+    stats, nb_events, setup, wall = RUNNERS[engine](nb_accounts, until, seed)
+    peak = _peak_rss_mb()
+    record = {
+        'engine': engine, 'nb_accounts': nb_accounts, 'until': until, 'seed': seed,
+        'setup_time': setup, 'wall_time': wall, 'nb_events': nb_events, 'events_per_sec': nb_events / wall if wall > 0 else np.nan,
+        'peak_rss_mb': peak, 'run_rss_mb': peak - rss_before,
+    }
+    return record, stats
+
+def measure(engine:str, nb_accounts:int, until:int=52, seed:int=0):
+    """Run `engine` on a book of `nb_accounts` accounts for `until` weeks, in a new process so that its peak RSS
+    is its own. Returns the measures (times in seconds, memory in MB) and the weekly accounts per stage.
+
+    `peak_rss_mb` is the peak resident memory of the process, `run_rss_mb` its growth during the setup and the run,
+    after the modules of the engine are imported.
+    """
+    if engine not in RUNNERS:
+        raise ValueError(f"Unknown engine '{engine}', expected one of {list(RUNNERS)}")
+    return _in_new_process(_measure, engine, nb_accounts, until, seed)
+
+
+# =============================================================================
+# Distances between stage trajectories
+# =============================================================================
+def stage_shares(stats:pd.DataFrame) -> pd.DataFrame:
+    """Weekly share of the accounts in each stage, in funnel order, from `account_stats_to_df(int_idx=True)`"""
+    counts = stats.set_index('timestamp')[STAGES].astype(float)
+    return counts.div(counts.sum(axis=1).replace(0, np.nan), axis=0).fillna(0)
+
+def trajectory_distances(stats:pd.DataFrame, reference:pd.DataFrame) -> Dict[str, float]:
+    """Distances between the weekly distributions of accounts over stages of two runs, on their common weeks:
+    - tvd: total variation distance between the stage shares, in [0, 1]
+    - emd: earth mover's distance between the stage shares along the funnel, in stages
+    - size_error: relative error on the number of accounts
+    each as its mean and max over weeks, and the values at the last week.
+    """
+    p, q = stage_shares(stats), stage_shares(reference)
+    weeks = p.index.intersection(q.index)
+    p, q = p.loc[weeks].to_numpy(), q.loc[weeks].to_numpy()
+    tvd = 0.5 * np.abs(p - q).sum(axis=1)
+    emd = np.abs(np.cumsum(p, axis=1) - np.cumsum(q, axis=1)).sum(axis=1)
+    a = stats.set_index('timestamp').loc[weeks, STAGES].sum(axis=1).to_numpy(dtype=float)
+    b = reference.set_index('timestamp').loc[weeks, STAGES].sum(axis=1).to_numpy(dtype=float)
+    size_error = np.abs(a - b) / np.maximum(b, 1)
+    return {
+        'tvd_mean': tvd.mean(), 'tvd_max': tvd.max(), 'tvd_last': tvd[-1],
+        'emd_mean': emd.mean(), 'emd_max': emd.max(), 'emd_last': emd[-1],
+        'size_error_max': size_error.max(), 'size_error_last': size_error[-1],
+    }
+
+
+def accuracy_limit(engine:str, nb_accounts:int) -> float:
+    """Largest mean total variation distance to the reference accepted for `engine` at `nb_accounts` accounts:
+    its bias in `ACCURACY_BIAS`, plus the sampling noise of single runs, which decreases as 1/sqrt(nb_accounts)"""
+    return ACCURACY_BIAS[engine] + 1 / np.sqrt(nb_accounts)
+
+
+# =============================================================================
+# Suite
+# =============================================================================
+def run_suite(scales:Sequence[int]=SCALES, engines:Sequence[str]=ENGINES, until:int=52, seed:int=0, verbose=True) -> pd.DataFrame:
+    """Run each of `engines` at each of `scales` (number of accounts), and compare its stage trajectories to the
+    ones of the `REFERENCE` engine at the same scale, run first.
+
+    Returns one row per scale and engine with the measures of `measure` and the distances of `trajectory_distances`
+    (NaN for the reference engine itself). Each run is in its own process.
+    """
+    engines = [REFERENCE] + [e for e in engines if e != REFERENCE]
+    rows = []
+    for n in scales:
+        reference = None
+        for engine in engines:
+            record, stats = measure(engine, n, until=until, seed=seed)
+            if engine == REFERENCE:
+                reference = stats
+            else:
+                record.update(trajectory_distances(stats, reference))
+            if verbose:
+                print(f"{engine:>12} {n:>8} accounts: {record['wall_time']:8.2f}s, {record['events_per_sec']:10.0f} events/s, "
+                      f"{record['peak_rss_mb']:7.0f} MB, tvd {record.get('tvd_mean', 0):.3f}")
+            rows.append(record)
+    return pd.DataFrame(rows)
+
+def check_regressions(results:pd.DataFrame, baseline:Optional[pd.DataFrame]=None, time_tolerance:float=1.5,
+                      rss_tolerance:float=1.3, accuracy_tolerance:float=0.02, min_time:float=0.1) -> List[str]:
+    """Accuracy and performance regressions in the `results` of `run_suite`, as a list of messages (empty if none):
+    - engines of `ACCURACY_BIAS` whose mean total variation distance to the reference exceeds `accuracy_limit`
+    - when a `baseline` (earlier results) is given, runs at the same scale and horizon that are more than
+      `time_tolerance` times slower (and by more than `min_time` seconds, to ignore the jitter of short runs),
+      use more than `rss_tolerance` times the peak memory, or whose mean total variation distance grew by more
+      than `accuracy_tolerance`
+    """
+    failures = []
+    for r in results.itertuples():
+        if r.engine in ACCURACY_BIAS and r.tvd_mean > accuracy_limit(r.engine, r.nb_accounts):
+            failures.append(f"{r.engine} at {r.nb_accounts} accounts: tvd {r.tvd_mean:.3f} to {REFERENCE}, "
+                            f"limit {accuracy_limit(r.engine, r.nb_accounts):.3f}")
+    if baseline is None:
+        return failures
+
+    keys = ['engine', 'nb_accounts', 'until']
+    df = results.merge(baseline, on=keys, suffixes=('', '_base'))
+    for r in df.itertuples():
+        run = f"{r.engine} at {r.nb_accounts} accounts"
+        if r.wall_time > time_tolerance * r.wall_time_base and r.wall_time - r.wall_time_base > min_time:
+            failures.append(f"{run}: {r.wall_time:.2f}s, baseline {r.wall_time_base:.2f}s")
+        if r.peak_rss_mb > rss_tolerance * r.peak_rss_mb_base:
+            failures.append(f"{run}: peak RSS {r.peak_rss_mb:.0f} MB, baseline {r.peak_rss_mb_base:.0f} MB")
+        if r.tvd_mean > r.tvd_mean_base + accuracy_tolerance:
+            failures.append(f"{run}: tvd {r.tvd_mean:.3f} to {REFERENCE}, baseline {r.tvd_mean_base:.3f}")
+    return failures
+
+def save_baseline(results:pd.DataFrame, path:Path=BASELINE):
+    Path(path).write_text(json.dumps(results.to_dict(orient='records'), indent=2, default=float))
+
+def load_baseline(path:Path=BASELINE) -> Optional[pd.DataFrame]:
+    path = Path(path)
+    return pd.DataFrame(json.loads(path.read_text())) if path.is_file() else None
+
+
+# =============================================================================
+# Scaling of CustomerRelationManagerSimulator
+# =============================================================================
+SCALING_SPACE = {
+    'nb_salesreps': [5, 20, 80],
+    'nb_mql': [100, 400],
+    'nb_sql': [100, 400],
+    'nb_others': [40, 160],
+    'until': [26, 52],
+}
+PHASES = ('init', 'run', 'transactions_to_df', 'account_df', 'plot_data')
+HISTORY = ROOT / 'data/benchmark-history.jsonl'
+
+def _time_phases(case:Dict[str, int], seed:int) -> dict:
+    """Time each phase of a simulation with the settings `case` (constructor arguments and `until`), with the peak
+    RSS of the process after each phase"""
+    from crm import CustomerRelationManagerSimulator
+
+    init = {k: v for k, v in case.items() if k != 'until'}
+    record = {**case, 'seed': seed, 'start_rss_mb': _peak_rss_mb()}
+    random.seed(seed)
+    np.random.seed(seed)
+    crm = None
+    phases = {
+        'init': lambda: CustomerRelationManagerSimulator(**init),
+        'run': lambda: crm.run(until=case['until']),
+        'transactions_to_df': lambda: crm.transactions_to_df(),
+        'account_df': lambda: crm.account_df(),
+        'plot_data': lambda: crm.account_stats_plot_df(),
+    }
+    with redirect_stdout(io.StringIO()):
+        for phase in PHASES:
+            start = time.perf_counter()
+            result = phases[phase]()
+            record[f"{phase}_time"] = time.perf_counter() - start
+            record[f"{phase}_rss_mb"] = _peak_rss_mb()
+            if phase == 'init':
+                crm = result
+                record['nb_accounts'] = len(crm.get_accounts())
+    record.update({'nb_accounts_end': len(crm.get_accounts()), 'nb_transactions': len(crm.transactions)})
+    return record
+
+def time_scaling(space:Dict[str, Sequence[int]]=SCALING_SPACE, seed:int=0, repeat:int=1, verbose=True) -> pd.DataFrame:
+    """Time the phases of the simulation (`PHASES`) for each combination of the settings in `space`, each in a new
+    process. With `repeat` > 1, keeps the fastest of the repeats for each phase, and the largest memory.
+
+    Returns one row per case, with the time (s) and the peak RSS of the process after each phase (MB), and the
+    number of accounts at the start and the end of the run and of transactions.
+    """
+    from sweep import grid_design
+
+    rows = []
+    for case in grid_design(space):
+        records = [_in_new_process(_time_phases, case, seed) for _ in range(repeat)]
+        runs = pd.DataFrame(records)
+        record = records[0]
+        record.update(runs.filter(like='_time').min().to_dict())
+        record.update(runs.filter(like='_rss_mb').max().to_dict())
+        if verbose:
+            print(', '.join(f"{k}={v}" for k, v in case.items()), '->', ', '.join(f"{p} {record[f'{p}_time']:.3f}s" for p in PHASES))
+        rows.append(record)
+    return pd.DataFrame(rows)
+
+def fit_exponents(results:pd.DataFrame, factors:Sequence[str]=('nb_salesreps', 'nb_accounts', 'until')) -> pd.DataFrame:
+    """Empirical complexity of each phase: least squares fit of log(time) = c + sum of b_f log(f) over the `factors`
+    that vary in `results` (see `time_scaling`). Returns the exponents b_f per phase, and the R² of each fit."""
+    factors = [f for f in factors if results[f].nunique() > 1]
+    X = np.column_stack([np.ones(len(results))] + [np.log(results[f].to_numpy(dtype=float)) for f in factors])
+    rows = {}
+    for phase in PHASES:
+        y = np.log(np.maximum(results[f"{phase}_time"].to_numpy(dtype=float), 1e-9))
+        coefs, *_ = np.linalg.lstsq(X, y, rcond=None)
+        residuals = y - X @ coefs
+        r2 = 1 - residuals.var() / y.var() if y.var() > 0 else 1.0
+        rows[phase] = {**dict(zip(factors, coefs[1:])), 'r2': r2}
+    return pd.DataFrame(rows).T
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def record_history(results:pd.DataFrame, path:Path=HISTORY, label:Optional[str]=None) -> pd.DataFrame:
+    """Append the `results` of `time_scaling` to the history file, one json line per case, with the time of the
+    record, the current git commit and an optional `label` (e.g. the optimization being measured)"""
+    results = results.assign(recorded_at=datetime.now().isoformat(timespec='seconds'), commit=_git_commit(), label=label)
+    with open(path, 'a') as f:
+        for record in results.to_dict(orient='records'):
+            f.write(json.dumps(record, default=float) + '\n')
+    return results
+
+def load_history(path:Path=HISTORY) -> pd.DataFrame:
+    path = Path(path)
+    return pd.read_json(path, lines=True) if path.is_file() and path.stat().st_size else pd.DataFrame()
+
+def compare_to_history(results:pd.DataFrame, history:pd.DataFrame, keys:Sequence[str]=tuple(SCALING_SPACE)) -> pd.DataFrame:
+    """Time of each phase of `results` relative to the last recorded run of the same case in `history`
+    (ratio above 1: slower). Cases without history are left out."""
+    if history.empty:
+        return pd.DataFrame(columns=list(keys) + [f"{p}_ratio" for p in PHASES])
+    times = [f"{p}_time" for p in PHASES]
+    last = history.sort_values('recorded_at').groupby(list(keys), as_index=False).last()[list(keys) + times + ['commit']]
+    df = results[list(keys) + times].merge(last, on=list(keys), suffixes=('', '_base'))
+    for phase in PHASES:
+        df[f"{phase}_ratio"] = df[f"{phase}_time"] / df[f"{phase}_time_base"]
+    return df[list(keys) + ['commit'] + [f"{p}_ratio" for p in PHASES]]
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['scaling']:
+        # Scaling sweep: comparison to the last recorded runs, complexity summary, then added to the history
+        results = time_scaling()
+        print(compare_to_history(results, load_history()).to_string())
+        print(fit_exponents(results).round(2).to_string())
+        record_history(results)
+        sys.exit(0)
+
+    # Full suite, checked against the baseline, which is recorded on the first run. Exits with 1 on regressions
+    results = run_suite()
+    baseline = load_baseline()
+    failures = check_regressions(results, baseline)
+    if baseline is None:
+        save_baseline(results)
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    sys.exit(1 if failures else 0)
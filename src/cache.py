@@ -0,0 +1,171 @@
+import gzip
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import pandas as pd
+
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # no file locks on Windows, eviction is then not protected against concurrent evictions
+    fcntl = None
+
+from utils import ROOT
+
+CACHE_DIR = ROOT / '.cache/results'
+
+
+@lru_cache(maxsize=None)
+def code_version() -> str:
+    """Hash of the source code of the simulator, so that cached results are invalidated when the code changes"""
+    h = hashlib.sha256()
+    for p in sorted(Path(__file__).parent.glob('*.py')):
+        h.update(p.name.encode())
+        h.update(p.read_bytes())
+    return h.hexdigest()[:16]
+
+@lru_cache(maxsize=None)
+def file_hash(path:Path) -> str:
+    """Hash of the content of a file, e.g. a model file"""
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()[:16]
+
+
+class ResultCache:
+    """On-disk cache of simulation results, keyed by a canonical hash of everything that defines a run.
+
+    Each entry is a dict of DataFrames stored as a compressed pickle. Entries are written atomically,
+    so concurrent readers and writers never see partial entries. When the cache exceeds `max_bytes`,
+    the least recently used entries are evicted.
+    """
+
+    def __init__(self, root:Path|str=CACHE_DIR, max_bytes:int=1 << 30):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    def key(self, kind:str, params:Dict[str, Any], horizon:float, seed:Optional[int]=None, model_file:Optional[Path]=None) -> str:
+        """Canonical hash of a run: kind of simulator, parameters, model file, horizon, seed and code version"""
+        spec = {
+            'kind': kind,
+            'params': params,
+            'horizon': horizon,
+            'seed': seed,
+            'model': file_hash(Path(model_file)) if model_file is not None else None,
+            'code': code_version(),
+        }
+        canonical = json.dumps(spec, sort_keys=True, default=str)
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def path(self, key:str) -> Path:
+        return self.root / key[:2] / f"{key}.pkl.gz"
+
+    def get(self, key:str) -> Optional[Dict[str, pd.DataFrame]]:
+        """Return the cached frames for `key`, or None when not in cache"""
+        p = self.path(key)
+        try:
+            with gzip.open(p, 'rb') as f:
+                frames = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(p)  # mark as recently used
+        except FileNotFoundError:
+            pass
+        return frames
+
+    def put(self, key:str, frames:Dict[str, pd.DataFrame]):
+        """Store `frames` for `key`, then evict least recently used entries if the cache is too large"""
+        p = self.path(key)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=p.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as f:
+                pickle.dump(frames, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, p)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        self.evict()
+
+    @contextmanager
+    def _lock(self):
+        """Exclusive lock on the cache, across processes"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.root / '.lock', 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def entries(self):
+        """List of (last use time, size, path) of all entries"""
+        entries = []
+        for p in self.root.glob('*/*.pkl.gz'):
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        return entries
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in `max_bytes`"""
+        with self._lock():
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, p in entries:
+                if total <= self.max_bytes:
+                    break
+                p.unlink(missing_ok=True)
+                total -= size
+
+    def clear(self):
+        with self._lock():
+            for _, _, p in self.entries():
+                p.unlink(missing_ok=True)
+
+    def __contains__(self, key:str):
+        return self.path(key).is_file()
+
+
+def run_abm_cached(params:Dict[str, Any], until:int, seed:int, cache:Optional[ResultCache]=None) -> Dict[str, pd.DataFrame]:
+    """Run an agent based scenario (see `scenarios.run_scenario`), or return its results from the cache.
+
+    A seed is required, as results of unseeded runs cannot be reproduced.
+    """
+    from scenarios import collect_results, run_scenario
+
+    cache = cache or ResultCache()
+    key = cache.key('abm', params=params, horizon=until, seed=seed)
+    frames = cache.get(key)
+    if frames is None:
+        frames = run_scenario(params, until=until, seed=seed, collect=lambda crm: collect_results(crm, start=0))
+        cache.put(key, frames)
+    return frames
+
+def run_sd_cached(params:Dict[str, Any], final_time:int, p2model:Optional[Path]=None, cache:Optional[ResultCache]=None) -> pd.DataFrame:
+    """Run the system dynamics model with `params` (see `SDModel.run`), or return its results from the cache"""
+    from sdmodel import SDModel
+
+    cache = cache or ResultCache()
+    p2model = Path(p2model) if p2model is not None else SDModel.p2model
+    key = cache.key('sd', params=params, horizon=final_time, model_file=p2model)
+    frames = cache.get(key)
+    if frames is None:
+        model = SDModel(p2model=p2model if p2model != SDModel.p2model else None, final_time=final_time)
+        frames = {'results': model.run(params=params)}
+        cache.put(key, frames)
+    return frames['results']
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,281 @@
+import copy
+import gzip
+import io
+import pickle
+import random
+import numpy as np
+import simpy
+
+from contextlib import redirect_stdout
+from pathlib import Path
+from typing import Generator, List, Optional, Tuple
+
+import agents
+from agents import Account, SalesRep
+from counters import AccountCounters
+from registry import AgentRegistry
+from streams import RandomStreams
+from utils import account_info_generator, salesrep_name_generator
+
+CHECKPOINT_VERSION = 4
+
+# Agent attributes captured in a checkpoint, on top of the ones passed to the agent constructors.
+# The state of accounts stored in crm.account_table is captured with the table.
+MARKETING_ATTRS = ['aid', 'created_at', 'marketing_parameters', 'next_campaign_at', 'next_industry_event_at']
+SALESREP_ATTRS = ['aid', 'idx', 'created_at', 'wkly_review_needs', 'wkly_request_for_presentation', 'wkly_request_for_bid', 'wkly_request_for_nego', 'wkly_completion_handover']
+ACCOUNT_ATTRS = ['aid', 'opportunity_id', 'account_parameters']
+# Simulation parameters defined at class or module level
+ACCOUNT_PARAMETERS = [
+    'mktg_conversion_rates', 'mktg_conversion_delays', 'sales_conversion_rates', 'sales_conversion_delays',
+    'ops_conversion_rates', 'ops_conversion_delays', 'conversion_factors', 'conversion_factor_dimensions', 'opportunity_sizes',
+]
+MODULE_PARAMETERS = ['LEAD_CONVERSION_RATES', 'DELAY_RANGES']
+# Processes that act before waiting for the next week, resumed with a wait until their event in the original queue.
+# The other processes start with their wait, computed from their captured state.
+RESUMED_LOOPS = ['request_user_need_discovery', 'request_meeting_for_presentation', 'request_invitation_to_bid', 'request_negotiation', 'request_project_feedback']
+
+
+def process_key(generator:Generator, crm) -> Optional[Tuple]:
+    """Key of the process running `generator` across a checkpoint: id of its agent (or crm) and name of its method,
+    with the index of the burst for lead bursts. None for processes outside of the simulation (profiler, metrics)."""
+    f_locals = generator.gi_frame.f_locals
+    if generator.__name__ == 'instrument':  # process wrapped by instrument.Profiler
+        return process_key(f_locals['generator'], crm)
+    aid = getattr(f_locals.get('self'), 'aid', None)
+    if aid is None:
+        return None
+    if 'burst' in f_locals:  # see crm.schedule_lead_burst
+        return (aid, generator.__name__, next(i for i, burst in enumerate(crm.scheduled_bursts) if burst is f_locals['burst']))
+    return (aid, generator.__name__)
+
+def pending_events(env:simpy.Environment) -> List[Tuple[float, Generator]]:
+    """(time, generator) of the processes waiting for a scheduled event of `env`, in the order the events will be
+    dispatched. Processes waiting for an item in a store have no scheduled event and are left out."""
+    pending = []
+    for t, _, _, event in sorted(env._queue, key=lambda entry: entry[:3]):
+        for callback in event.callbacks or []:
+            if isinstance(getattr(callback, '__self__', None), simpy.Process):
+                pending.append((t, callback.__self__._generator))
+    return pending
+
+def resume_at(env, t:float, generator:Generator):
+    """Process running `generator` from the time `t`"""
+    yield env.timeout(t - env.now)
+    yield from generator
+
+
+class DeferredProcesses:
+    """Collects the processes started in `env` instead of starting them, until `start`, so that the processes
+    started by the agent constructors of a restored simulation can be started in their original order"""
+
+    def __init__(self, env:simpy.Environment):
+        self.env = env
+        self.generators:List[Generator] = []
+        env.process = self.generators.append
+
+    def start(self, crm, schedule:List[Tuple[float, Tuple]]):
+        """Start the collected processes: first the ones with an event in the original queue (`schedule`), in the
+        order of their events so that events due at the same time are dispatched in the same order, then the
+        processes waiting for messages"""
+        del self.env.process
+        generators = {process_key(generator, crm): generator for generator in self.generators}
+        for t, key in schedule:
+            generator = generators.pop(key, None)
+            if generator is not None:
+                self.env.process(resume_at(self.env, t, generator) if key[1] in RESUMED_LOOPS else generator)
+        for generator in generators.values():
+            self.env.process(generator)
+
+
+def capture_state(crm) -> dict:
+    """Capture the state of the simulation as a dict of plain python objects.
+
+    Simpy processes cannot be pickled, so the state captures what they are waiting for instead:
+    messages in the inboxes, replies not yet delivered, time of the next campaign or event,
+    arrivals and lead bursts not yet injected, and the order of their events in the queue.
+    Checkpoints are taken on week boundaries, when all weekly processes are due.
+    """
+    now = crm.env.now
+    if not float(now).is_integer():
+        raise ValueError(f"Checkpoints must be taken on week boundaries, simulation time is {now}")
+    return {
+        'version': CHECKPOINT_VERSION,
+        'now': now,
+        'crm': {
+            'aid': crm.aid,
+            'registry': crm.registry.state(),
+            'stats_dimensions': crm.account_counters.dimensions,
+            'batch_arrivals': crm.batch_arrivals,
+            'industry_events': crm.marketing.industry_events,
+            'mql_arrival_rate': crm.mql_arrival_rate,
+            'account_info_seed': crm.account_info_seed,
+            'nb_account_infos': crm.nb_account_infos,
+            'nb_agents_created': dict(crm.nb_agents_created),
+        },
+        'parameters': {
+            'Account': {p: getattr(Account, p) for p in ACCOUNT_PARAMETERS},
+            'agents': {p: getattr(agents, p) for p in MODULE_PARAMETERS},
+        },
+        'marketing': {a: getattr(crm.marketing, a) for a in MARKETING_ATTRS},
+        'salesreps': [
+            {'name': sr.name, **{a: getattr(sr, a) for a in SALESREP_ATTRS}} for sr in crm.get_salesreps()
+        ],
+        'accounts': [
+            {'name': a.name, 'idx': a.idx, 'created_at': a.created_at, **{attr: getattr(a, attr) for attr in ACCOUNT_ATTRS}}
+            for a in crm.get_accounts()
+        ],
+        'account_table': copy.deepcopy(crm.account_table),
+        'inboxes': {
+            agent.aid: list(agent.inbox.items)
+            for category in crm.agents.values() for agent in category if agent.inbox.items
+        },
+        'schedule': [(t, key) for t, generator in pending_events(crm.env) if (key := process_key(generator, crm)) is not None],
+        'requests_in_progress': [a.aid for a in crm.requests_in_progress],
+        'pending_replies': dict(crm.pending_replies),
+        'opportunities': copy.deepcopy(crm.opportunities),
+        'dirty_accounts': sorted(crm.dirty_accounts),
+        'pending_arrivals': crm.pending_arrivals,
+        'next_arrival_at': crm.next_arrival_at,
+        'scheduled_bursts': list(crm.scheduled_bursts),
+        'logs': {
+            'transactions': list(crm.transactions),
+            'account_stats': list(getattr(crm, 'account_stats', [])),
+            'account_stats_by': {dim: list(records) for dim, records in crm.account_stats_by.items()},
+        },
+        'rng': {
+            'random': random.getstate(),
+            'numpy': np.random.get_state(),
+            'streams': crm.streams.state() if crm.streams is not None else None,
+        },
+    }
+
+
+def restore_state(state:dict, cls=None):
+    """Rebuild a simulation from a state captured by `capture_state`, and rebuild its event queue in the same order,
+    so that the simulation continues exactly as the original one"""
+    if cls is None:
+        from crm import CustomerRelationManagerSimulator as cls
+    if state['version'] != CHECKPOINT_VERSION:
+        raise ValueError(f"Unsupported checkpoint version {state['version']}, expected {CHECKPOINT_VERSION}")
+    now = state['now']
+
+    # Simulation parameters
+    for p, value in state['parameters']['Account'].items():
+        setattr(Account, p, copy.deepcopy(value))
+    Account.build_conversion_factor_table()
+    for p, value in state['parameters']['agents'].items():
+        setattr(agents, p, copy.deepcopy(value))
+
+    # CRM and agents, created in the same order as in the original simulation
+    crm = cls.__new__(cls)
+    env = simpy.Environment(initial_time=now)
+    deferred = DeferredProcesses(env)
+    crm.setup_crm(
+        stats_dimensions=state['crm']['stats_dimensions'],
+        batch_arrivals=state['crm']['batch_arrivals'],
+        industry_events=state['crm']['industry_events'],
+        env=env,
+    )
+    crm.mql_arrival_rate = state['crm']['mql_arrival_rate']
+    for attr, value in state['marketing'].items():
+        setattr(crm.marketing, attr, copy.deepcopy(value))
+
+    for s in state['salesreps']:
+        salesrep = SalesRep(crm=crm, name=s['name'])
+        for attr in SALESREP_ATTRS:
+            setattr(salesrep, attr, s[attr])
+    salesreps = {sr.aid: sr for sr in crm.get_salesreps()}
+    crm.salesrep_name_gen = salesrep_name_generator(start=len(salesreps) + 1)
+
+    crm.account_info_seed = state['crm']['account_info_seed']
+    crm.nb_account_infos = state['crm']['nb_account_infos']
+    crm.account_info_gen = account_info_generator(random_state=crm.account_info_seed, start=crm.nb_account_infos)
+
+    # Accounts are views over the rows of the restored account table
+    crm.account_table = copy.deepcopy(state['account_table'])
+    for a in state['accounts']:
+        account = Account(crm=crm, name=a['name'], marketing=crm.marketing, created_at=a['created_at'], idx=a['idx'])
+        for attr in ACCOUNT_ATTRS:
+            setattr(account, attr, copy.deepcopy(a[attr]))
+        crm.account_table.aid[account.idx] = account.aid
+    accounts = {a.aid: a for a in crm.get_accounts()}
+    crm.nb_agents_created = dict(state['crm']['nb_agents_created'])
+    crm.dirty_accounts = set(state['dirty_accounts'])
+    crm.opportunities = copy.deepcopy(state['opportunities'])
+
+    # Registry and counters are keyed by id, rebuild them now that agents have their original id and state
+    crm.aid = state['crm']['aid']
+    crm.registry = AgentRegistry.restore(state['crm']['registry'], [crm, crm.marketing, *salesreps.values(), *accounts.values()])
+    crm.account_counters = AccountCounters(dimensions=state['crm']['stats_dimensions'])
+    for account in accounts.values():
+        crm.account_counters.add(account)
+
+    # In-flight messages and requests
+    for aid, items in state['inboxes'].items():
+        crm.registry[aid].inbox.items.extend(items)
+    crm.requests_in_progress = [accounts[aid] for aid in state['requests_in_progress']]
+    for aid, (due, recipient_aid, reply_msg) in state['pending_replies'].items():
+        account = accounts[aid]
+        account.resume = account.deliver_reply(reply_msg, recipient=crm.registry[recipient_aid], delay=due - now)
+    crm.pending_arrivals = state['pending_arrivals']
+    crm.next_arrival_at = state['next_arrival_at']
+    for burst in state['scheduled_bursts']:
+        crm.schedule_lead_burst(**burst)
+
+    # Logs
+    crm.transactions = state['logs']['transactions']
+    crm.account_stats = state['logs']['account_stats']
+    crm.account_stats_by = state['logs']['account_stats_by']
+
+    # Top level processes, with the next account stats at the time of their event in the original queue
+    due = {key: t for t, key in state['schedule']}
+    crm.start_processes(stats_delay=due[(crm.aid, 'record_accounts_stats')] - now)
+    deferred.start(crm, state['schedule'])
+
+    random.setstate(state['rng']['random'])
+    np.random.set_state(state['rng']['numpy'])
+    crm.streams = RandomStreams.restore(state['rng']['streams']) if state['rng']['streams'] is not None else None
+    return crm
+
+
+def save_checkpoint(crm, path:Path|str):
+    """Save the state of the simulation in a compressed pickle file at `path`"""
+    state = capture_state(crm)
+    with gzip.open(Path(path), 'wb', compresslevel=6) as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_checkpoint(path:Path|str, cls=None):
+    """Load a simulation from the checkpoint file at `path`, ready to continue with `run`"""
+    with gzip.open(Path(path), 'rb') as f:
+        state = pickle.load(f)
+    return restore_state(state, cls=cls)
+
+
+def check_round_trip(at:int=10, until:int=30, seed:int=0, **init) -> bool:
+    """Check that a simulation saved at week `at` and restored continues exactly as the original one until week
+    `until`: same transactions, weekly stats and accounts. `init` are the arguments of the simulation."""
+    from crm import CustomerRelationManagerSimulator
+
+    random.seed(seed)
+    np.random.seed(seed)
+    with redirect_stdout(io.StringIO()):
+        crm = CustomerRelationManagerSimulator(**init)
+        crm.run(until=at)
+        state = pickle.dumps(capture_state(crm), protocol=pickle.HIGHEST_PROTOCOL)
+        crm.run(until=until)
+        restored = restore_state(pickle.loads(state))
+        restored.run(until=until)
+    return (
+        restored.transactions == crm.transactions
+        and restored.account_stats == crm.account_stats
+        and restored.account_stats_by == crm.account_stats_by
+        and restored.account_df().equals(crm.account_df())
+    )
+
+
+if __name__ == "__main__":
+    for crn_seed in [None, 7]:
+        for options in [{}, {'batch_arrivals': True, 'industry_events': True, 'stats_dimensions': ['account_type']}]:
+            ok = check_round_trip(crn_seed=crn_seed, **options)
+            print(f"crn_seed={crn_seed!s:<5} {options}: {'ok' if ok else 'DIFFERS'}")
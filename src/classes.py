@@ -1,3 +1,4 @@
+import itertools
 import sys
 from pathlib import Path
 from uuid import uuid4
@@ -7,6 +8,20 @@ from utils import draw_value_beta
 
 
 class Account:
+
+    # Export schema: column -> (attribute path, kind), see utils.snapshot_df
+    export_schema = {
+        'account_type': ('account_type', AccountType),
+        'country': ('country', None),
+        'created': ('created', None),
+        'industry': ('industry', None),
+        'lead_source': ('lead_source', LeadSource),
+        'name': ('name', None),
+        'sales_rep': ('sales_rep.uid', None),
+        'stage': ('stage', AccountStage),
+        'uid': ('uid', None),
+    }
+
     def __init__(self, 
                  env, 
                  name,
@@ -34,18 +49,30 @@ class Account:
 
     def __call__(self) -> dict:
         """Return a dictionary representation of the account."""
-        attrs_2_include = [a for a in dir(self) if not a.startswith('_') and not callable(getattr(self, a))] + ['sales_rep']
-        return {a:getattr(self,a) for a in attrs_2_include}
+        return {col:getattr(self, col) for col in self.export_schema}
 
 
 class Opportunity:
     
+    _ids = itertools.count()  # dense integer ids, cheaper to store and compare than uuids
+
     _osizes = {
         AccountType.SMALL:{'val_min': 10_000, 'val_max': 100_000},
         AccountType.MEDIUM:{'val_min': 100_000, 'val_max': 500_000},
         AccountType.LARGE:{'val_min': 500_000, 'val_max': 2_000_000},
     }
 
+    # Export schema: column -> (attribute path, kind), see utils.snapshot_df
+    export_schema = {
+        'account': ('account', None),
+        'created_at': ('created_at', None),
+        'id': ('id', None),
+        'name': ('name', None),
+        'source': ('source', LeadSource),
+        'stage': ('stage', OpportunityStage),
+        'value': ('value', 'int64'),
+    }
+
     def __init__(
         self, 
         env,
@@ -60,7 +87,7 @@ class Opportunity:
         self.name = name
         self.stage = stage
         self.source = source if source else account.lead_source
-        self.id = uuid4()
+        self.id = next(self._ids)
         self.created_at = env.now
         self.value = self.draw_value()
 
@@ -76,14 +103,18 @@ class Opportunity:
 
     def __call__(self) -> dict:
         """Return a dictionary representation of the opportunity."""
-        attrs = set([a for a in dir(self) if not a.startswith('_') and not callable(getattr(self, a))])
-        attrs_2_exclude = set(['env'])           # exclude 
-        attrs_2_include = set(['account'])      # callable classes to still include
-        attrs = sorted(list(attrs.difference(attrs_2_exclude).union(attrs_2_include)))
-        return {a:getattr(self,a) for a in attrs}
+        return {col:getattr(self, col) for col in self.export_schema}
 
 
 class SalesRep:
+
+    # Export schema: column -> (attribute path, kind), see utils.snapshot_df
+    export_schema = {
+        'created': ('created', None),
+        'name': ('name', None),
+        'uid': ('uid', None),
+    }
+
     def __init__(self, env, name):
         self.env = env
         self.name = name
@@ -94,5 +125,5 @@ class SalesRep:
         return f"SalesRep(name={self.name} uid={self.uid})"
 
     def __call__(self) -> dict:
-        """Return a dictionary representation of the account."""
-        return {a:getattr(self,a) for a in dir(self) if not a.startswith('_') and not callable(getattr(self, a))}
\ No newline at end of file
+        """Return a dictionary representation of the sales rep."""
+        return {col:getattr(self, col) for col in self.export_schema}
@@ -0,0 +1,77 @@
+from collections import Counter
+from typing import Dict, Sequence
+
+from enums import AccountStage
+
+
+class AccountCounters:
+    """Number of accounts per stage, maintained incrementally as accounts are added, removed or updated.
+
+    Accounts are counted per key (stage, *dimensions), so that weekly stats only sum over the keys
+    instead of scanning all accounts. Optional dimensions are:
+    - 'salesrep': name of the assigned sales rep (None when not assigned)
+    - 'lead_source': LeadSource of the account
+    - 'account_type': AccountType of the account
+    """
+
+    dimension_getters = {
+        'salesrep': lambda a: a.assigned_salesrep.name if a.assigned_salesrep is not None else None,
+        'lead_source': lambda a: a.lead_source,
+        'account_type': lambda a: a.account_type,
+    }
+
+    def __init__(self, dimensions:Sequence[str]=()):
+        unknown = set(dimensions).difference(self.dimension_getters)
+        if unknown:
+            raise ValueError(f"Unknown stats dimensions {sorted(unknown)}, expected some of {list(self.dimension_getters)}")
+        self.dimensions = tuple(dimensions)
+        self._getters = [self.dimension_getters[d] for d in self.dimensions]
+        self.counts = Counter()     # key -> nb of accounts
+        self._keys = {}             # account id -> current key of the account
+
+    def key(self, account) -> tuple:
+        return (account.stage,) + tuple(getter(account) for getter in self._getters)
+
+    def add(self, account):
+        """Start counting an account"""
+        key = self.key(account)
+        self._keys[account.aid] = key
+        self.counts[key] += 1
+
+    def remove(self, account):
+        """Stop counting an account"""
+        key = self._keys.pop(account.aid, None)
+        if key is not None:
+            self.counts[key] -= 1
+
+    def update(self, account):
+        """Move the account to its new key, after a change of stage or of one of the dimensions"""
+        old = self._keys.get(account.aid, None)
+        if old is None:
+            return  # account not counted yet, e.g. during its initialization
+        new = self.key(account)
+        if new != old:
+            self._keys[account.aid] = new
+            self.counts[old] -= 1
+            self.counts[new] += 1
+
+    def per_stage(self) -> Dict[AccountStage, int]:
+        """Number of accounts per stage"""
+        if not self.dimensions:
+            return {key[0]: n for key, n in self.counts.items()}
+        stages = Counter()
+        for key, n in self.counts.items():
+            stages[key[0]] += n
+        return dict(stages)
+
+    def per_dimension(self, dimension:str) -> Dict[object, Dict[AccountStage, int]]:
+        """Number of accounts per stage, for each value of `dimension`"""
+        i = self.dimensions.index(dimension) + 1
+        values = {}
+        for key, n in self.counts.items():
+            stages = values.setdefault(key[i], Counter())
+            stages[key[0]] += n
+        return values
+
+    def __len__(self):
+        return len(self._keys)
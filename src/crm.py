@@ -1,52 +1,89 @@
 import numpy as np
 import itertools
-import matplotlib.pyplot as plt
-import pandas as pd
+import logging
 import random
-import seaborn as sns   
 import simpy
 
-from eccore.core import setup_logging, logthis
 from enum import Enum
 from pathlib import Path
-from typing import Dict, List, Optional, Sequence, Tuple
-from uuid import uuid4
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
 
 from agents import BaseAgent, MarketingDpt, SalesRep, Account
+from counters import AccountCounters
+from registry import AgentRegistry
+from opportunities import OpportunityTable
+from tables import AccountTable
 from datetime import datetime, timedelta
 from enums import AccountStatus, AccountType, AccountStage, Country, Industry, LeadSource
 from enums import MktgIntents, SalesIntents, Actions
-from utils import salesrep_name_generator, account_info_generator
+from streams import RandomStreams
+from utils import salesrep_name_generator, account_info_generator, snapshot_df
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 class CustomerRelationManagerSimulator:
 
-    def __init__(self,nb_salesreps=5, nb_mql=20, nb_sql=20, nb_others=15):
+    def __init__(self,nb_salesreps=5, nb_mql=20, nb_sql=20, nb_others=15, stats_dimensions:Sequence[str]=(), batch_arrivals=False, industry_events=False, crn_seed:Optional[int]=None, profiler=None):
+        self.setup_crm(stats_dimensions=stats_dimensions, batch_arrivals=batch_arrivals, industry_events=industry_events, crn_seed=crn_seed, profiler=profiler)
+        self.setup_salesreps(nb_salesreps)
+        self.setup_accounts(nb_mql, nb_sql, nb_others)
+        self.start_processes()
+
+    @property
+    def uid(self) -> str:
+        """Unique identifier string of the simulation, materialized on first use"""
+        return self.registry.uid(self.aid)
+
+    # =============================================================================
+    # Methods to setup the simulation
+    # =============================================================================
+    def setup_crm(self, stats_dimensions:Sequence[str]=(), batch_arrivals=False, industry_events=False, env:Optional[simpy.Environment]=None, crn_seed:Optional[int]=None, profiler=None):
+        """Initialize the CRM state, the simulation environment and the marketing department, without any sales rep or account.
+        `env` is the simulation environment, a new one by default, and the optional `profiler` (see `instrument.Profiler`)
+        instruments all the processes of the simulation."""
         self.name = 'CRMSim'
-        self.uid = 'crm-' + str(uuid4())
-        self.env = simpy.Environment()
+        self.registry = AgentRegistry() # integer ids of the crm and its agents, used in messages and transactions
+        self.aid = self.registry.add(self, 'crm')
+        self.env = env if env is not None else simpy.Environment()
+        self.profiler = profiler
+        if profiler is not None:
+            profiler.attach(self.env)
         self.time_step_unit = 'Week'
         self.agents:Dict[str, List[Account|SalesRep|MarketingDpt]] = {} # List of Agents, dict with key as agent types and value as lists
-        self.requests_in_progress = [] # queue where accounts with pending request are stored
+        self.nb_agents_created:Dict[str, int] = {} # number of agents ever created per category, used as agent index
+        self.account_table = AccountTable() # state of all accounts, one row per account index
+        self.requests_in_progress = [] # queue where accounts with pending request are stored, flagged in account_table
+        self.pending_replies = {} # account id -> (due time, recipient id, reply msg) for replies not yet delivered
+        self.pending_arrivals = None # (due time, arrival times) of the batch of MQL arrivals in progress
+        self.next_arrival_at = None # time of the next MQL arrival, when not batched
+        self.scheduled_bursts = [] # lead bursts not yet injected
+        self.account_counters = AccountCounters(dimensions=stats_dimensions) # accounts per stage, updated incrementally
+        self.account_stats_by:Dict[str, List[dict]] = {} # weekly stats per stats dimension
+        self.dirty_accounts = set() # ids of accounts added, changed or removed since the last export
 
         self.transactions = []
+        self.opportunities = OpportunityTable() # opportunities of all accounts, by account and sales rep index
+        self.streams = RandomStreams(crn_seed) if crn_seed is not None else None # per decision point streams for common random numbers
 
-        self.marketing = MarketingDpt(self)
+        self.marketing = MarketingDpt(self, industry_events=industry_events)
         self.salesrep_name_gen = salesrep_name_generator() # initialise salesrep name generator
-        self.setup_salesreps(nb_salesreps)
-        self.account_info_gen = account_info_generator()
-        self.setup_accounts(nb_mql, nb_sql, nb_others)
+        self.account_info_seed = random.randrange(2**32)
+        self.account_info_gen = account_info_generator(random_state=self.account_info_seed)
+        self.nb_account_infos = 0 # number of account infos drawn from the generator
 
-        
+        self.mql_arrival_rate = 2 / 4  # 2 new MQL per month
+        self.batch_arrivals = batch_arrivals
         self.loprocesses = [
-            (self.new_mql_arrival, {'arrival_rate': 2 / 4}),  # MQL arrival process, 2 new MQL per month
+            (self.new_mql_arrivals_batched if batch_arrivals else self.new_mql_arrival, {}),  # MQL arrival process
             ] # List of all processes at the top level in the CRM
+
+    def start_processes(self, stats_delay=1):
+        """Register the top level processes, with the first account stats recorded after `stats_delay`"""
         self.register_processes()
-        self.env.process(self.record_accounts_stats())  # Positionel last to ensure it is the last action
+        self.env.process(self.record_accounts_stats(delay=stats_delay))  # Positionel last to ensure it is the last action
 
-    # =============================================================================
-    # Methods to setup the simulation
-    # =============================================================================
     def setup_salesreps(self, nb_salesreps):
         """Initialize sales reps."""
 
@@ -61,48 +98,73 @@ class CustomerRelationManagerSimulator:
         """Initialize accounts."""
         nb_mql, nb_sql = int(nb_mql), int(nb_sql)
         nb_prospects, nb_pitched, nb_bidded, nb_signed = int(nb_others),int(nb_others*.70),int(nb_others*.60),int(nb_others*.35)
-        if nb_mql > 0:
-            for i,_ in enumerate(range(nb_mql)):
-                self.add_account(stage=AccountStage.MQL)
-            print(f"Created {nb_mql} MQL accounts")
-        if nb_sql > 0:
-            for i,_ in enumerate(range(nb_sql)):
-                self.add_account(stage=AccountStage.SQL)
-            print(f"Created {nb_sql} SQL accounts")            
-        if nb_prospects > 0:
-            for i,_ in enumerate(range(nb_prospects)):
-                self.add_account(stage=AccountStage.PROSPECT)
-            print(f"Created {nb_prospects} PROSPECT accounts")
-        if nb_pitched > 0:
-            for i,_ in enumerate(range(nb_pitched)):
-                self.add_account(stage=AccountStage.PITCHED)
-            print(f"Created {nb_pitched} PITCHED accounts")
-        if nb_bidded > 0:
-            for i,_ in enumerate(range(nb_bidded)):
-                self.add_account(stage=AccountStage.BIDDED)
-            print(f"Created {nb_bidded} BIDDED accounts")
-        if nb_signed > 0:
-            for i,_ in enumerate(range(nb_signed)):
-                self.add_account(stage=AccountStage.SIGNED)
-            print(f"Created {nb_signed} SIGNED accounts")
+        for nb, stage in [
+            (nb_mql, AccountStage.MQL), 
+            (nb_sql, AccountStage.SQL), 
+            (nb_prospects, AccountStage.PROSPECT), 
+            (nb_pitched, AccountStage.PITCHED), 
+            (nb_bidded, AccountStage.BIDDED), 
+            (nb_signed, AccountStage.SIGNED),
+            ]:
+            if nb > 0:
+                self.add_accounts(nb, stage=stage)
+                print(f"Created {nb} {stage.name} accounts")
         print(f"Total accounts created: {len(self.get_accounts())}")  # type: ignore
 
     def add_account(self, stage, **kwargs):
-        co_info = next(self.account_info_gen)
+        return self.add_accounts(1, stage, **kwargs)[0]
+
+    def add_accounts(self, nb_accounts, stage, created_at=None, **kwargs) -> List[Account]:
+        """Create a batch of `nb_accounts` accounts at `stage`.
+
+        Account types and lead sources are drawn in one call unless passed as kwargs, and sales reps are 
+        assigned round robin over the batch. `created_at` optionally gives the creation time of each account.
+        """
+        nb_accounts = int(nb_accounts)
+        co_infos = [next(self.account_info_gen) for _ in range(nb_accounts)]
+        self.nb_account_infos += nb_accounts
+        if 'account_type' in kwargs: account_types = [kwargs['account_type']] * nb_accounts
+        else: account_types = random.choices(list(AccountType), k=nb_accounts)
+        if 'lead_source' in kwargs: lead_sources = [kwargs['lead_source']] * nb_accounts
+        else: lead_sources = random.choices(list(LeadSource), k=nb_accounts)
+        if created_at is None: created_at = [None] * nb_accounts
+
         sales_rep_loop = itertools.cycle(self.get_salesreps())
-        account = Account(
-            crm=self, 
-            name=co_info['Company Name'],
-            marketing=self.marketing,
-            country=co_info['Country'],
-            industry=co_info['Industry'],
-            account_type=kwargs.get('account_type', random.choice(list(AccountType))),
-            lead_source=kwargs.get('lead_source', random.choice(list(LeadSource))),
+        accounts = []
+        for co_info, account_type, lead_source, t in zip(co_infos, account_types, lead_sources, created_at):
+            account = Account(
+                crm=self, 
+                name=co_info['Company Name'],
+                marketing=self.marketing,
+                country=co_info['Country'],
+                industry=co_info['Industry'],
+                account_type=account_type,
+                lead_source=lead_source,
+                created_at=None if t is None else float(t),
+                )
+            account.stage = stage
+            if stage != AccountStage.LEAD:
+                account.assigned_salesrep = next(sales_rep_loop)
+            accounts.append(account)
+        self.record_initial_states(accounts)
+        # self.log(self.env, self, f"{nb_accounts} accounts added to CRM (total of {len(self.get_accounts())} accounts).")
+        return accounts
+
+    def record_initial_states(self, accounts:List[Account]):
+        """Record the initial stage and sales rep of new accounts, at their creation time, so that
+        account states can be rebuilt from the transaction log (see `eventlog`)"""
+        for account in accounts:
+            self.record_transaction(
+                msg={'suid': self.aid, 'ruid': account.aid, 'intent': 'initial stage', 'action': account.stage.name},
+                transaction_type='system',
+                timestamp=account.created_at,
             )
-        account.stage = stage
-        if stage != AccountStage.LEAD:
-            account.assigned_salesrep = next(sales_rep_loop)
-        # self.log(self.env, self, f"Account {account.name} added to CRM (total of {len(self.get_accounts())} accounts).")
+            if account.assigned_salesrep is not None:
+                self.record_transaction(
+                    msg={'suid': account.assigned_salesrep.aid, 'ruid': account.aid, 'intent': 'assign sales rep', 'action': 'assign'},
+                    transaction_type='system',
+                    timestamp=account.created_at,
+                )
 
     # =============================================================================
     # CRM related methods
@@ -111,7 +173,27 @@ class CustomerRelationManagerSimulator:
         if stage is None:
             return [a for a in self.agents.get('account', [])] # type: ignore
         else:
-            return [acct for acct in self.agents.get('account', []) if acct.stage == stage] # type: ignore
+            return self.accounts_at_rows(self.account_table.rows(stage))
+
+    def accounts_at_rows(self, rows) -> List[Account]:
+        """Accounts of the `rows` of the account table"""
+        agents = self.registry.agents
+        return [agents[aid] for aid in self.account_table.aid[rows].tolist()]
+
+    def sample_accounts(self, rows, k:int) -> List[Account]:
+        """Random sample of `k` accounts (all if fewer) among the `rows` of the account table, see `AccountTable.rows`"""
+        rows = np.random.choice(rows, size=min(k, len(rows)), replace=False)
+        return self.accounts_at_rows(rows)
+
+    def start_requests(self, accounts:List[Account]):
+        """Queue accounts sent a request, so that they are not sent another one before their reply"""
+        self.requests_in_progress.extend(accounts)
+        self.account_table.in_progress[[a.idx for a in accounts]] = True
+
+    def end_request(self, account:Account):
+        """Remove an account from the queue of requests, once its reply is processed"""
+        self.requests_in_progress.remove(account)
+        self.account_table.in_progress[account.idx] = account in self.requests_in_progress
 
     def get_salesreps(self) -> List[SalesRep]:
         return self.agents.get('salesrep', []) # type: ignore
@@ -127,8 +209,8 @@ class CustomerRelationManagerSimulator:
         self.log(f"Assigned sales rep {selected_salerep.name} to account {account.name}", selected_salerep, self.env)
         self.record_transaction(
             msg={
-                'suid': selected_salerep.uid,
-                'ruid': account.uid,
+                'suid': selected_salerep.aid,
+                'ruid': account.aid,
                 'intent': 'assign sales rep',
                 'action': 'assign',
             },
@@ -136,20 +218,79 @@ class CustomerRelationManagerSimulator:
         )
 
     def register_agent_to_crm(self, agent, category): 
-        """Adds this agent to the collection stored in crm"""
+        """Adds this agent to the collection stored in crm, and gives it an id in the registry and an index unique in its category"""
+        agent.aid = self.registry.add(agent, category)
+        if category == 'account':
+            self.account_table.aid[agent.idx] = agent.aid  # index is the row allocated by the account
+        else:
+            agent.idx = self.nb_agents_created.get(category, 0)
+        self.nb_agents_created[category] = agent.idx + 1
         self.agents.setdefault(category, []).append(agent)
+        if category == 'account':
+            self.account_counters.add(agent)
+            self.dirty_accounts.add(agent.aid)
+
+    def remove_account(self, account:Account):
+        """Remove an account from the CRM"""
+        self.agents['account'].remove(account)
+        self.account_counters.remove(account)
+        self.registry.remove(account.aid)
+        self.account_table.remove(account.idx)
+        self.dirty_accounts.add(account.aid)
+        if account in self.requests_in_progress:
+            self.requests_in_progress.remove(account)
+        self.record_transaction(
+            msg={'suid': self.aid, 'ruid': account.aid, 'intent': 'remove account', 'action': 'remove'},
+            transaction_type='system',
+        )
 
-    def new_mql_arrival(self, arrival_rate):
+    def new_mql_arrival(self, arrival_rate=None):
         """Exponential random variable giving the time to the next MQL arrival.
 
         P[X>t] = exp(-arrival rate * t)
         """
         while True:
-            delay = random.expovariate(arrival_rate)
-            t = self.env.now + delay
+            if self.next_arrival_at is None:
+                delay = random.expovariate(self.mql_arrival_rate if arrival_rate is None else arrival_rate)
+                self.next_arrival_at = self.env.now + delay
+            else:  # arrival drawn before a checkpoint
+                delay = self.next_arrival_at - self.env.now
             yield self.env.timeout(delay)
+            self.next_arrival_at = None
             self.add_account(stage=AccountStage.MQL)
 
+    def new_mql_arrivals_batched(self, arrival_rate=None):
+        """Weekly batches of MQL arrivals from a Poisson process, with one simpy event per week.
+
+        The number of arrivals over the coming week and their offsets within the week are drawn in one call. 
+        The accounts are created in bulk at the end of the week, with their actual arrival times.
+        """
+        while True:
+            if self.pending_arrivals is None:
+                rate = self.mql_arrival_rate if arrival_rate is None else arrival_rate
+                nb_arrivals = np.random.poisson(rate)
+                arrival_times = self.env.now + np.sort(np.random.uniform(0, 1, size=nb_arrivals))
+                self.pending_arrivals = (self.env.now + 1, arrival_times)
+            due, arrival_times = self.pending_arrivals
+            yield self.env.timeout(max(due - self.env.now, 0))
+            self.pending_arrivals = None
+            if len(arrival_times) > 0:
+                self.add_accounts(len(arrival_times), stage=AccountStage.MQL, created_at=arrival_times)
+
+    def schedule_lead_burst(self, at, nb_accounts, stage=AccountStage.MQL, **kwargs):
+        """Schedule a burst of `nb_accounts` new accounts at time `at`, e.g. leads from an industry event.
+
+        The accounts are created in one batch (see `add_accounts`), kwargs are passed to `add_accounts`.
+        """
+        burst = {'at': at, 'nb_accounts': nb_accounts, 'stage': stage, **kwargs}
+        self.scheduled_bursts.append(burst)
+
+        def inject():
+            yield self.env.timeout(max(at - self.env.now, 0))
+            self.scheduled_bursts.remove(burst)
+            self.add_accounts(nb_accounts, stage=stage, **kwargs)
+        return self.env.process(inject())
+
     # =============================================================================
     # CRM reporting methods
     # =============================================================================
@@ -169,40 +310,64 @@ class CustomerRelationManagerSimulator:
         else:
             self.transactions = [record]  
 
-    def record_accounts_stats(self):
-        """Record the number of accounts per stage in the environment."""
+    def record_transactions(self, msgs, transaction_type, **kwargs):
+        """Record a batch of transactions at once, all at the current time (see `record_transaction`)."""
+        now = self.env.now
+        self.transactions.extend(
+            {
+                'timestamp': now,
+                'sender': msg['suid'],
+                'receiver': msg['ruid'],
+                'intent': msg['intent'],
+                'action': msg.get('action', None),
+                'type': transaction_type,
+                **kwargs,
+            }
+            for msg in msgs
+        )
+
+    def record_accounts_stats(self, delay=1):
+        """Record the number of accounts per stage in the environment, every week after the first `delay`."""
         while True:
-            yield self.env.timeout(delay=1)
+            yield self.env.timeout(delay=delay)
+            delay = 1
+            per_stage = self.account_counters.per_stage()
             record = {
                 'timestamp': self.env.now,
                 'nb_accounts': len(self.agents['account']),
-                'LEAD': len([a for a in self.agents['account'] if a.stage == AccountStage.LEAD]), # type: ignore
-                'MQL': len([a for a in self.agents['account'] if a.stage == AccountStage.MQL]), # type: ignore
-                'SQL': len([a for a in self.agents['account'] if a.stage == AccountStage.SQL]), # type: ignore
-                'PROSPECT': len([a for a in self.agents['account'] if a.stage == AccountStage.PROSPECT]), # type: ignore
-                'PITCHED': len([a for a in self.agents['account'] if a.stage == AccountStage.PITCHED]), # type: ignore
-                'BIDDED': len([a for a in self.agents['account'] if a.stage == AccountStage.BIDDED]), # type: ignore
-                'SIGNED': len([a for a in self.agents['account'] if a.stage == AccountStage.SIGNED]), # type: ignore
-                'ACTIVE': len([a for a in self.agents['account'] if a.stage == AccountStage.ACTIVE]), # type: ignore
-                'STALE': len([a for a in self.agents['account'] if a.stage == AccountStage.STALE]), # type: ignore
             }
+            record.update({stage.name: per_stage.get(stage, 0) for stage in AccountStage})
             if hasattr(self, 'account_stats'):
                 getattr(self, 'account_stats').append(record)
             else:
                 self.account_stats = [record]
 
-    def transactions_to_df(self, day1:datetime=datetime(2026, 1, 1)) -> pd.DataFrame:
-        """Convert transactions to a pandas DataFrame"""
+            # Optional weekly stats per dimension (sales rep, lead source, account type)
+            for dim in self.account_counters.dimensions:
+                records = self.account_stats_by.setdefault(dim, [])
+                for value, stages in self.account_counters.per_dimension(dim).items():
+                    record = {'timestamp': self.env.now, dim: value.name if isinstance(value, Enum) else value}
+                    record.update({stage.name: stages.get(stage, 0) for stage in AccountStage})
+                    records.append(record)
+
+    def transactions_to_df(self, day1:datetime=datetime(2026, 1, 1)) -> 'pd.DataFrame':
+        """Convert transactions to a pandas DataFrame, with senders and receivers as uids"""
+        import pandas as pd
+
         if hasattr(self, 'transactions'):
             df = pd.DataFrame(self.transactions)
+            df['sender'] = self.registry.uids(df['sender'])
+            df['receiver'] = self.registry.uids(df['receiver'])
             d1 = day1 + timedelta(days= 7 - day1.weekday())  # Align to the first Monday
             df['timestamp'] = df['timestamp'].apply(lambda x: d1 + timedelta(weeks=x))
             return df.set_index('timestamp', drop=True).sort_index()
         else:
             return pd.DataFrame(columns=['timestamp', 'sender', 'receiver', 'intent', 'action', 'type'])
 
-    def account_stats_to_df(self, day1:datetime=datetime(2026, 1, 1), int_idx=False) -> pd.DataFrame:
+    def account_stats_to_df(self, day1:datetime=datetime(2026, 1, 1), int_idx=False) -> 'pd.DataFrame':
         """Convert account stats to a pandas DataFrame"""
+        import pandas as pd
+
         if hasattr(self, 'account_stats'):
             df = pd.DataFrame(self.account_stats)
             if not int_idx:
@@ -213,21 +378,51 @@ class CustomerRelationManagerSimulator:
         else:
             return pd.DataFrame(columns=['sender', 'receiver', 'intent', 'action', 'type'])
 
+    def account_stats_by_to_df(self, dimension:str, day1:datetime=datetime(2026, 1, 1), int_idx=False) -> 'pd.DataFrame':
+        """Convert account stats per `dimension` ('salesrep', 'lead_source' or 'account_type') to a pandas DataFrame"""
+        import pandas as pd
+
+        if dimension not in self.account_counters.dimensions:
+            raise ValueError(f"'{dimension}' is not tracked, stats dimensions are {self.account_counters.dimensions}")
+        df = pd.DataFrame(self.account_stats_by.get(dimension, []), columns=['timestamp', dimension] + [s.name for s in AccountStage])
+        if not int_idx:
+            d1 = day1 + timedelta(days= 7 - day1.weekday())  # Align to the first Monday
+            df['timestamp'] = df['timestamp'].apply(lambda x: d1 + timedelta(weeks=x))
+            df = df.set_index('timestamp', drop=True).sort_index()
+        return df
+
     def accounts_per_stage(self, stage: AccountStage) -> List[Account]:
-        accounts = self.agents['account']
-        l = [a for a in  accounts if a.stage == stage] #type: ignore
-        return l #type:ignore
+        return self.get_accounts(stage)
 
     def account_df(self):
-        df = pd.DataFrame([a() for a in self.agents['account']])
-        for c in df.columns:
-            df.loc[:,c] = df.loc[:,c].apply(lambda x: x.name if isinstance(x, Enum) else x)
-        df.loc[:,'assigned_salesrep'] = df.loc[:,'assigned_salesrep'].apply(lambda x: x.uid)
-        return df
+        """Snapshot of all accounts, with enums as categorical columns and sales reps as uid, read from the account table"""
+        table = self.account_table
+        active = table.active
+        salesrep_uids = np.array([sr.uid for sr in self.get_salesreps()] + [None], dtype=object)  # index -1 -> None
+        return table.to_df(
+            Account.export_schema,
+            uid=self.registry.uids(table.aid[active].tolist()),
+            assigned_salesrep=salesrep_uids[table.salesrep[active]],
+        )
 
     def salesrep_df(self):
-        df = pd.DataFrame([sr() for sr in self.agents['salesrep']])
+        """Snapshot of all sales reps"""
+        return snapshot_df(self.agents.get('salesrep', []), SalesRep.export_schema)
+
+    def opportunity_df(self):
+        """All opportunities, with account and sales rep uids"""
+        df = self.opportunities.to_df()
+        account_uids = {a.idx: a.uid for a in self.get_accounts()}
+        salesrep_uids = {sr.idx: sr.uid for sr in self.get_salesreps()}
+        df['account'] = df['account'].map(account_uids)
+        df['salesrep'] = df['salesrep'].map(salesrep_uids)
         return df
+
+    def salesrep_performance(self) -> 'pd.DataFrame':
+        """Pipeline value, win rate and cycle time per sales rep, see `OpportunityTable.per_salesrep`"""
+        df = self.opportunities.per_salesrep(nb_salesreps=self.nb_agents_created.get('salesrep', 0))
+        names = {sr.idx: sr.name for sr in self.get_salesreps()}
+        return df.rename(index=names)
         
     # =============================================================================
     # Process related methods
@@ -239,6 +434,23 @@ class CustomerRelationManagerSimulator:
     # =============================================================================
     # Simulation related methods
     # =============================================================================
+    def checkpoint(self, path:Path|str):
+        """Save the current state of the simulation to `path`, see `checkpoint.save_checkpoint`"""
+        from checkpoint import save_checkpoint
+        save_checkpoint(self, path)
+
+    @classmethod
+    def restore(cls, path:Path|str) -> 'CustomerRelationManagerSimulator':
+        """Rebuild a simulation from the checkpoint at `path`, see `checkpoint.load_checkpoint`"""
+        from checkpoint import load_checkpoint
+        return load_checkpoint(path, cls=cls)
+
+    def to_sqlite(self, path:Path|str):
+        """Persist accounts, sales reps, transactions and weekly stats in the SQLite database at `path`,
+        and return it as a `store.CRMStore` to query. Calling it again on the same database only exports what changed since."""
+        from store import CRMStore
+        return CRMStore(path).sync(self)
+
     def run(self, until: int):
         """Run the simulation until a specified time
 
@@ -258,8 +470,8 @@ class CustomerRelationManagerSimulator:
     # =============================================================================
     # Plotting and visualization methods
     # =============================================================================
-    def plot_account_stats(self, as_share=True, hide_mql=True, hide_mql_sql=True):
-        """Plot account statistics."""
+    def account_stats_plot_df(self, as_share=True, hide_mql=True, hide_mql_sql=True) -> 'pd.DataFrame':
+        """Data of `plot_account_stats`: weekly accounts per stage, or their shares, indexed by month end"""
         if hide_mql_sql:
             df = self.account_stats_to_df().drop(columns=['LEAD', 'MQL', 'SQL', 'ACTIVE', 'nb_accounts'])        
         elif hide_mql:
@@ -274,6 +486,15 @@ class CustomerRelationManagerSimulator:
 
         # Use month start for index for better bar alignment
         df_pct.index = df_pct.index.to_period('M').to_timestamp('M')  # type: ignore
+        return df_pct
+
+    def plot_account_stats(self, as_share=True, hide_mql=True, hide_mql_sql=True):
+        """Plot account statistics."""
+        import matplotlib.pyplot as plt
+        import pandas as pd
+        import seaborn as sns
+
+        df_pct = self.account_stats_plot_df(as_share=as_share, hide_mql=hide_mql, hide_mql_sql=hide_mql_sql)
 
         # Calculate bar width as number of days in each month
         month_days = df_pct.index.days_in_month * 0.75  #type: ignore
@@ -300,7 +521,7 @@ class CustomerRelationManagerSimulator:
     @staticmethod
     def log(txt, agent, env):
         # print(f"[{env.now:.2f}]-[{agent.name}] {txt}")
-        logthis(f"[{env.now:.2f}]-[{agent.name}] {txt}")
+        logging.info(f"[{env.now:.2f}]-[{agent.name}] {txt}")
 
 
 
@@ -1,10 +1,12 @@
+import numpy as np
 import pandas as pd
 import random
 import simpy
 
 from classes import SalesRep, Account, Opportunity
-from enums import AccountStage, AccountType, LeadSource
-from utils import salesrep_name_generator, account_info_generator
+from enums import AccountStage, AccountType, LeadSource, OpportunityStage
+from opportunities import OpportunityTable, draw_values
+from utils import salesrep_name_generator, account_info_generator, snapshot_df
 
 
 
@@ -12,12 +14,14 @@ class CustomerRelationManagerSimulator:
     def __init__(self, nb_salesreps=3, nb_accounts=5):
         self.env = simpy.Environment()
         self.sales_reps = {}
+        self.salesrep_idx = {} # salesrep uid -> integer index
         self.salesrep_name_gen = salesrep_name_generator()
         self.setup_salesreps(nb_salesreps)
         self.accounts = {}
+        self.account_idx = {} # account uid -> integer index, used in the opportunity table
+        self.opportunities = OpportunityTable()
         self.account_info_gen = account_info_generator()
         self.setup_accounts(nb_accounts)
-        self.opportunities = {}
 
     # Methods to setup the simulation
     def setup_salesreps(self, nb_salesreps):
@@ -53,10 +57,12 @@ class CustomerRelationManagerSimulator:
     # Methods to manage accounts and sales reps
     def add_account(self, account):
         self.accounts[account.uid] = account
+        self.account_idx[account.uid] = len(self.account_idx)
         # print(f"{self.env.now}: Account {account.name} added to CRM.")
 
     def add_salesrep(self, salesrep):
         self.sales_reps[salesrep.uid] = salesrep
+        self.salesrep_idx[salesrep.uid] = len(self.salesrep_idx)
         # print(f"{self.env.now}: Sales Rep {salesrep.name} added to CRM.")
 
     def assign_salesrep(self, account, salesrep):
@@ -69,11 +75,29 @@ class CustomerRelationManagerSimulator:
         self.assign_salesrep(account, self.sales_reps[key])
 
     # Methods to manage opportunities
-    def add_opportunities(self, idxs):
-        pass
+    def add_opportunities(self, idxs, t=None) -> np.ndarray:
+        """Create one opportunity for each account uid in `idxs`, with values drawn in one call. Returns their ids"""
+        accounts = [self.accounts[uid] for uid in idxs]
+        return self.opportunities.create(
+            accounts=[self.account_idx[uid] for uid in idxs],
+            values=draw_values([a.account_type for a in accounts]),
+            t=self.env.now if t is None else t,
+            salesreps=[self.salesrep_idx.get(a.sales_rep.uid, -1) for a in accounts],
+        )
+
+    def add_opportunity(self,account) -> int:
+        """Create an opportunity for `account`. Returns its id"""
+        return int(self.add_opportunities([account.uid])[0])
+
+    def close_opportunities(self, idxs, stage:OpportunityStage, t=None):
+        """Close the open opportunities of the account uids in `idxs` as won, lost or stale"""
+        ids = self.opportunities.open_ids_of([self.account_idx[uid] for uid in idxs])
+        self.opportunities.close(ids, stage, t=self.env.now if t is None else t)
 
-    def add_opportunity(self,account):
-        pass
+    def salesrep_performance(self) -> pd.DataFrame:
+        """Pipeline value, win rate and cycle time per sales rep, see `OpportunityTable.per_salesrep`"""
+        df = self.opportunities.per_salesrep(nb_salesreps=len(self.salesrep_idx))
+        return df.rename(index={i: self.sales_reps[uid].name for uid, i in self.salesrep_idx.items()})
 
     # Methods to update accounts with SD Simulation
     def get_uids_per_stage(self):
@@ -82,7 +106,7 @@ class CustomerRelationManagerSimulator:
         df = self.retrieve_accounts()
         for stage in list(AccountStage):
             # print(df.loc[df['stage'] == stage, :]['uid'].tolist())
-            acct_uid_per_stage[stage] = df[df['stage'] == stage]['uid'].tolist()
+            acct_uid_per_stage[stage] = df[df['stage'] == stage.name]['uid'].tolist()
         return acct_uid_per_stage
 
     def _create_new_accounts(self, row):
@@ -144,10 +168,11 @@ class CustomerRelationManagerSimulator:
         
         idxs = random.sample(uids_per_stage[AccountStage.PITCHED], bids)
         move_accounts(idxs, AccountStage.BIDDED)
-        self.add_opportunities(idxs)
+        self.add_opportunities(idxs, t=row.name)
 
         idxs = random.sample(uids_per_stage[AccountStage.BIDDED], c)
         move_accounts(idxs, AccountStage.SIGNED)
+        self.close_opportunities(idxs, OpportunityStage.CLOSED_WON, t=row.name)
         
         idxs = random.sample(uids_per_stage[AccountStage.SIGNED], sta)
         move_accounts(idxs, AccountStage.ACTIVE)
@@ -162,6 +187,7 @@ class CustomerRelationManagerSimulator:
 
         idxs = random.sample(uids_per_stage[AccountStage.BIDDED], lost)
         move_accounts(idxs, AccountStage.SQL)
+        self.close_opportunities(idxs, OpportunityStage.CLOSED_LOST, t=row.name)
         
         idxs = random.sample(uids_per_stage[AccountStage.ACTIVE], comp)
         move_accounts(idxs, AccountStage.SQL)
@@ -181,4 +207,4 @@ class CustomerRelationManagerSimulator:
 
     # Methods for outputs and reports
     def retrieve_accounts(self) -> pd.DataFrame:
-        return pd.DataFrame(data=[a() for a in self.accounts.values()])
\ No newline at end of file
+        return snapshot_df(list(self.accounts.values()), Account.export_schema)
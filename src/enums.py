@@ -1,4 +1,5 @@
 from enum import Enum, auto
+from functools import lru_cache
 
 class AccountStage(Enum):
     """
@@ -134,3 +135,14 @@ class InternalMessages(Enum):
     BIDDED2SQL = 'Back to SQL, bid lost'
     SIGNED2ACTIVE = 'SIGNED to SATISFIED'
     SIGNED2STALE = 'SIGNED to UNSATISFIED'
+
+
+@lru_cache(maxsize=None)
+def enum_codes(enum_cls) -> dict:
+    """Map each member of `enum_cls` to its integer code, i.e. its position in the enum"""
+    return {member: code for code, member in enumerate(enum_cls)}
+
+@lru_cache(maxsize=None)
+def enum_labels(enum_cls) -> list:
+    """Return the names of the members of `enum_cls`, in code order"""
+    return [member.name for member in enum_cls]
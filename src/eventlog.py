@@ -0,0 +1,174 @@
+import gzip
+import json
+import pickle
+import numpy as np
+import pandas as pd
+
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from enums import AccountStage, BusinessValues, enum_codes
+
+# Fields of a transaction, in the order they are stored in the log chunks
+FIELDS = ['timestamp', 'sender', 'receiver', 'intent', 'action', 'type', 'value']
+# Fields of the state of an account rebuilt from the log
+STATE_FIELDS = [
+    'created_at', 'stage', 'assigned_salesrep', 'nb_opportunities', 'cumulative_opportunity_value',
+    'active_opportunity', 'cumulative_purchase_value', 'active_purchase',
+]
+CREATED, STAGE, SALESREP, NB_OPPS, CUM_OPP, ACTIVE_OPP, CUM_PURCHASE, ACTIVE_PURCHASE = range(len(STATE_FIELDS))
+
+
+def apply_transaction(state:Dict[str, list], t:tuple):
+    """Apply one transaction (see `FIELDS`) to the account `state`, which maps account uid -> list of `STATE_FIELDS`"""
+    timestamp, sender, receiver, intent, action, _, value = t
+    if action == 'create' and intent == 'new account instance':
+        state[receiver] = [timestamp, AccountStage.MQL, None, 0, 0, 0, 0, 0]
+    elif action == 'transition':
+        state[receiver][STAGE] = AccountStage[intent.split(' to ')[1]]
+    elif intent == 'initial stage':
+        state[receiver][STAGE] = AccountStage[action]
+    elif intent == 'assign sales rep':
+        state[receiver][SALESREP] = sender
+    elif intent == BusinessValues.OPPORTUNITY.value:
+        account = state[sender]
+        account[ACTIVE_OPP] = value
+        account[CUM_OPP] += value
+        account[NB_OPPS] += 1
+    elif intent == BusinessValues.PURCHASE.value:
+        account = state[sender]
+        account[ACTIVE_PURCHASE] = value
+        account[CUM_PURCHASE] += value
+        account[ACTIVE_OPP] = 0
+    elif intent == 'remove account':
+        state.pop(receiver, None)
+
+
+class EventLog:
+    """Transaction log of a simulation, stored in chunked files, with periodic snapshots of the account states.
+
+    The state of all accounts (stage, sales rep and business values) at any simulated time is rebuilt by
+    replaying the log from the last snapshot before that time, without re-simulating. Transactions are
+    replayed in the order they were recorded, which is their causal order: accounts created in batch are
+    recorded with backdated timestamps, so that timestamps are not strictly increasing along the log.
+
+    Files in `directory`:
+    - chunk-<n>.pkl.gz: up to `chunk_size` transactions, as tuples of `FIELDS`
+    - snapshot-<n>.pkl.gz: account states after the first n chunks
+    - index.json: number of transactions, min and max timestamp of each chunk, and chunks with a snapshot
+    """
+
+    def __init__(self, directory:Path|str, chunk_size:int=50_000, snapshot_every:int=4):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        index = self.directory / 'index.json'
+        if index.is_file():
+            self.index = json.loads(index.read_text())
+        else:
+            self.index = {'chunk_size': chunk_size, 'snapshot_every': snapshot_every, 'chunks': [], 'snapshots': []}
+        self.chunk_size = self.index['chunk_size']
+        self.snapshot_every = self.index['snapshot_every']
+
+    @property
+    def nb_transactions(self) -> int:
+        return sum(c['nb'] for c in self.index['chunks'])
+
+    def _write(self, name:str, obj):
+        tmp = self.directory / f"{name}.tmp"
+        with gzip.open(tmp, 'wb', compresslevel=6) as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp.replace(self.directory / name)
+
+    def _read(self, name:str):
+        with gzip.open(self.directory / name, 'rb') as f:
+            return pickle.load(f)
+
+    def _save_index(self):
+        tmp = self.directory / 'index.json.tmp'
+        tmp.write_text(json.dumps(self.index))
+        tmp.replace(self.directory / 'index.json')
+
+    def sync(self, crm) -> 'EventLog':
+        """Append the transactions of `crm` recorded since the last sync, with senders and receivers as uids"""
+        uid = crm.registry.uid
+        return self.append(
+            {**t, 'sender': uid(t['sender']), 'receiver': uid(t['receiver'])} for t in crm.transactions[self.nb_transactions:]
+        )
+
+    def append(self, transactions:Iterable[dict]) -> 'EventLog':
+        """Append `transactions` to the log, in chunks, and snapshot the account states every `snapshot_every` chunks.
+        The last chunk is only written once full, except for the last one of the batch."""
+        records = [tuple(t.get(f, None) for f in FIELDS) for t in transactions]
+        chunks = self.index['chunks']
+        if chunks and chunks[-1]['nb'] < self.chunk_size:
+            # Complete the last chunk, which was written partially full
+            last = chunks.pop()
+            records = self._read(last['file']) + records
+        state = None
+        for start in range(0, len(records), self.chunk_size):
+            chunk = records[start:start + self.chunk_size]
+            n = len(chunks)
+            timestamps = [r[0] for r in chunk]
+            chunks.append({'file': f"chunk-{n:06d}.pkl.gz", 'nb': len(chunk), 'min_ts': min(timestamps), 'max_ts': max(timestamps)})
+            self._write(chunks[-1]['file'], chunk)
+            if len(chunk) == self.chunk_size and (n + 1) % self.snapshot_every == 0 and (n + 1) not in self.index['snapshots']:
+                state = self.replay(nb_chunks=n + 1, state=state)
+                self._write(f"snapshot-{n + 1:06d}.pkl.gz", state)
+                self.index['snapshots'].append(n + 1)
+        self._save_index()
+        return self
+
+    def iter_chunks(self, start:int=0, stop:Optional[int]=None) -> Iterator[Tuple[dict, List[tuple]]]:
+        """Iterate over (chunk info, transactions) for chunks `start` to `stop`, loading one chunk at a time"""
+        for info in self.index['chunks'][start:stop]:
+            yield info, self._read(info['file'])
+
+    def replay(self, nb_chunks:int, state:Optional[Dict[str, list]]=None) -> Dict[str, list]:
+        """Account states after replaying the first `nb_chunks` chunks, from the latest available snapshot"""
+        if state is None:
+            state, start = self._load_snapshot(lambda n: n <= nb_chunks)
+        else:
+            start = max([n for n in self.index['snapshots'] if n <= nb_chunks], default=0)
+        for _, chunk in self.iter_chunks(start, nb_chunks):
+            for t in chunk:
+                apply_transaction(state, t)
+        return state
+
+    def _load_snapshot(self, usable) -> Tuple[Dict[str, list], int]:
+        """Latest snapshot whose number of chunks satisfies `usable`, and that number of chunks"""
+        n = max([n for n in self.index['snapshots'] if usable(n)], default=0)
+        if n == 0:
+            return {}, 0
+        return self._read(f"snapshot-{n:06d}.pkl.gz"), n
+
+    def state_at(self, t:float) -> Dict[str, list]:
+        """Account states at time `t`, i.e. after all transactions with a timestamp up to `t`"""
+        chunks = self.index['chunks']
+        # Latest snapshot made only of transactions up to t
+        state, start = self._load_snapshot(lambda n: all(c['max_ts'] <= t for c in chunks[:n]))
+        for info in chunks[start:]:
+            if info['min_ts'] > t:
+                continue
+            for record in self._read(info['file']):
+                if record[0] <= t:
+                    apply_transaction(state, record)
+        return state
+
+    def accounts_at(self, t:float) -> pd.DataFrame:
+        """Snapshot of all accounts at time `t`, with one row per account uid and one column per `STATE_FIELDS`"""
+        state = self.state_at(t)
+        df = pd.DataFrame.from_dict(state, orient='index', columns=STATE_FIELDS).rename_axis('uid')
+        df['stage'] = pd.Categorical([s.name for s in df['stage']], categories=[s.name for s in AccountStage])
+        return df
+
+    def stages_at(self, t:float) -> pd.Series:
+        """Number of accounts per stage at time `t`.
+        Weekly stats at week w are recorded before the transactions of week w, i.e. match `stages_at(w - 1e-9)`"""
+        state = self.state_at(t)
+        codes = enum_codes(AccountStage)
+        counts = np.bincount([codes[values[STAGE]] for values in state.values()], minlength=len(AccountStage))
+        return pd.Series(counts, index=[s.name for s in AccountStage], name=t)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,46 @@
+import json
+import random
+import sys
+import numpy as np
+
+from contextlib import redirect_stdout
+from typing import Any, Dict, List
+
+from crm import CustomerRelationManagerSimulator
+
+
+def run(until:int=52, seed:int|None=None, **init) -> Dict[str, Any]:
+    """Run a simulation with the constructor arguments `init` until week `until`, and return its results as plain
+    records: weekly account stats, accounts per stage at the end and number of transactions.
+
+    Only the simulation core is imported, without pandas, plotting or pysd, for a fast start of worker processes.
+    """
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+    with redirect_stdout(sys.stderr):
+        crm = CustomerRelationManagerSimulator(**init)
+        crm.run(until=until)
+    return {
+        'until': until,
+        'seed': seed,
+        'account_stats': getattr(crm, 'account_stats', []),
+        'per_stage': {stage.name: n for stage, n in crm.account_table.per_stage().items()},
+        'nb_transactions': len(crm.transactions),
+    }
+
+def parse_args(args:List[str]) -> Dict[str, Any]:
+    """Keyword arguments from 'name=value' strings, with values parsed as json when possible, e.g. 'nb_salesreps=10'"""
+    kwargs = {}
+    for arg in args:
+        name, _, value = arg.partition('=')
+        try:
+            kwargs[name] = json.loads(value)
+        except ValueError:
+            kwargs[name] = value
+    return kwargs
+
+
+if __name__ == "__main__":
+    # e.g. python headless.py until=104 seed=1 nb_salesreps=10 > results.json
+    json.dump(run(**parse_args(sys.argv[1:])), sys.stdout)
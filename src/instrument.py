@@ -0,0 +1,152 @@
+import json
+import time
+import pandas as pd
+
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Generator, List, Tuple
+
+
+def process_name(generator:Generator) -> str:
+    """Name of the process running `generator`: class of the agent (or crm) and name of the method, e.g.
+    'SalesRep.request_negotiation' or 'Account.handle_inbox'"""
+    owner = generator.gi_frame.f_locals.get('self') if generator.gi_frame is not None else None
+    return f"{type(owner).__name__}.{generator.__name__}" if owner is not None else generator.__qualname__
+
+def delegation_stack(generator:Generator, root:str) -> Tuple[str, ...]:
+    """Names of `generator` (as `root`) and of the generators it currently delegates to with `yield from`,
+    e.g. ('Account.handle_inbox', 'Account.reply_to_salesrep_request', 'Account.deliver_reply')"""
+    stack = [root]
+    inner = generator.gi_yieldfrom
+    while inner is not None and hasattr(inner, 'gi_yieldfrom'):
+        stack.append(inner.__qualname__)
+        inner = inner.gi_yieldfrom
+    return tuple(stack)
+
+def queue_length(env) -> int:
+    """Number of events scheduled in `env`"""
+    return len(env._queue)
+
+
+class Profiler:
+    """Opt-in profiler of the processes of a simulation, see `CustomerRelationManagerSimulator(profiler=...)`.
+
+    Once attached to an environment, each process started by `env.process` is wrapped in a generator that times
+    each of its resumptions, i.e. the code run between two events. Each resumption is counted and timed under:
+    - the process type, e.g. 'SalesRep.request_user_need_discovery' or 'CustomerRelationManagerSimulator.record_accounts_stats'
+    - the stack of handlers it delegates to, e.g. 'Account.handle_inbox;Account.reply_to_salesrep_request'
+      (the deeper stack of the start and the end of the resumption)
+    - the intent of the message, when the process is resumed with a message from its inbox
+    The length of the event queue is sampled every `sample_interval` of simulated time.
+
+    Simulations without profiler are not affected: nothing is wrapped and no check is made while running.
+    """
+
+    def __init__(self, sample_interval:float=1):
+        self.sample_interval = sample_interval
+        self.stacks:Dict[Tuple[str, ...], List[float]] = defaultdict(lambda: [0, 0.0])   # stack -> [count, time]
+        self.intents:Dict[Tuple[str, str], int] = defaultdict(int)                        # (process, intent) -> count
+        self.queue_samples:List[Tuple[float, int]] = []
+        self.env = None
+
+    def attach(self, env):
+        """Instrument the processes started in `env` from now on, and start sampling its event queue"""
+        self.env = env
+        start_process = env.process
+        env.process = lambda generator: start_process(self.instrument(generator))
+        start_process(self.sample_queue())
+
+    def instrument(self, generator:Generator) -> Generator:
+        """Wrap `generator`, forwarding the events it yields and the values or exceptions it is resumed with"""
+        root = process_name(generator)
+        intents, clock = self.intents, time.perf_counter
+        value, error = None, None
+        while True:
+            before = delegation_stack(generator, root)
+            if value.__class__ is str:
+                intents[(root, _intent(value))] += 1
+            start = clock()
+            try:
+                event = generator.send(value) if error is None else generator.throw(error)
+            except StopIteration:
+                self._count(before, clock() - start)
+                return
+            elapsed = clock() - start
+            after = delegation_stack(generator, root)
+            self._count(before if len(before) >= len(after) else after, elapsed)
+            try:
+                value, error = (yield event), None
+            except BaseException as e:
+                value, error = None, e
+
+    def _count(self, stack:Tuple[str, ...], elapsed:float):
+        entry = self.stacks[stack]
+        entry[0] += 1
+        entry[1] += elapsed
+
+    def sample_queue(self):
+        while True:
+            self.queue_samples.append((self.env.now, queue_length(self.env)))
+            yield self.env.timeout(self.sample_interval)
+
+    # =============================================================================
+    # Reports
+    # =============================================================================
+    def handlers_df(self) -> pd.DataFrame:
+        """Resumptions and wall time (s) per process type and handler, the function the process delegates to
+        (e.g. the handler of an intent dispatched by `handle_inbox`) or the process itself, by decreasing time"""
+        rows = [{'process': stack[0], 'handler': stack[min(1, len(stack) - 1)], 'nb_events': n, 'wall_time': t} for stack, (n, t) in self.stacks.items()]
+        df = pd.DataFrame(rows, columns=['process', 'handler', 'nb_events', 'wall_time'])
+        df = df.groupby(['process', 'handler']).sum()
+        df['mean_us'] = 1e6 * df['wall_time'] / df['nb_events']
+        df['share'] = df['wall_time'] / df['wall_time'].sum()
+        return df.sort_values('wall_time', ascending=False)
+
+    def processes_df(self) -> pd.DataFrame:
+        """Resumptions and wall time (s) per process type, by decreasing time"""
+        df = self.handlers_df().groupby('process')[['nb_events', 'wall_time']].sum()
+        df['mean_us'] = 1e6 * df['wall_time'] / df['nb_events']
+        df['share'] = df['wall_time'] / df['wall_time'].sum()
+        return df.sort_values('wall_time', ascending=False)
+
+    def intents_df(self) -> pd.DataFrame:
+        """Number of messages handled per process type and intent"""
+        rows = [{'process': p, 'intent': i, 'nb_messages': n} for (p, i), n in self.intents.items()]
+        return pd.DataFrame(rows, columns=['process', 'intent', 'nb_messages']).sort_values('nb_messages', ascending=False, ignore_index=True)
+
+    def queue_df(self) -> pd.DataFrame:
+        """Length of the event queue, sampled over simulated time"""
+        return pd.DataFrame(self.queue_samples, columns=['timestamp', 'queue_length'])
+
+    def folded(self) -> str:
+        """Stacks in the folded format of flamegraph.pl and speedscope: one 'stack;of;handlers microseconds' per line"""
+        return '\n'.join(f"{';'.join(stack)} {round(1e6 * t)}" for stack, (n, t) in sorted(self.stacks.items()))
+
+    def write_folded(self, path:Path|str):
+        Path(path).write_text(self.folded() + '\n')
+
+    def report(self, top:int=20) -> str:
+        """Tabular report: time per process type, the `top` handlers, messages per intent and the event queue"""
+        queue = self.queue_df()['queue_length']
+        return '\n\n'.join([
+            self.processes_df().to_string(float_format=lambda v: f"{v:.4f}"),
+            self.handlers_df().head(top).to_string(float_format=lambda v: f"{v:.4f}"),
+            self.intents_df().to_string(index=False),
+            f"event queue: mean {queue.mean():.1f}, max {queue.max()}" if len(queue) else "event queue: not sampled",
+        ])
+
+
+def _intent(json_msg:str) -> str:
+    try:
+        return json.loads(json_msg).get('intent') or 'none'
+    except (ValueError, AttributeError):
+        return 'none'
+
+
+if __name__ == "__main__":
+    from crm import CustomerRelationManagerSimulator
+
+    profiler = Profiler()
+    crm = CustomerRelationManagerSimulator(profiler=profiler)
+    crm.run(until=52)
+    print(profiler.report())
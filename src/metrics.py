@@ -0,0 +1,153 @@
+import os
+import resource
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from enums import AccountStage
+
+
+def rss_mb() -> float:
+    """Current resident memory of the process in MB, from /proc when available, else its peak"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class MetricsExporter:
+    """Live metrics of a running simulation, in the Prometheus text format.
+
+    Once attached to a simulation (`attach`), a process of the simulation collects the metrics every `interval`
+    weeks of simulated time, and publishes them at most every `min_wall_interval` seconds:
+    - to the file `path`, replaced atomically so that a node exporter textfile collector never reads a partial file
+    - on http://localhost:`port`/metrics when a port is given (see `serve`)
+    Metrics are read from counters the simulation maintains anyway, except for the events scheduled in the
+    environment, counted by a wrapper of `env.schedule` installed by `attach`. Simulations without exporter are not
+    affected.
+    """
+
+    def __init__(self, path:Optional[Path|str]=None, port:Optional[int]=None, interval:float=1, min_wall_interval:float=1.0,
+                 prefix:str='crm_sim', labels:Optional[Dict[str, str]]=None):
+        self.path = Path(path) if path is not None else None
+        self.interval = interval
+        self.min_wall_interval = min_wall_interval
+        self.prefix = prefix
+        self.labels = labels or {}
+        self.text = ''
+        self.server = None
+        self.crm = None
+        self.nb_events = 0  # events scheduled since the exporter was attached
+        self._last:Optional[Tuple[float, float, int]] = None   # (wall time, simulated time, events) at the last publish
+        if port is not None:
+            self.serve(port)
+
+    def attach(self, crm):
+        """Start reporting the metrics of the simulation `crm`"""
+        self.crm = crm
+        self.labels.setdefault('simulation', crm.uid)
+        self.count_events(crm.env)
+        crm.env.process(self.report())
+        return self
+
+    def count_events(self, env):
+        """Count the events scheduled in `env` in `nb_events`"""
+        schedule = env.schedule
+
+        def counting_schedule(*args, **kwargs):
+            self.nb_events += 1
+            return schedule(*args, **kwargs)
+        env.schedule = counting_schedule
+
+    def report(self):
+        while True:
+            now = time.perf_counter()
+            if self._last is None or now - self._last[0] >= self.min_wall_interval:
+                self.publish()
+            yield self.crm.env.timeout(self.interval)
+
+    def collect(self) -> List[Tuple[str, str, str, Dict[str, str], float]]:
+        """Current metrics, as (name, type, help, labels, value)"""
+        crm, env = self.crm, self.crm.env
+        wall, events = time.perf_counter(), self.nb_events
+        if self._last is None:
+            weeks_per_sec = events_per_sec = 0.0
+        else:
+            elapsed = max(wall - self._last[0], 1e-9)
+            weeks_per_sec = (env.now - self._last[1]) / elapsed
+            events_per_sec = (events - self._last[2]) / elapsed
+        self._last = (wall, env.now, events)
+
+        per_stage = crm.account_counters.per_stage()
+        metrics = [
+            ('simulated_weeks', 'gauge', 'Simulated time in weeks', {}, env.now),
+            ('simulated_weeks_per_second', 'gauge', 'Simulated weeks per wall-clock second since the last report', {}, weeks_per_sec),
+            ('events_total', 'counter', 'Events scheduled in the simulation', {}, events),
+            ('events_per_second', 'gauge', 'Events per wall-clock second since the last report', {}, events_per_sec),
+            ('requests_in_flight', 'gauge', 'Accounts with a pending sales request', {}, len(crm.requests_in_progress)),
+            ('transactions_total', 'counter', 'Transactions in the transaction log', {}, len(crm.transactions)),
+            ('resident_memory_megabytes', 'gauge', 'Resident memory of the process', {}, rss_mb()),
+        ]
+        metrics += [('accounts', 'gauge', 'Accounts per stage', {'stage': stage.name}, per_stage.get(stage, 0)) for stage in AccountStage]
+        return metrics
+
+    def render(self) -> str:
+        """Metrics in the Prometheus text exposition format"""
+        lines, described = [], set()
+        for name, kind, help, labels, value in self.collect():
+            name = f"{self.prefix}_{name}"
+            if name not in described:
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+                described.add(name)
+            labels = {**self.labels, **labels}
+            label_str = ','.join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{name}{{{label_str}}} {value:g}" if label_str else f"{name} {value:g}")
+        return '\n'.join(lines) + '\n'
+
+    def publish(self):
+        """Collect the metrics, write them to the file and make them available to the HTTP endpoint"""
+        self.text = self.render()
+        if self.path is not None:
+            tmp = self.path.with_name(self.path.name + '.tmp')
+            tmp.write_text(self.text)
+            os.replace(tmp, self.path)
+
+    def serve(self, port:int, host:str='127.0.0.1'):
+        """Serve the last published metrics on http://host:port/metrics, from a daemon thread"""
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = exporter.text.encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def close(self):
+        """Publish the final metrics and stop the HTTP endpoint"""
+        if self.crm is not None:
+            self.publish()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+if __name__ == "__main__":
+    pass
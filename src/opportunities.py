@@ -0,0 +1,119 @@
+import numpy as np
+
+from typing import TYPE_CHECKING, Optional, Sequence
+
+from classes import Opportunity
+from enums import AccountType, OpportunityStage, enum_codes, enum_labels
+from tables import ColumnTable
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+OPEN_STAGES = [OpportunityStage.IDENTIFIED, OpportunityStage.PITCHED, OpportunityStage.BIDDED]
+CLOSED_STAGES = [OpportunityStage.CLOSED_WON, OpportunityStage.CLOSED_LOST, OpportunityStage.CLOSED_STALE]
+
+# Opportunity value range per account type, see `draw_values`, read from the opportunities of the agent model
+OPPORTUNITY_SIZES = {kind: (size['val_min'], size['val_max']) for kind, size in Opportunity._osizes.items()}
+
+
+def draw_values(account_types:Sequence[AccountType], sizes=None, alpha=2, beta=5, rng=None) -> np.ndarray:
+    """Draw one opportunity value per account type in one call, from a right-skewed beta distribution
+    scaled to the value range of each account type (same distribution as `utils.draw_value_beta`)"""
+    sizes = sizes or OPPORTUNITY_SIZES
+    rng = rng if rng is not None else np.random
+    bounds = np.array([sizes.get(t, (10_000, 100_000)) for t in account_types], dtype=float).reshape(-1, 2)
+    samples = rng.beta(alpha, beta, size=len(bounds))
+    return (bounds[:, 0] + samples * (bounds[:, 1] - bounds[:, 0])).astype(np.int64)
+
+
+class OpportunityTable(ColumnTable):
+    """Opportunities stored column-wise in numpy arrays, one row per opportunity with its integer id as row index.
+
+    Columns are the index of the account and of the sales rep (-1 when none), the value, the stage code
+    (see `enum_codes(OpportunityStage)`) and the creation and closing times (NaN while open).
+    Opportunities are created, advanced and closed in vectorized batches, and aggregated with `np.bincount`.
+    """
+
+    columns = {
+        'account': np.int64,
+        'salesrep': np.int32,
+        'value': np.int64,
+        'stage': np.int8,
+        'created_at': np.float64,
+        'closed_at': np.float64,
+    }
+
+    def __init__(self, capacity:int=1024):
+        super().__init__(capacity=capacity)
+        self._codes = enum_codes(OpportunityStage)
+
+    def create(self, accounts, values, t:float, salesreps=None, stage:OpportunityStage=OpportunityStage.BIDDED) -> np.ndarray:
+        """Create one opportunity per account index in `accounts`, with `values`, at time `t`. Returns their ids"""
+        accounts = np.atleast_1d(np.asarray(accounts, dtype=np.int64))
+        ids = self._append(len(accounts))
+        d = self._data
+        d['account'][ids] = accounts
+        d['salesrep'][ids] = -1 if salesreps is None else salesreps
+        d['value'][ids] = values
+        d['stage'][ids] = self._codes[stage]
+        d['created_at'][ids] = t
+        d['closed_at'][ids] = np.nan
+        return ids
+
+    def advance(self, ids, stage:OpportunityStage):
+        """Move the opportunities `ids` to an open `stage`"""
+        self._data['stage'][np.asarray(ids, dtype=np.int64)] = self._codes[stage]
+
+    def close(self, ids, stage:OpportunityStage, t:float):
+        """Close the opportunities `ids` as won, lost or stale at time `t`"""
+        if stage not in CLOSED_STAGES:
+            raise ValueError(f"{stage} is not a closing stage, expected one of {CLOSED_STAGES}")
+        ids = np.asarray(ids, dtype=np.int64)
+        self._data['stage'][ids] = self._codes[stage]
+        self._data['closed_at'][ids] = t
+
+    def is_open(self) -> np.ndarray:
+        """Mask of the opportunities still open"""
+        return self.stage < self._codes[CLOSED_STAGES[0]]
+
+    def open_ids_of(self, accounts) -> np.ndarray:
+        """Ids of the open opportunities of the account indices `accounts`"""
+        return np.flatnonzero(self.is_open() & np.isin(self.account, accounts))
+
+    def per_salesrep(self, nb_salesreps:Optional[int]=None) -> 'pd.DataFrame':
+        """Pipeline value, win rate and mean cycle time (creation to closing of won opportunities) per sales rep index"""
+        import pandas as pd
+
+        n = nb_salesreps or (int(self.salesrep.max()) + 1 if self.size else 0)
+        rep = self.salesrep
+        keep = rep >= 0
+        rep, value, stage = rep[keep], self.value[keep].astype(float), self.stage[keep]
+        is_open = stage < self._codes[CLOSED_STAGES[0]]
+        won = stage == self._codes[OpportunityStage.CLOSED_WON]
+        lost = (stage == self._codes[OpportunityStage.CLOSED_LOST]) | (stage == self._codes[OpportunityStage.CLOSED_STALE])
+        cycle = (self.closed_at - self.created_at)[keep]
+
+        nb_won = np.bincount(rep, weights=won, minlength=n)
+        nb_closed = nb_won + np.bincount(rep, weights=lost, minlength=n)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            df = pd.DataFrame({
+                'nb_open': np.bincount(rep, weights=is_open, minlength=n).astype(np.int64),
+                'pipeline_value': np.bincount(rep, weights=value * is_open, minlength=n),
+                'nb_won': nb_won.astype(np.int64),
+                'won_value': np.bincount(rep, weights=value * won, minlength=n),
+                'win_rate': nb_won / nb_closed,
+                'cycle_time': np.bincount(rep, weights=np.where(won, cycle, 0), minlength=n) / nb_won,
+            })
+        return df.rename_axis('salesrep')
+
+    def to_df(self) -> 'pd.DataFrame':
+        """All opportunities, with the stage as categorical column"""
+        import pandas as pd
+
+        df = pd.DataFrame({col: getattr(self, col) for col in self.columns if col != 'stage'})
+        df.insert(3, 'stage', pd.Categorical.from_codes(self.stage, categories=enum_labels(OpportunityStage)))
+        return df.rename_axis('id')
+
+
+if __name__ == "__main__":
+    pass
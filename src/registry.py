@@ -0,0 +1,69 @@
+from typing import Dict, Iterable, List, Optional
+from uuid import UUID, uuid4, uuid5
+
+
+class AgentRegistry:
+    """Dense integer ids for the CRM and its agents, used in messages, transactions and lookups.
+
+    The uid string of an agent (e.g. 'acct-<uuid>') is only materialized when requested, for export
+    or display. It is derived from the id and a random namespace drawn once per registry, so that it is
+    the same in forked branches and restored checkpoints of a simulation. Ids are never reused: the slot
+    of a removed agent is set to None, while its uid remains available for exports of past transactions.
+    """
+
+    prefixes = {'crm': 'crm', 'marketing': 'mktg', 'salesrep': 'srep', 'account': 'acct'}
+
+    def __init__(self, namespace:Optional[UUID]=None):
+        self.namespace = namespace or uuid4()
+        self.agents:List[Optional[object]] = []    # id -> agent, None once removed
+        self.categories:List[str] = []              # id -> category
+        self._uids:Dict[int, str] = {}              # id -> uid, cache of materialized uids
+
+    def add(self, agent, category:str) -> int:
+        """Register `agent` and return its id"""
+        self.agents.append(agent)
+        self.categories.append(category)
+        return len(self.agents) - 1
+
+    def remove(self, aid:int):
+        self.agents[aid] = None
+
+    def __getitem__(self, aid:int):
+        return self.agents[aid]
+
+    def get(self, aid:int):
+        """Agent with id `aid`, None when removed or unknown"""
+        return self.agents[aid] if 0 <= aid < len(self.agents) else None
+
+    def __len__(self):
+        return len(self.agents)
+
+    def uid(self, aid:int) -> str:
+        """Uid string of the agent with id `aid`, materialized on first request"""
+        uid = self._uids.get(aid)
+        if uid is None:
+            uid = self._uids[aid] = f"{self.prefixes.get(self.categories[aid], 'agent')}-{uuid5(self.namespace, str(aid))}"
+        return uid
+
+    def uids(self, aids:Iterable[int]) -> List[str]:
+        """Uid strings of the ids `aids`, e.g. to export the senders and receivers of transactions"""
+        uid = self.uid
+        return [uid(aid) for aid in aids]
+
+    def state(self) -> dict:
+        """Namespace and categories, see `restore`"""
+        return {'namespace': self.namespace, 'categories': list(self.categories)}
+
+    @classmethod
+    def restore(cls, state:dict, agents:Iterable) -> 'AgentRegistry':
+        """Rebuild a registry from its `state` and the `agents` still registered, which carry their id as `aid`"""
+        registry = cls(namespace=state['namespace'])
+        registry.categories = list(state['categories'])
+        registry.agents = [None] * len(registry.categories)
+        for agent in agents:
+            registry.agents[agent.aid] = agent
+        return registry
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,219 @@
+import multiprocessing
+import os
+import numpy as np
+import pandas as pd
+
+from typing import Any, Dict, List, Optional, Sequence
+
+from aggregators import Histogram, QuantileSketch, RunningStats
+from enums import AccountStage
+from scenarios import compute_kpis, run_scenario
+
+STATS_COLUMNS = ['nb_accounts'] + [s.name for s in AccountStage]
+
+
+class ReplicationSummary:
+    """Streaming summary of the replications of a scenario, updated after each run and mergeable across workers.
+
+    Keeps, for the weekly number of accounts per stage and for the KPIs of each run:
+    - mean and variance (`RunningStats`), for means and confidence intervals
+    - quantile sketches (`QuantileSketch`), for quantile bands
+    - optionally, per week histograms of accounts per stage over `hist_edges`
+    Memory does not depend on the number of replications.
+    """
+
+    def __init__(self, quantiles:Sequence[float]=(0.05, 0.5, 0.95), relative_accuracy:float=0.01, hist_edges:Optional[Sequence[float]]=None):
+        self.quantiles = tuple(quantiles)
+        self.relative_accuracy = relative_accuracy
+        self.nb_replications = 0
+        self.timestamps:Optional[np.ndarray] = None
+        self.weekly = RunningStats()
+        self.weekly_sketches:Optional[List[QuantileSketch]] = None     # one per week and column, flattened
+        self.weekly_hist = Histogram(hist_edges) if hist_edges is not None else None
+        self.kpis:Dict[str, RunningStats] = {}
+        self.kpi_sketches:Dict[str, QuantileSketch] = {}
+        self.converged:Optional[bool] = None  # whether the precision targets were met, see `run_until_precise`
+
+    def update(self, crm, kpis:Optional[Dict[str, float]]=None):
+        """Add the results of one run of the simulation `crm`"""
+        df = crm.account_stats_to_df(int_idx=True)
+        values = df[STATS_COLUMNS].to_numpy(dtype=float)
+        if self.timestamps is None:
+            self.timestamps = df['timestamp'].to_numpy()
+            self.weekly_sketches = [QuantileSketch(self.relative_accuracy) for _ in range(values.size)]
+        elif not np.array_equal(self.timestamps, df['timestamp'].to_numpy()):
+            raise ValueError("All replications must run over the same weeks")
+        self.weekly.update(values)
+        for sketch, v in zip(self.weekly_sketches, values.ravel()):
+            sketch.add(v)
+        if self.weekly_hist is not None:
+            self.weekly_hist.update(values)
+
+        for kpi, value in (kpis or {}).items():
+            self.kpis.setdefault(kpi, RunningStats()).update(value)
+            self.kpi_sketches.setdefault(kpi, QuantileSketch(self.relative_accuracy)).add(value)
+        self.nb_replications += 1
+
+    def merge(self, other:'ReplicationSummary') -> 'ReplicationSummary':
+        """Combine the replications summarized in `other` into this summary. The merged summary is converged when
+    both are, see `run_until_precise`"""
+        if other.timestamps is None:
+            return self
+        if self.timestamps is None:
+            self.timestamps = other.timestamps
+            self.weekly_sketches = [QuantileSketch(self.relative_accuracy) for _ in other.weekly_sketches]
+        elif not np.array_equal(self.timestamps, other.timestamps):
+            raise ValueError("Cannot merge summaries over different weeks")
+        self.weekly.merge(other.weekly)
+        for sketch, o in zip(self.weekly_sketches, other.weekly_sketches):
+            sketch.merge(o)
+        if self.weekly_hist is not None and other.weekly_hist is not None:
+            self.weekly_hist.merge(other.weekly_hist)
+        for kpi, stats in other.kpis.items():
+            self.kpis.setdefault(kpi, RunningStats()).merge(stats)
+            self.kpi_sketches.setdefault(kpi, QuantileSketch(self.relative_accuracy)).merge(other.kpi_sketches[kpi])
+        self.nb_replications += other.nb_replications
+        if other.converged is not None:
+            self.converged = other.converged if self.converged is None else self.converged and other.converged
+        return self
+
+    def weekly_summary(self, confidence:float=0.95) -> pd.DataFrame:
+        """Weekly mean, std, confidence interval and quantiles of the number of accounts, per stage"""
+        shape = self.weekly.mean.shape
+        low, high = self.weekly.ci(confidence)
+        columns = {'mean': self.weekly.mean, 'std': self.weekly.std, 'ci_low': low, 'ci_high': high}
+        for q in self.quantiles:
+            columns[f"q{q:g}"] = np.array([s.quantile(q) for s in self.weekly_sketches]).reshape(shape)
+        index = pd.MultiIndex.from_product([self.timestamps, STATS_COLUMNS], names=['timestamp', 'stage'])
+        return pd.DataFrame({k: v.ravel() for k, v in columns.items()}, index=index)
+
+    def kpi_summary(self, confidence:float=0.95) -> pd.DataFrame:
+        """Mean, std, confidence interval and quantiles of each KPI over the replications"""
+        rows = {}
+        for kpi, stats in self.kpis.items():
+            low, high = stats.ci(confidence)
+            rows[kpi] = {'mean': float(stats.mean), 'std': float(stats.std), 'ci_low': float(low), 'ci_high': float(high), 'n': int(stats.n)}
+            rows[kpi].update({f"q{q:g}": self.kpi_sketches[kpi].quantile(q) for q in self.quantiles})
+        return pd.DataFrame.from_dict(rows, orient='index').rename_axis('kpi')
+
+    def half_width(self, kpi:str, confidence:float=0.95, relative=False) -> float:
+        """Half-width of the confidence interval of the mean of `kpi`, relative to the absolute mean if `relative`"""
+        stats = self.kpis[kpi]
+        if stats.n < 2:
+            return np.inf
+        low, high = stats.ci(confidence)
+        half_width = float(high - low) / 2
+        if relative:
+            return half_width / abs(float(stats.mean)) if stats.mean != 0 else (0.0 if half_width == 0 else np.inf)
+        return half_width
+
+    def plot_account_stats(self, stages:Optional[Sequence[str]]=None, band='ci', confidence:float=0.95):
+        """Plot the mean number of accounts per stage over time, with a band per stage:
+        the confidence interval of the mean (`band='ci'`) or the range between the extreme quantiles (`band='quantiles'`)"""
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
+        stages = list(stages or ['PROSPECT', 'PITCHED', 'BIDDED', 'SIGNED', 'STALE'])
+        df = self.weekly_summary(confidence=confidence)
+        low_col, high_col = ('ci_low', 'ci_high') if band == 'ci' else (f"q{min(self.quantiles):g}", f"q{max(self.quantiles):g}")
+        colors = sns.color_palette("tab10", n_colors=len(stages))
+
+        plt.figure(figsize=(8,4))
+        for i, stage in enumerate(stages):
+            d = df.xs(stage, level='stage')
+            plt.plot(d.index, d['mean'], label=stage, color=colors[i])
+            plt.fill_between(d.index, d[low_col], d[high_col], color=colors[i], alpha=0.2)
+
+        plt.xlabel("Week")
+        plt.ylabel("Number Accounts")
+        what = f"{confidence:.0%} CI" if band == 'ci' else f"{min(self.quantiles):g}-{max(self.quantiles):g} quantiles"
+        plt.title(f"Account per Stages over {self.nb_replications} Replications (mean and {what})")
+        plt.legend(title="Stage", bbox_to_anchor=(1.05, 1), loc='upper left')
+        plt.tight_layout()
+        plt.show()
+
+
+def _replication_chunk(task):
+    params, until, seeds, summary_kwargs = task
+    summary = ReplicationSummary(**summary_kwargs)
+    for seed in seeds:
+        run_scenario(params, until=until, seed=seed, collect=lambda crm: summary.update(crm, compute_kpis(crm)))
+    return summary
+
+
+def run_replications(
+    params:Dict[str, Any],
+    until:int,
+    replications:int,
+    seed:int=0,
+    processes:Optional[int]=None,
+    **summary_kwargs,
+    ) -> ReplicationSummary:
+    """Run `replications` of the scenario `params` (see `run_scenario`) in a worker pool, and summarize them.
+
+    Replication r uses the seed `seed + r`. Each worker summarizes its share of the replications as it goes,
+    and the worker summaries are merged at the end, so that no run results are kept in memory.
+    `summary_kwargs` are passed to `ReplicationSummary`.
+    """
+    processes = processes or min(replications, os.cpu_count() or 1)
+    seeds = [seed + r for r in range(replications)]
+    tasks = [(params, until, seeds[i::processes], summary_kwargs) for i in range(processes)]
+    summary = ReplicationSummary(**summary_kwargs)
+    with multiprocessing.Pool(processes=processes) as pool:
+        for chunk in pool.imap_unordered(_replication_chunk, tasks):
+            summary.merge(chunk)
+    return summary
+
+
+DEFAULT_PRECISION_TARGETS = {
+    'closed_won_value': 0.05,
+    'sql_to_signed': 0.05,
+    'stage_SIGNED': 0.05,
+}
+
+def run_until_precise(
+    params:Dict[str, Any],
+    until:int,
+    targets:Optional[Dict[str, float]]=None,
+    relative=True,
+    confidence:float=0.95,
+    min_replications:int=4,
+    max_replications:int=200,
+    batch_size:Optional[int]=None,
+    seed:int=0,
+    processes:Optional[int]=None,
+    verbose=False,
+    **summary_kwargs,
+    ) -> ReplicationSummary:
+    """Run replications of the scenario `params` in batches until the KPIs reach a target precision.
+
+    `targets` maps KPIs to the maximum half-width of the confidence interval of their mean, relative to
+    the mean when `relative` is True (default: 5% on closed-won value, SQL to SIGNED conversion and
+    signed accounts at the horizon). After at least `min_replications`, replications stop as soon as all
+    targets are met, or when `max_replications` is reached. Each batch runs `batch_size` replications
+    (default: one per worker) across the pool. Replication r uses the seed `seed + r`, as in `run_replications`.
+    The returned summary has `converged` set to whether all targets were met.
+    """
+    targets = targets or DEFAULT_PRECISION_TARGETS
+    processes = processes or os.cpu_count() or 1
+    batch_size = batch_size or processes
+    summary = ReplicationSummary(**summary_kwargs)
+    summary.converged = False
+    with multiprocessing.Pool(processes=processes) as pool:
+        while summary.nb_replications < max_replications:
+            start = seed + summary.nb_replications
+            n = min(max(batch_size, min_replications - summary.nb_replications), max_replications - summary.nb_replications)
+            seeds = list(range(start, start + n))
+            tasks = [(params, until, seeds[i::processes], summary_kwargs) for i in range(min(processes, n))]
+            for chunk in pool.imap_unordered(_replication_chunk, tasks):
+                summary.merge(chunk)
+            half_widths = {kpi: summary.half_width(kpi, confidence, relative=relative) for kpi in targets}
+            if verbose:
+                print(f"{summary.nb_replications} replications: " + ", ".join(f"{k}={v:.3g}" for k, v in half_widths.items()))
+            if summary.nb_replications >= min_replications and all(half_widths[kpi] <= t for kpi, t in targets.items()):
+                summary.converged = True
+                break
+    return summary
+
+if __name__ == "__main__":
+    pass
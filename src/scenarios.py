@@ -0,0 +1,285 @@
+import io
+import multiprocessing
+import os
+import random
+import numpy as np
+import pandas as pd
+
+from contextlib import redirect_stdout
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import agents
+from agents import Account, SalesRep, MarketingDpt
+from enums import AccountStage, Actions, BusinessValues, SalesIntents
+
+# Roots of the dotted paths used to address simulation parameters
+PATH_ROOTS = {
+    'Account': Account,
+    'SalesRep': SalesRep,
+    'MarketingDpt': MarketingDpt,
+    'agents': agents,
+}
+_MISSING = object()
+
+
+def _resolve_key(container:dict, key:str):
+    """Return the key of `container` matching `key`, either as is or by enum member name"""
+    if key in container:
+        return key
+    for k in container:
+        if isinstance(k, Enum) and k.name == key:
+            return k
+    return key
+
+
+def resolve_targets(crm, path:str) -> List[Tuple[Any, Any]]:
+    """Resolve a dotted `path` into the list of (container, key) it addresses in the simulation `crm`.
+
+    The first part of the path is either `crm` (the simulator), `agents` (module level parameters),
+    or an agent class (`Account`, `SalesRep`, `MarketingDpt`). For agent classes, instance attributes
+    address every instance of the class in the CRM, other attributes address the class itself.
+    The following parts are attributes or dict keys, where enum keys are addressed by member name:
+    e.g. 'Account.sales_conversion_rates.negotiation', 'SalesRep.wkly_review_needs' or
+    'Account.conversion_factors.country.US'.
+    """
+    root, *parts = path.split('.')
+    if not parts:
+        raise ValueError(f"Path '{path}' must have at least one attribute after its root")
+    if root == 'crm':
+        objs = [crm]
+    elif root in PATH_ROOTS:
+        obj = PATH_ROOTS[root]
+        instances = [a for a in crm.agents.get(getattr(obj, '_category', None), [])] if isinstance(obj, type) else []
+        if instances and parts[0] in vars(instances[0]):
+            objs = instances
+        else:
+            objs = [obj]
+    else:
+        raise ValueError(f"Unknown root '{root}' in path '{path}', expected 'crm' or one of {list(PATH_ROOTS)}")
+
+    targets = []
+    for obj in objs:
+        container = obj
+        for part in parts[:-1]:
+            if isinstance(container, dict):
+                container = container[_resolve_key(container, part)]
+            else:
+                container = getattr(container, part)
+        key = _resolve_key(container, parts[-1]) if isinstance(container, dict) else parts[-1]
+        targets.append((container, key))
+    return targets
+
+
+def apply_overrides(crm, overrides:Dict[str, Any]) -> List[Tuple[Any, Any, Any]]:
+    """Set each parameter addressed by a dotted path in `overrides` (see `resolve_targets`).
+
+    Returns the list of previous values, to revert the overrides with `revert_overrides`.
+    """
+    previous = []
+    for path, value in overrides.items():
+        for container, key in resolve_targets(crm, path):
+            if isinstance(container, dict):
+                previous.append((container, key, container.get(key, _MISSING)))
+                container[key] = value
+            else:
+                previous.append((container, key, getattr(container, key, _MISSING)))
+                setattr(container, key, value)
+    Account.build_conversion_factor_table()
+    return previous
+
+
+def revert_overrides(previous:List[Tuple[Any, Any, Any]]):
+    """Revert overrides applied by `apply_overrides`, from the list of previous values it returned"""
+    for container, key, value in reversed(previous):
+        if isinstance(container, dict):
+            if value is _MISSING: container.pop(key, None)
+            else: container[key] = value
+        else:
+            if value is _MISSING: delattr(container, key)
+            else: setattr(container, key, value)
+    Account.build_conversion_factor_table()
+
+
+def collect_results(crm, start:int) -> Dict[str, pd.DataFrame]:
+    """Default results of a branch: weekly account stats, transactions since the fork and accounts at the end"""
+    transactions = pd.DataFrame(crm.transactions[start:])
+    if len(transactions):
+        transactions['sender'] = crm.registry.uids(transactions['sender'])
+        transactions['receiver'] = crm.registry.uids(transactions['receiver'])
+    return {
+        'account_stats': crm.account_stats_to_df(int_idx=True),
+        'transactions': transactions,
+        'accounts': crm.account_df(),
+    }
+
+
+def compute_kpis(crm) -> Dict[str, float]:
+    """Key performance indicators of a simulation, computed in one pass over its transactions.
+
+    - closed_won_value: total purchase value
+    - nb_closed_won: number of accounts transitioning from BIDDED to SIGNED
+    - opportunity_value: total forecasted opportunity value
+    - sql_to_signed: nb_closed_won over the number of distinct accounts engaged at SQL stage
+    - stage_<STAGE>: number of accounts per stage at the end of the simulation
+    """
+    closed_won_value, nb_closed_won, opportunity_value = 0, 0, 0
+    engaged_sql = set()
+    for t in crm.transactions:
+        intent = t['intent']
+        if intent == BusinessValues.PURCHASE.value:
+            closed_won_value += t['value']
+        elif intent == BusinessValues.OPPORTUNITY.value:
+            opportunity_value += t['value']
+        elif intent == 'BIDDED to SIGNED' and t['type'] == 'system':
+            nb_closed_won += 1
+        elif intent == SalesIntents.USER_NEED.value and t['action'] == Actions.REQUEST.value:
+            engaged_sql.add(t['receiver'])
+    kpis = {
+        'closed_won_value': closed_won_value,
+        'nb_closed_won': nb_closed_won,
+        'opportunity_value': opportunity_value,
+        'sql_to_signed': nb_closed_won / len(engaged_sql) if engaged_sql else np.nan,
+    }
+    per_stage = crm.account_counters.per_stage()
+    kpis.update({f"stage_{stage.name}": per_stage.get(stage, 0) for stage in AccountStage})
+    return kpis
+
+
+def run_scenario(params:Dict[str, Any], until:int, seed:Optional[int]=None, collect:Callable=compute_kpis, verbose=False):
+    """Build, run and collect the results of one scenario from scratch.
+
+    `params` are parameter overrides addressed by dotted path (see `resolve_targets`), plus the
+    keyword arguments of the simulator constructor addressed as 'init.<kwarg>', e.g. 'init.nb_salesreps'.
+    Overrides are reverted after the run, so that consecutive scenarios in one process do not interfere.
+    """
+    from crm import CustomerRelationManagerSimulator
+
+    init = {path.split('.', 1)[1]: v for path, v in params.items() if path.startswith('init.')}
+    overrides = {path: v for path, v in params.items() if not path.startswith('init.')}
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+    previous = []
+    try:
+        if verbose:
+            crm = CustomerRelationManagerSimulator(**init)
+        else:
+            with redirect_stdout(io.StringIO()):
+                crm = CustomerRelationManagerSimulator(**init)
+        previous = apply_overrides(crm, overrides)
+        crm.run(until=until)
+        return collect(crm)
+    finally:
+        revert_overrides(previous)
+
+
+# State shared with the forked branches, inherited by the child processes instead of pickled
+_FORK_STATE = {}
+
+def _run_branch(task):
+    i, (name, overrides) = task
+    crm, until, seed = _FORK_STATE['crm'], _FORK_STATE['until'], _FORK_STATE['seed']
+    if seed is not None:
+        random.seed(seed + i)
+        np.random.seed(seed + i)
+    start = len(crm.transactions)
+    apply_overrides(crm, overrides)
+    crm.run(until=until)
+    return name, _FORK_STATE['collect'](crm, start)
+
+
+def fork_scenarios(
+    crm,
+    scenarios:Dict[str, Dict[str, Any]],
+    until:int,
+    collect:Optional[Callable]=None,
+    processes:Optional[int]=None,
+    seed:Optional[int]=None,
+    ) -> Dict[str, Any]:
+    """Branch the simulation `crm` into one forked process per scenario, and run all branches in parallel.
+
+    Each scenario is a dict of parameter overrides addressed by dotted path (see `apply_overrides`).
+    Branches start from the current state of `crm`, shared copy-on-write with the parent process,
+    and run until `until`. `collect(crm, start)` builds the result of each branch, where `start` is the
+    number of transactions at the fork (default: `collect_results`). With `seed` None, all branches
+    continue the random streams of `crm`, otherwise branch i is seeded with `seed + i`.
+
+    Requires the 'fork' start method, i.e. Linux or macOS.
+    """
+    ctx = multiprocessing.get_context('fork')
+    _FORK_STATE.update(crm=crm, until=until, seed=seed, collect=collect or collect_results)
+    processes = processes or min(len(scenarios), os.cpu_count() or 1)
+    try:
+        # One task per child, so that each branch is forked from the untouched state of crm
+        with ctx.Pool(processes=processes, maxtasksperchild=1) as pool:
+            results = pool.map(_run_branch, list(enumerate(scenarios.items())), chunksize=1)
+    finally:
+        _FORK_STATE.clear()
+    return dict(results)
+
+
+def _compare_task(task):
+    arm, replication, params, until, seed, crn_seed = task
+    params = {**params, 'init.crn_seed': crn_seed} if crn_seed is not None else params
+    return arm, replication, run_scenario(params, until=until, seed=seed, collect=compute_kpis)
+
+
+def paired_deltas(baseline:pd.DataFrame, variant:pd.DataFrame, confidence:float=0.95) -> pd.DataFrame:
+    """Mean and confidence interval of the difference variant - baseline for each KPI.
+
+    `baseline` and `variant` have one row per replication and one column per KPI, with rows paired by index.
+    """
+    from scipy import stats
+
+    delta = variant - baseline
+    n = delta.notna().sum()
+    mean, std = delta.mean(), delta.std(ddof=1)
+    half_width = stats.t.ppf((1 + confidence) / 2, n - 1) * std / np.sqrt(n)
+    return pd.DataFrame({
+        'baseline': baseline.mean(),
+        'variant': variant.mean(),
+        'delta': mean,
+        'std_delta': std,
+        'ci_low': mean - half_width,
+        'ci_high': mean + half_width,
+        'n': n,
+    }).rename_axis('kpi')
+
+
+def compare_scenarios(
+    baseline:Dict[str, Any],
+    variant:Dict[str, Any],
+    until:int,
+    replications:int=10,
+    seed:int=0,
+    crn:bool=True,
+    confidence:float=0.95,
+    processes:Optional[int]=None,
+    ) -> pd.DataFrame:
+    """Compare two scenarios over `replications` paired runs, and return the paired KPI deltas (see `paired_deltas`).
+
+    With `crn` True, both runs of replication r share the seed `seed + r` for the simulation set up and for
+    the common random numbers, i.e. one random stream per account and decision (see `RandomStreams`).
+    The noise then mostly cancels out in the deltas, and far fewer replications are needed for a
+    significant difference than with independent runs. With `crn` False, both arms use independent seeds.
+    """
+    tasks = []
+    for r in range(replications):
+        for arm, params in (('baseline', baseline), ('variant', variant)):
+            if crn:
+                tasks.append((arm, r, params, until, seed + r, seed + r))
+            else:
+                tasks.append((arm, r, params, until, seed + 2 * r + (arm == 'variant'), None))
+    processes = processes or min(len(tasks), os.cpu_count() or 1)
+    with multiprocessing.Pool(processes=processes) as pool:
+        results = pool.map(_compare_task, tasks)
+    kpis = {
+        arm: pd.DataFrame({r: kpis for a, r, kpis in results if a == arm}).T.sort_index()
+        for arm in ('baseline', 'variant')
+    }
+    return paired_deltas(kpis['baseline'], kpis['variant'], confidence=confidence)
+
+
+if __name__ == "__main__":
+    pass
@@ -1,9 +1,6 @@
-import matplotlib.pyplot as plt
 import pandas as pd
-import pysd
 
 from pathlib import Path
-from pysd.py_backend.output import ModelOutput
 
 import warnings
 # warnings.filterwarnings('ignore')
@@ -29,6 +26,8 @@ class SDModel:
     assert p2model.is_file(), f"Model file {p2model} does not exist."
 
     def __init__(self, p2model=None, final_time=200, params=None):
+        import pysd
+
         if p2model is not None:
             self.p2model = Path(p2model)
             assert p2model.suffix == '.mdl', f"Expected model file to have .mdl extension, got {p2model.suffix}."
@@ -42,6 +41,9 @@ class SDModel:
         self.p2model.with_suffix('.pic').unlink(missing_ok=True)  
 
     def steps(self, num_steps=1, params=None):
+        import pysd
+        from pysd.py_backend.output import ModelOutput
+
         model = pysd.load(self.p2model.with_suffix('.py'))
         output = ModelOutput()
         if self.p2model.with_suffix('.pic').exists():
@@ -67,6 +69,13 @@ class SDModel:
             # concatenate new results to existing results, dropping the first row of new result equal to last row
             self.all_results_df = pd.concat([self.all_results_df, self.step_results_df.iloc[1:,]])
 
+    def run(self, params=None, initial_condition=None):
+        """Run the model from its initial time to `final_time` in one go, with `params` on top of `self.params`,
+        and optionally the initial values of some stocks in `initial_condition`, e.g. {'mql': 500}"""
+        kwargs = {} if initial_condition is None else {'initial_condition': (0, initial_condition)}
+        self.all_results_df = self.model.run(params={**self.params, **(params or {})}, final_time=self.final_time, **kwargs)
+        return self.all_results_df
+
     def parse_stocks(self):
         raise NotImplementedError("This method is not implemented yet. Please implement the parse_stocks method to extract stock variables from the model.")
 
@@ -75,6 +84,8 @@ class SDModel:
             print("No results to plot. Please run the model first.")
             return
         else:
+            import matplotlib.pyplot as plt
+
             fig, ax = plt.subplots(figsize=figsize)
             self.all_results_df[coi].plot(ax=ax)
             plt.title(title)
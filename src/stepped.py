@@ -0,0 +1,328 @@
+import heapq
+import inspect
+import io
+import numpy as np
+import pandas as pd
+import random
+
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence
+
+from agents import Account, MarketingDpt
+from enums import AccountStage, AccountType, Country, Industry, LeadSource
+from enums import MktgIntents, SalesIntents, OpsIntents, enum_codes
+from opportunities import OpportunityStage, OpportunityTable
+from tables import AccountTable
+from utils import ROOT
+
+CODES = enum_codes(AccountStage)
+
+# Weekly request loops of the sales reps, in the order of SalesRep processes:
+# (intent, stage of the targeted accounts, stage on accept, stage on reject)
+SALES_STEPS = [
+    (SalesIntents.USER_NEED.value, AccountStage.SQL, AccountStage.PROSPECT, AccountStage.SQL),
+    (SalesIntents.PRESENTATION.value, AccountStage.PROSPECT, AccountStage.PITCHED, AccountStage.SQL),
+    (SalesIntents.BID.value, AccountStage.PITCHED, AccountStage.BIDDED, AccountStage.SQL),
+    (SalesIntents.NEGO.value, AccountStage.BIDDED, AccountStage.SIGNED, AccountStage.SQL),
+    (OpsIntents.FEEDBACK_AT_COMPLETION.value, AccountStage.SIGNED, AccountStage.PROSPECT, AccountStage.STALE),
+]
+EMAIL = MktgIntents.EMAIL_CAMPAIGN.value
+
+
+class SteppedCRMSimulator:
+    """Time-stepped version of `CustomerRelationManagerSimulator`, advancing in weekly ticks.
+
+    The model is the same, with the parameters read from `Account` and `MarketingDpt`, but each tick resolves
+    the activity of all accounts at once on an `AccountTable`:
+    - weekly stats, recorded before the events of the week as in the event-driven engine
+    - requests of all sales reps for each stage, with the accept/reject decisions drawn in one call
+    - replies, with the transitions, opportunities and purchases of all replying accounts, MQL arrivals and
+      industry events due within the week, in time order
+    Sales reps sample their targets without replacement among the accounts without pending request, so that the
+    requests of all sales reps for a stage are one sample split between them. As in the event-driven engine, where
+    the weekly loops pick their targets before the replies due at the same time are processed, replies due on a
+    week boundary are applied after the requests of that week.
+
+    No transactions are recorded: KPIs are accumulated as the simulation goes (see `kpis`).
+    See `compare_engines` for the validation against the event-driven engine.
+    """
+
+    def __init__(self, nb_salesreps=5, nb_mql=20, nb_sql=20, nb_others=15, industry_events=False, seed:Optional[int]=None):
+        self.rng = np.random.default_rng(seed)
+        self.now = 0
+        self.nb_salesreps = nb_salesreps
+        self.industry_events = industry_events
+        self.mql_arrival_rate = 2 / 4  # 2 new MQL per month
+        self.weekly_requests = {intent: 2 for intent, *_ in SALES_STEPS}  # per sales rep, as in SalesRep
+        self.marketing_parameters = {k: dict(v) for k, v in MarketingDpt.default_marketing_parameters.items()}
+        self.next_campaign_at = 0
+        self.next_industry_event_at = self.compute_time_to_next_event() if industry_events else None
+
+        self.account_table = AccountTable()
+        self.opportunities = OpportunityTable()
+        self.opportunity_id = np.full(self.account_table._data['aid'].shape, -1, dtype=np.int64)
+        self.engaged_sql = np.zeros(self.opportunity_id.shape, dtype=bool)
+        self.pending = []   # heap of (due, seq, intent, rows, accepted) for replies not yet applied
+        self._seq = 0
+        self.nb_events = 0  # requests and replies, the counterpart of the transactions of the event-driven engine
+        self.account_stats:List[dict] = []
+        self.totals = {'closed_won_value': 0, 'nb_closed_won': 0, 'opportunity_value': 0}
+        self._load_account_infos()
+        self.setup_accounts(nb_mql, nb_sql, nb_others)
+
+    # =============================================================================
+    # Accounts
+    # =============================================================================
+    def _load_account_infos(self):
+        """Country and industry codes of the account info table, shuffled, drawn in sequence as `account_info_generator`"""
+        df = pd.read_csv(ROOT / 'data/account-info-clean.tsv', sep='\t', usecols=['Country', 'Industry'])
+        df = df.sample(frac=1, random_state=int(self.rng.integers(2**32))).reset_index(drop=True)
+        country, industry = enum_codes(Country), enum_codes(Industry)
+        self._countries = np.array([country[getattr(Country, c, Country.EU)] for c in df['Country']], dtype=np.int8)
+        self._industries = np.array([industry[getattr(Industry, i, Industry.ConsumerGoods)] for i in df['Industry']], dtype=np.int8)
+        self.nb_account_infos = 0
+
+    def setup_accounts(self, nb_mql, nb_sql, nb_others=15):
+        """Initialize accounts, with the same number per stage as `CustomerRelationManagerSimulator.setup_accounts`"""
+        nb_others = int(nb_others)
+        for nb, stage in [
+            (int(nb_mql), AccountStage.MQL),
+            (int(nb_sql), AccountStage.SQL),
+            (nb_others, AccountStage.PROSPECT),
+            (int(nb_others * .70), AccountStage.PITCHED),
+            (int(nb_others * .60), AccountStage.BIDDED),
+            (int(nb_others * .35), AccountStage.SIGNED),
+        ]:
+            self.add_accounts(nb, stage)
+
+    def add_accounts(self, nb_accounts:int, stage:AccountStage, lead_source:Optional[LeadSource]=None) -> np.ndarray:
+        """Create a batch of accounts at `stage`, with sales reps assigned round robin over the batch. Returns their rows"""
+        if nb_accounts <= 0:
+            return np.empty(0, dtype=np.int64)
+        infos = (self.nb_account_infos + np.arange(nb_accounts)) % len(self._countries)
+        self.nb_account_infos += nb_accounts
+        lead_sources = (
+            self.rng.integers(len(LeadSource), size=nb_accounts) if lead_source is None
+            else enum_codes(LeadSource)[lead_source]
+        )
+        rows = self.account_table.extend(
+            nb_accounts,
+            stage=CODES[stage],
+            account_type=self.rng.integers(len(AccountType), size=nb_accounts),
+            country=self._countries[infos],
+            industry=self._industries[infos],
+            lead_source=lead_sources,
+            salesrep=np.arange(nb_accounts) % self.nb_salesreps if stage != AccountStage.LEAD else -1,
+        )
+        rows_capacity = len(self.account_table._data['aid'])
+        if rows_capacity > len(self.opportunity_id):
+            self.opportunity_id = np.concatenate([self.opportunity_id, np.full(rows_capacity - len(self.opportunity_id), -1)])
+            self.engaged_sql = np.concatenate([self.engaged_sql, np.zeros(rows_capacity - len(self.engaged_sql), dtype=bool)])
+        self.account_table.aid[rows] = rows
+        return rows
+
+    # =============================================================================
+    # Requests and replies
+    # =============================================================================
+    def schedule_replies(self, intent:str, rows:np.ndarray, accepted:np.ndarray, delay:float):
+        """Schedule the replies of the accounts `rows` to `intent` after `delay`"""
+        heapq.heappush(self.pending, (self.now + delay, self._seq, intent, rows, accepted))
+        self._seq += 1
+        self.nb_events += 2 * len(rows)
+
+    def send_sales_requests(self):
+        """Requests of all sales reps for each stage, with the replies of the accounts drawn at once"""
+        table = self.account_table
+        d = table._data
+        for intent, stage, _, _ in SALES_STEPS:
+            eligible = table.rows(stage, exclude_in_progress=True)
+            n = min(self.nb_salesreps * self.weekly_requests[intent], len(eligible))
+            if n == 0:
+                continue
+            rows = self.rng.choice(eligible, size=n, replace=False)
+            d['in_progress'][rows] = True
+            if intent == SalesIntents.USER_NEED.value:
+                self.engaged_sql[rows] = True
+            if intent in Account.sales_conversion_rates:
+                rate, delay = Account.sales_conversion_rates[intent], Account.sales_conversion_delays.get(intent, 0.0)
+                k = Account.conversion_intent_codes.get(intent, -1)
+                factors = Account.conversion_factor_table[d['country'][rows], d['industry'][rows], d['account_type'][rows], k]
+                rate = np.minimum(rate * factors, 1)
+            else:
+                rate, delay = Account.ops_conversion_rates.get(intent, 0), Account.ops_conversion_delays.get(intent, 0.0)
+            self.schedule_replies(intent, rows, self.rng.random(n) <= rate, delay)
+
+    def send_email_campaign(self):
+        """Email campaign to random MQL accounts, when due"""
+        if self.now < self.next_campaign_at:
+            return
+        params = self.marketing_parameters[EMAIL]
+        eligible = self.account_table.rows(AccountStage.MQL)
+        rows = self.rng.choice(eligible, size=min(params['nb_targetted_accounts'], len(eligible)), replace=False)
+        accepted = self.rng.random(len(rows)) <= Account.mktg_conversion_rates[EMAIL]
+        self.schedule_replies(EMAIL, rows, accepted, Account.mktg_conversion_delays[EMAIL])
+        self.next_campaign_at = self.now + int(52 / max(params['nb_yearly_campaigns'], 1))
+
+    def apply_replies(self, intent:str, rows:np.ndarray, accepted:np.ndarray, t:float):
+        """Transitions and business values of the accounts `rows` replying to `intent` at time `t`"""
+        d = self.account_table._data
+        if intent == EMAIL:
+            # Accepting MQL accounts become SQL, assigned to the first sales rep as in `assign_salesrep`
+            rows = rows[accepted & (d['stage'][rows] == CODES[AccountStage.MQL]) & d['active'][rows]]
+            d['stage'][rows] = CODES[AccountStage.SQL]
+            d['salesrep'][rows] = 0
+            return
+        _, _, on_accept, on_reject = next(step for step in SALES_STEPS if step[0] == intent)
+        keep = d['active'][rows]
+        rows, accepted = rows[keep], accepted[keep]
+        won, lost = rows[accepted], rows[~accepted]
+        if intent == SalesIntents.BID.value and len(won):
+            bounds = np.array([Account.opportunity_sizes[kind] for kind in AccountType], dtype=float)[d['account_type'][won]]
+            values = (self.rng.uniform(bounds[:, 0], bounds[:, 1]) // 1000 * 1000).astype(np.int64)
+            d['active_opportunity'][won] = values
+            d['cumulative_opportunity_value'][won] += values
+            d['nb_opportunities'][won] += 1
+            self.opportunity_id[won] = self.opportunities.create(won, values, t=t, salesreps=d['salesrep'][won])
+            self.totals['opportunity_value'] += int(values.sum())
+        elif intent == SalesIntents.NEGO.value:
+            values = d['active_opportunity'][won]
+            d['active_purchase'][won] = values
+            d['cumulative_purchase_value'][won] += values
+            d['active_opportunity'][won] = 0
+            self.totals['closed_won_value'] += int(values.sum())
+            self.totals['nb_closed_won'] += len(won)
+            for closed, stage in [(won, OpportunityStage.CLOSED_WON), (lost, OpportunityStage.CLOSED_LOST)]:
+                ids = self.opportunity_id[closed]
+                self.opportunities.close(ids[ids >= 0], stage, t=t)
+                self.opportunity_id[closed] = -1
+        d['stage'][won] = CODES[on_accept]
+        d['stage'][lost] = CODES[on_reject]
+        d['in_progress'][rows] = False
+
+    def apply_pending(self, until:float, inclusive=False):
+        """Apply the replies due before `until` (or at `until` when `inclusive`), in time order"""
+        pending = self.pending
+        while pending and (pending[0][0] < until or (inclusive and pending[0][0] == until)):
+            t, _, intent, rows, accepted = heapq.heappop(pending)
+            self.apply_replies(intent, rows, accepted, t)
+
+    # =============================================================================
+    # Simulation
+    # =============================================================================
+    def compute_time_to_next_event(self):
+        n = self.marketing_parameters[MktgIntents.INDUSTRY_EVENT.value]['nb_yearly_events']
+        return 52 / max(n, 1)
+
+    def onboard_industry_event_leads(self):
+        params = self.marketing_parameters[MktgIntents.INDUSTRY_EVENT.value]
+        nb_leads = self.rng.binomial(params['nb_leads_per_event'], params['industry_event_conversion_rate'])
+        nb_sql = self.rng.binomial(nb_leads, Account.mktg_conversion_rates[MktgIntents.INDUSTRY_EVENT.value])
+        self.add_accounts(nb_leads - nb_sql, AccountStage.MQL, lead_source=LeadSource.INDUSTRY_EVENT)
+        self.add_accounts(nb_sql, AccountStage.SQL, lead_source=LeadSource.INDUSTRY_EVENT)
+
+    def record_accounts_stats(self):
+        per_stage = self.account_table.per_stage()
+        record = {'timestamp': self.now, 'nb_accounts': int(self.account_table.active.sum())}
+        record.update({stage.name: per_stage.get(stage, 0) for stage in AccountStage})
+        self.account_stats.append(record)
+
+    def step(self):
+        """Advance one week: stats, requests of the week, then replies due now and what happens within the week"""
+        t = self.now
+        if t >= 1:
+            self.record_accounts_stats()
+        self.send_email_campaign()
+        self.send_sales_requests()
+
+        # Events within the week, in time order: replies, then arrivals and industry events at their time
+        events = [(float(a), 'arrival') for a in t + np.sort(self.rng.uniform(0, 1, size=self.rng.poisson(self.mql_arrival_rate)))]
+        if self.industry_events:
+            while self.next_industry_event_at < t + 1:
+                events.append((self.next_industry_event_at, 'industry event'))
+                self.next_industry_event_at += self.compute_time_to_next_event()
+        for at, kind in sorted(events):
+            self.apply_pending(at, inclusive=True)
+            if kind == 'arrival':
+                self.add_accounts(1, AccountStage.MQL)
+            else:
+                self.onboard_industry_event_leads()
+        self.apply_pending(t + 1)
+        self.now = t + 1
+
+    def run(self, until:int):
+        """Run the simulation until week `until`, excluded, as `CustomerRelationManagerSimulator.run`"""
+        while self.now < until:
+            self.step()
+
+    # =============================================================================
+    # Reporting
+    # =============================================================================
+    def account_stats_to_df(self, day1:datetime=datetime(2026, 1, 1), int_idx=False) -> pd.DataFrame:
+        """Weekly number of accounts per stage, in the format of `CustomerRelationManagerSimulator.account_stats_to_df`"""
+        df = pd.DataFrame(self.account_stats, columns=['timestamp', 'nb_accounts'] + [s.name for s in AccountStage])
+        if not int_idx:
+            d1 = day1 + timedelta(days= 7 - day1.weekday())  # Align to the first Monday
+            df['timestamp'] = df['timestamp'].apply(lambda x: d1 + timedelta(weeks=x))
+            df = df.set_index('timestamp', drop=True).sort_index()
+        return df
+
+    def kpis(self) -> Dict[str, float]:
+        """Same KPIs as `scenarios.compute_kpis`, accumulated during the run"""
+        nb_engaged = int(self.engaged_sql.sum())
+        kpis = dict(self.totals)
+        kpis['sql_to_signed'] = kpis['nb_closed_won'] / nb_engaged if nb_engaged else np.nan
+        per_stage = self.account_table.per_stage()
+        kpis.update({f"stage_{stage.name}": per_stage.get(stage, 0) for stage in AccountStage})
+        return kpis
+
+
+def compare_engines(until:int=52, replications:int=30, seed:int=0, weeks:Optional[Sequence[int]]=None, alpha:float=0.01, **init) -> pd.DataFrame:
+    """Validation harness: run `replications` of the event-driven and the stepped engines with the same settings
+    (`init`, keyword arguments of both constructors), and compare their distributions of accounts per stage.
+
+    For each stage at each of `weeks` (default: every 13 weeks and the last week), returns the mean and std of
+    both engines, and the p-values of a two-sample Kolmogorov-Smirnov test and of Welch's t-test. `consistent` is
+    False when a p-value is below `alpha` divided by the number of tests (Bonferroni correction).
+    """
+    from scipy import stats
+    from crm import CustomerRelationManagerSimulator
+
+    STEPPED_INIT = inspect.signature(SteppedCRMSimulator).parameters
+
+    runs = {'event': [], 'stepped': []}
+    for r in range(replications):
+        random.seed(seed + r)
+        np.random.seed(seed + r)
+        with redirect_stdout(io.StringIO()):
+            crm = CustomerRelationManagerSimulator(**init)
+            crm.run(until=until)
+        runs['event'].append(crm.account_stats_to_df(int_idx=True))
+        stepped = SteppedCRMSimulator(seed=seed + r, **{k: v for k, v in init.items() if k in STEPPED_INIT})
+        stepped.run(until=until)
+        runs['stepped'].append(stepped.account_stats_to_df(int_idx=True))
+
+    weeks = list(weeks) if weeks is not None else sorted(set(range(13, until, 13)) | {until - 1})
+    stages = ['nb_accounts'] + [s.name for s in AccountStage]
+    rows = []
+    for week in weeks:
+        for stage in stages:
+            a = np.array([df.loc[df['timestamp'] == week, stage].iloc[0] for df in runs['event']], dtype=float)
+            b = np.array([df.loc[df['timestamp'] == week, stage].iloc[0] for df in runs['stepped']], dtype=float)
+            if a.std() == 0 and b.std() == 0:
+                p_ks = p_t = 1.0 if a.mean() == b.mean() else 0.0
+            else:
+                p_ks = stats.ks_2samp(a, b).pvalue
+                p_t = stats.ttest_ind(a, b, equal_var=False).pvalue
+            rows.append({
+                'week': week, 'stage': stage,
+                'mean_event': a.mean(), 'mean_stepped': b.mean(), 'std_event': a.std(ddof=1), 'std_stepped': b.std(ddof=1),
+                'p_ks': p_ks, 'p_ttest': p_t,
+            })
+    df = pd.DataFrame(rows).set_index(['week', 'stage'])
+    df['consistent'] = df[['p_ks', 'p_ttest']].min(axis=1) >= alpha / (2 * len(df))
+    return df
+
+
+if __name__ == "__main__":
+    pass
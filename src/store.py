@@ -0,0 +1,195 @@
+import sqlite3
+import pandas as pd
+
+from enum import Enum
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from agents import Account, SalesRep
+from enums import AccountStage, BusinessValues
+from utils import resolve_attr
+
+
+def _sql_type(kind) -> str:
+    if isinstance(kind, type) and issubclass(kind, Enum):
+        return 'TEXT'
+    return {'int64': 'INTEGER', 'float64': 'REAL'}.get(kind, 'TEXT')
+
+def _sql_value(value):
+    return value.name if isinstance(value, Enum) else value
+
+def _table_columns(schema) -> Dict[str, str]:
+    """SQL columns of a table built from an agent export schema (see `utils.snapshot_df`)"""
+    return {col: _sql_type(kind) for col, (path, kind) in schema.items()}
+
+def _rows(objs, schema, extra:Sequence[str]=()) -> List[tuple]:
+    paths = [path for path, kind in schema.values()] + list(extra)
+    return [tuple(_sql_value(resolve_attr(o, p)) for p in paths) for o in objs]
+
+
+class CRMStore:
+    """SQLite database with the accounts, sales reps, opportunities, transactions and weekly stats of a simulation.
+
+    Tables:
+    - accounts: one row per account, columns of `Account.export_schema` plus `created_at`
+    - salesreps: one row per sales rep, columns of `SalesRep.export_schema`
+    - transactions: one row per transaction, with its sequence number in the simulation as id
+    - account_stats: number of accounts per (week, stage)
+    - opportunities: view of the opportunity forecasts and purchases in the transactions
+    - exports: one row per export, with the watermarks of what was exported (see `sync`)
+
+    The database is in WAL mode, so that queries can run while the simulation syncs new rows.
+    """
+
+    def __init__(self, path:Path|str=':memory:'):
+        self.path = path
+        self.con = sqlite3.connect(str(path))
+        self.con.execute('PRAGMA journal_mode=WAL')
+        self.con.execute('PRAGMA synchronous=NORMAL')
+        self.create_tables()
+
+    def create_tables(self):
+        accounts = {**_table_columns(Account.export_schema), 'created_at': 'REAL'}
+        salesreps = _table_columns(SalesRep.export_schema)
+        ddl = f"""
+        CREATE TABLE IF NOT EXISTS accounts ({', '.join(f'{c} {t}' for c, t in accounts.items())}, PRIMARY KEY (uid));
+        CREATE TABLE IF NOT EXISTS salesreps ({', '.join(f'{c} {t}' for c, t in salesreps.items())}, PRIMARY KEY (uid));
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY,
+            timestamp REAL,
+            sender TEXT,
+            receiver TEXT,
+            intent TEXT,
+            action TEXT,
+            type TEXT,
+            value REAL
+        );
+        CREATE TABLE IF NOT EXISTS account_stats (week INTEGER, stage TEXT, nb_accounts INTEGER, PRIMARY KEY (week, stage));
+        CREATE TABLE IF NOT EXISTS exports (
+            period INTEGER PRIMARY KEY,
+            crm_uid TEXT,
+            nb_transactions INTEGER,
+            last_week INTEGER,
+            sim_time REAL,
+            nb_new_transactions INTEGER,
+            nb_changed_accounts INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS idx_transactions_receiver ON transactions (receiver, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_transactions_sender ON transactions (sender, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_transactions_intent ON transactions (intent);
+        CREATE INDEX IF NOT EXISTS idx_accounts_salesrep ON accounts (assigned_salesrep, stage);
+        CREATE INDEX IF NOT EXISTS idx_account_stats_stage ON account_stats (stage, week);
+        CREATE VIEW IF NOT EXISTS opportunities AS
+            SELECT id, timestamp, sender AS account, receiver AS salesrep, intent, value
+            FROM transactions
+            WHERE intent IN ('{BusinessValues.OPPORTUNITY.value}', '{BusinessValues.PURCHASE.value}');
+        """
+        self.con.executescript(ddl)
+
+    def watermark(self) -> Dict[str, Any]:
+        """Watermark of the last export: period number, crm uid, number of transactions, last week and simulation time"""
+        row = self.con.execute(
+            'SELECT period, crm_uid, nb_transactions, last_week, sim_time FROM exports ORDER BY period DESC LIMIT 1'
+        ).fetchone()
+        if row is None:
+            return {'period': 0, 'crm_uid': None, 'nb_transactions': 0, 'last_week': -1, 'sim_time': None}
+        return dict(zip(['period', 'crm_uid', 'nb_transactions', 'last_week', 'sim_time'], row))
+
+    def sync(self, crm, full=False):
+        """Export what changed in the simulation `crm` since the last export, and record a new watermark.
+
+        - transactions recorded after the last exported sequence number are appended
+        - weekly stats after the last exported week are appended
+        - accounts added, changed or removed since the last export (`crm.dirty_accounts`) are upserted or deleted,
+          all accounts on the first export or when `full`
+        - sales reps are upserted
+        The cost of an export is thus proportional to the activity since the previous one.
+        """
+        wm = self.watermark()
+        if wm['crm_uid'] is not None and wm['crm_uid'] != crm.uid:
+            raise ValueError(f"Store was exported from simulation {wm['crm_uid']}, not {crm.uid}")
+        full = full or wm['period'] == 0
+        start = wm['nb_transactions']
+        new_stats = [r for r in getattr(crm, 'account_stats', []) if r['timestamp'] > wm['last_week']]
+        if full:
+            accounts, removed = crm.get_accounts(), []
+        else:
+            agents = [crm.registry[aid] for aid in crm.dirty_accounts]
+            accounts = [a for a in agents if a is not None]
+            removed = [crm.registry.uid(aid) for aid, a in zip(crm.dirty_accounts, agents) if a is None]
+
+        uid = crm.registry.uid
+        with self.con:
+            self.con.executemany(
+                'INSERT INTO transactions (id, timestamp, sender, receiver, intent, action, type, value) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    (seq, t['timestamp'], uid(t['sender']), uid(t['receiver']), t['intent'], t['action'], t['type'], t.get('value', None))
+                    for seq, t in enumerate(crm.transactions[start:], start=start)
+                ),
+            )
+            self.con.executemany(
+                'INSERT INTO account_stats (week, stage, nb_accounts) VALUES (?, ?, ?)',
+                ((int(r['timestamp']), stage.name, r[stage.name]) for r in new_stats for stage in AccountStage),
+            )
+            self.upsert('accounts', accounts, Account.export_schema, extra=['created_at'])
+            self.con.executemany('DELETE FROM accounts WHERE uid = ?', ((uid,) for uid in removed))
+            self.upsert('salesreps', crm.get_salesreps(), SalesRep.export_schema)
+            self.con.execute(
+                'INSERT INTO exports VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (
+                    wm['period'] + 1, crm.uid, len(crm.transactions),
+                    int(new_stats[-1]['timestamp']) if new_stats else wm['last_week'],
+                    crm.env.now, len(crm.transactions) - start, len(accounts) + len(removed),
+                ),
+            )
+        crm.dirty_accounts.clear()
+        return self
+
+    def upsert(self, table:str, objs, schema, extra:Sequence[str]=()):
+        """Insert or replace the rows of `objs` in `table`"""
+        columns = list(schema) + list(extra)
+        self.con.executemany(
+            f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            _rows(objs, schema, extra),
+        )
+
+    def query(self, sql:str, params:Sequence[Any]=()) -> pd.DataFrame:
+        """Run a SQL query and return its result as a DataFrame"""
+        return pd.read_sql_query(sql, self.con, params=params)
+
+    def account_touches(self, account_uid:str) -> pd.DataFrame:
+        """All transactions sent to or by an account, in time order"""
+        return self.query(
+            'SELECT * FROM transactions WHERE receiver = ? UNION ALL SELECT * FROM transactions WHERE sender = ? ORDER BY timestamp, id',
+            (account_uid, account_uid),
+        )
+
+    def salesrep_pipeline(self, salesrep:str) -> pd.DataFrame:
+        """Accounts assigned to a sales rep, given by uid or name, with their stage and business values"""
+        return self.query(
+            'SELECT a.* FROM accounts a JOIN salesreps s ON a.assigned_salesrep = s.uid WHERE s.uid = ? OR s.name = ? ORDER BY a.stage',
+            (salesrep, salesrep),
+        )
+
+    def stage_history(self, stage:AccountStage|str, weeks:Optional[Sequence[int]]=None) -> pd.DataFrame:
+        """Weekly number of accounts in `stage`, optionally between weeks[0] and weeks[1]"""
+        stage = stage.name if isinstance(stage, AccountStage) else stage
+        if weeks is None:
+            return self.query('SELECT week, nb_accounts FROM account_stats WHERE stage = ? ORDER BY week', (stage,))
+        return self.query(
+            'SELECT week, nb_accounts FROM account_stats WHERE stage = ? AND week BETWEEN ? AND ? ORDER BY week',
+            (stage, *weeks),
+        )
+
+    def close(self):
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,63 @@
+import random
+
+from typing import Dict, Hashable
+
+
+class RandomStreams:
+    """Independent random streams, one per decision point, for common random numbers.
+
+    A decision point is identified by a hashable key, e.g. (account index, intent). Each stream is seeded
+    from the master `seed` and its key only, so that the n-th draw at a decision point is the same in all
+    simulations sharing the seed, whatever happens elsewhere in the simulation. Comparing scenarios on the
+    same streams removes most of the noise from their difference.
+
+    As streams are determined by the seed and their key, their state is captured as the number of draws of
+    each stream (see `state` and `restore`).
+    """
+
+    def __init__(self, seed:int):
+        self.seed = seed
+        self._streams:Dict[Hashable, random.Random] = {}
+        self._draws:Dict[Hashable, int] = {}  # number of draws per stream
+
+    def stream(self, key:Hashable) -> random.Random:
+        """Random generator of the decision point `key`, created on first use"""
+        rng = self._streams.get(key)
+        if rng is None:
+            rng = self._streams[key] = random.Random(f"{self.seed}/{key}")
+            self._draws[key] = 0
+        return rng
+
+    def random(self, key:Hashable) -> float:
+        """Next uniform draw in [0, 1) from the stream of `key`"""
+        rng = self.stream(key)
+        self._draws[key] += 1
+        return rng.random()
+
+    def uniform(self, key:Hashable, a:float, b:float) -> float:
+        """Next uniform draw in [a, b] from the stream of `key`"""
+        rng = self.stream(key)
+        self._draws[key] += 1
+        return rng.uniform(a, b)
+
+    def state(self) -> dict:
+        """Seed and number of draws per stream, see `restore`"""
+        return {'seed': self.seed, 'draws': dict(self._draws)}
+
+    @classmethod
+    def restore(cls, state:dict) -> 'RandomStreams':
+        """Rebuild the streams from their `state`, by replaying the draws of each stream from its seed"""
+        streams = cls(state['seed'])
+        for key, n in state['draws'].items():
+            rng = streams.stream(key)
+            for _ in range(n):
+                rng.random()
+            streams._draws[key] = n
+        return streams
+
+    def __len__(self):
+        return len(self._streams)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,120 @@
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import numpy as np
+import pandas as pd
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from scenarios import compute_kpis, run_scenario
+
+
+# =============================================================================
+# Designs of experiments
+# =============================================================================
+def grid_design(space:Dict[str, Sequence]) -> List[Dict[str, Any]]:
+    """All combinations of the values listed for each parameter path in `space`"""
+    paths = list(space)
+    return [dict(zip(paths, values)) for values in itertools.product(*[space[p] for p in paths])]
+
+def _scale(u, spec):
+    """Map uniform draws `u` in [0,1) onto the parameter range `spec`:
+    a list of choices, or a (low, high) tuple, of ints for integer parameters"""
+    if isinstance(spec, list):
+        return [spec[i] for i in (np.asarray(u) * len(spec)).astype(int)]
+    low, high = spec
+    if isinstance(low, int) and isinstance(high, int):
+        return [int(v) for v in np.floor(low + np.asarray(u) * (high - low + 1))]
+    return [float(v) for v in low + np.asarray(u) * (high - low)]
+
+def random_design(space:Dict[str, Any], n:int, seed:Optional[int]=None) -> List[Dict[str, Any]]:
+    """`n` scenarios drawn uniformly in `space`, which maps each parameter path to a list of choices
+    or to a (low, high) range"""
+    rng = np.random.default_rng(seed)
+    columns = {p: _scale(rng.random(n), spec) for p, spec in space.items()}
+    return [{p: columns[p][i] for p in space} for i in range(n)]
+
+def latin_hypercube_design(space:Dict[str, Any], n:int, seed:Optional[int]=None) -> List[Dict[str, Any]]:
+    """`n` scenarios from a latin hypercube sample of `space` (see `random_design`):
+    each parameter range is split in `n` strata, each sampled exactly once"""
+    rng = np.random.default_rng(seed)
+    columns = {p: _scale((rng.permutation(n) + rng.random(n)) / n, spec) for p, spec in space.items()}
+    return [{p: columns[p][i] for p in space} for i in range(n)]
+
+DESIGNS = {
+    'grid': lambda space, n, seed: grid_design(space),
+    'random': random_design,
+    'lhs': latin_hypercube_design,
+}
+
+def make_scenarios(space:Dict[str, Any], method='grid', n:Optional[int]=None, seed:Optional[int]=None) -> List[Dict[str, Any]]:
+    """Build the scenarios of a sweep over `space` with the design `method` ('grid', 'random' or 'lhs')"""
+    if method not in DESIGNS:
+        raise ValueError(f"Unknown design '{method}', expected one of {list(DESIGNS)}")
+    if method != 'grid' and n is None:
+        raise ValueError(f"Design '{method}' requires the number of scenarios n")
+    return DESIGNS[method](space, n, seed)
+
+
+# =============================================================================
+# Sweep engine
+# =============================================================================
+def scenario_id(params:Dict[str, Any]) -> str:
+    """Stable identifier of a scenario, hashed from its canonical json representation"""
+    canonical = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()[:12]
+
+def _sweep_task(task):
+    sid, replication, seed, params, until = task
+    kpis = run_scenario(params, until=until, seed=seed, collect=compute_kpis)
+    return [
+        {'scenario_id': sid, 'replication': replication, 'seed': seed, 'until': until, **params, 'kpi': kpi, 'value': value}
+        for kpi, value in kpis.items()
+    ]
+
+def run_sweep(
+    scenarios:List[Dict[str, Any]],
+    until:int,
+    out:Path|str,
+    replications:int=1,
+    seed:int=0,
+    processes:Optional[int]=None,
+    ) -> pd.DataFrame:
+    """Run all `scenarios` with `replications` each in a worker pool, and write their KPIs in a tidy csv table.
+
+    The table at `out` has one row per scenario, replication and KPI, with the scenario parameters as columns.
+    Rows are appended as runs complete, and runs already in `out` with the same seed and horizon `until` are
+    skipped, so an interrupted sweep resumes where it stopped. Replication r of every scenario uses the seed
+    `seed + r`, so that scenarios are compared on the same random streams. Resuming a table with other
+    parameter columns raises a ValueError.
+    """
+    out = Path(out)
+    paths = list(dict.fromkeys(p for params in scenarios for p in params))
+    columns = ['scenario_id', 'replication', 'seed', 'until', *paths, 'kpi', 'value']
+    done = set()
+    if out.is_file():
+        df = pd.read_csv(out)
+        if scenarios and set(df.columns) != set(columns):
+            raise ValueError(f"Columns of {out} {list(df.columns)} differ from the columns of the sweep {columns}")
+        done = set(zip(df['scenario_id'], df['replication'], df['seed'], df['until']))
+        columns = list(df.columns)
+
+    tasks = [
+        (scenario_id(params), r, seed + r, params, until)
+        for params in scenarios for r in range(replications)
+        if (scenario_id(params), r, seed + r, until) not in done
+    ]
+    if tasks:
+        processes = processes or min(len(tasks), os.cpu_count() or 1)
+        with multiprocessing.Pool(processes=processes) as pool:
+            for rows in pool.imap_unordered(_sweep_task, tasks):
+                header = not out.is_file()
+                pd.DataFrame(rows, columns=columns).to_csv(out, mode='a', header=header, index=False)
+    return pd.read_csv(out) if out.is_file() else pd.DataFrame(columns=columns)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,184 @@
+import numpy as np
+
+from typing import TYPE_CHECKING, Any, Dict, Optional, Sequence
+
+from enums import AccountStage, AccountType, Country, Industry, LeadSource, enum_codes, enum_labels
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+class ColumnTable:
+    """Rows stored column-wise in numpy arrays, with the row index as id. Subclasses define `columns`,
+    mapping each column name to its dtype. Arrays grow by doubling their capacity when full."""
+
+    columns:Dict[str, Any] = {}
+
+    def __init__(self, capacity:int=1024):
+        self.size = 0
+        self._data = {col: np.empty(capacity, dtype=dtype) for col, dtype in self.columns.items()}
+
+    def __len__(self):
+        return self.size
+
+    def __getattr__(self, col):
+        """Column `col` as a view of its filled part, e.g. `table.value`"""
+        data = self.__dict__.get('_data', {})
+        if col in data:
+            return data[col][:self.size]
+        raise AttributeError(col)
+
+    def _reserve(self, n:int):
+        capacity = len(next(iter(self._data.values())))
+        if self.size + n > capacity:
+            capacity = max(2 * capacity, self.size + n)
+            for col, arr in self._data.items():
+                new = np.empty(capacity, dtype=arr.dtype)
+                new[:self.size] = arr[:self.size]
+                self._data[col] = new
+
+    def _append(self, n:int) -> np.ndarray:
+        """Allocate `n` new rows and return their ids. Their values are set by the caller"""
+        self._reserve(n)
+        ids = np.arange(self.size, self.size + n)
+        self.size += n
+        return ids
+
+
+class Column:
+    """Attribute of an agent stored in the column of a table of the crm, at the row `idx` of the agent.
+
+    `table` is the name of the table attribute of the crm, e.g. 'account_table'. The column defaults to the
+    attribute name. Enum members are stored as their code, see `enums.enum_codes`.
+    """
+
+    def __init__(self, table:str, column:Optional[str]=None, enum_cls=None):
+        self.table = table
+        self.column = column
+        self.enum_cls = enum_cls
+        if enum_cls is not None:
+            self.codes = enum_codes(enum_cls)
+            self.members = list(enum_cls)
+
+    def __set_name__(self, owner, name):
+        self.column = self.column or name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        value = getattr(obj.crm, self.table)._data[self.column][obj.idx]
+        if self.enum_cls is not None:
+            return self.members[value]
+        return value.item() if isinstance(value, np.generic) else value
+
+    def __set__(self, obj, value):
+        getattr(obj.crm, self.table)._data[self.column][obj.idx] = self.codes[value] if self.enum_cls is not None else value
+
+
+class AccountTable(ColumnTable):
+    """State of all accounts of a simulation, one row per account with the account index as row.
+
+    `agents.Account` objects are views over their row (see `Column`). Enum attributes are stored as codes,
+    the assigned sales rep as its index (-1 when none). Rows of removed accounts are kept with `active` False,
+    and `in_progress` flags accounts with a pending sales request. Histograms and sampling of accounts per stage
+    are computed on the columns, without touching the account objects.
+    """
+
+    columns = {
+        'aid': np.int64,
+        'name': object,
+        'stage': np.int8,
+        'account_type': np.int8,
+        'country': np.int8,
+        'industry': np.int8,
+        'lead_source': np.int8,
+        'salesrep': np.int32,
+        'nb_opportunities': np.int64,
+        'cumulative_opportunity_value': np.int64,
+        'active_opportunity': np.int64,
+        'nb_purchases': np.int64,
+        'cumulative_purchase_value': np.int64,
+        'active_purchase': np.int64,
+        'active': np.bool_,
+        'in_progress': np.bool_,
+    }
+    enums = {
+        'stage': AccountStage,
+        'account_type': AccountType,
+        'country': Country,
+        'industry': Industry,
+        'lead_source': LeadSource,
+    }
+
+    def __init__(self, capacity:int=1024):
+        super().__init__(capacity=capacity)
+        self._stage_codes = enum_codes(AccountStage)
+
+    def add(self, name:str) -> int:
+        """Allocate the row of a new MQL account without sales rep, and return its index"""
+        row = int(self._append(1)[0])
+        d = self._data
+        for col in self.columns:
+            d[col][row] = 0
+        d['name'][row] = name
+        d['stage'][row] = self._stage_codes[AccountStage.MQL]
+        d['salesrep'][row] = -1
+        d['active'][row] = True
+        return row
+
+    def extend(self, n:int, **values) -> np.ndarray:
+        """Allocate the rows of `n` new MQL accounts without sales rep, with the column `values` given as codes
+        or arrays of codes, and return their indices"""
+        rows = self._append(n)
+        d = self._data
+        for col in self.columns:
+            d[col][rows] = 0
+        d['stage'][rows] = self._stage_codes[AccountStage.MQL]
+        d['salesrep'][rows] = -1
+        d['active'][rows] = True
+        for col, value in values.items():
+            d[col][rows] = value
+        return rows
+
+    def remove(self, row:int):
+        self._data['active'][row] = False
+        self._data['in_progress'][row] = False
+
+    def rows(self, stage:Optional[AccountStage]=None, exclude_in_progress=False) -> np.ndarray:
+        """Rows of the active accounts, optionally at `stage` and without pending request"""
+        mask = self.active.copy()
+        if stage is not None:
+            mask &= self.stage == self._stage_codes[stage]
+        if exclude_in_progress:
+            mask &= ~self.in_progress
+        return np.flatnonzero(mask)
+
+    def per_stage(self) -> Dict[AccountStage, int]:
+        """Number of active accounts per stage"""
+        counts = np.bincount(self.stage[self.active], minlength=len(AccountStage))
+        return {stage: int(n) for stage, n in zip(AccountStage, counts) if n}
+
+    def to_df(self, schema, **extra:Sequence) -> 'pd.DataFrame':
+        """Active accounts with the columns of the export `schema` (see `utils.snapshot_df`).
+
+        Columns are read from the table columns of the same name, enums as categoricals over the stored codes,
+        or from `extra` (e.g. uids) with one value per active account. Columns are copies, so that the frame does not
+        change when the simulation goes on.
+        """
+        import pandas as pd
+
+        active = self.active
+        take = (lambda arr: arr.copy()) if active.all() else (lambda arr: arr[active])
+        columns = {}
+        for col in schema:
+            if col in extra:
+                columns[col] = pd.Series(extra[col], dtype=object)
+            elif col in self.enums:
+                columns[col] = pd.Categorical.from_codes(take(self._data[col][:self.size]), categories=enum_labels(self.enums[col]))
+            else:
+                columns[col] = take(self._data[col][:self.size])
+        return pd.DataFrame(columns, columns=list(schema), copy=False)   # columns are already copies
+
+
+if __name__ == "__main__":
+    pass
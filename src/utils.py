@@ -1,33 +1,47 @@
+import csv
 import numpy as np
-import pandas as pd
 
+from enum import Enum
 from pathlib import Path
-from scipy.stats import beta
+
+from typing import TYPE_CHECKING
+
+from enums import enum_codes, enum_labels
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 ROOT = Path(__file__).parent.parent.resolve()
 
-def account_info_generator(random_state=None):
-    """Generate a unique account info."""
+def account_info_generator(random_state=None, start=0):
+    """Generate a unique account info.
+
+    With the same `random_state`, `start` resumes the sequence after the first `start` account infos.
+    """
     p2acct_info = ROOT / 'data/account-info-clean.tsv'
-    df = pd.read_csv(p2acct_info, sep='\t')
-    df = df.sample(frac=1, random_state=random_state)  # Shuffle the DataFrame
-    df = df.reset_index(drop=True)  # Reset index after shuffling   
-    idx = 0
+    with open(p2acct_info, newline='') as f:
+        rows = list(csv.DictReader(f, delimiter='\t'))
+    # Shuffle as DataFrame.sample(frac=1, random_state=random_state), without loading pandas
+    rng = np.random if random_state is None else np.random.RandomState(random_state)
+    records = [rows[i] for i in rng.choice(len(rows), size=len(rows), replace=False)]
+    idx = start
     while True:
-        row = df.iloc[idx % len(df)]
+        row = records[idx % len(records)]
         yield row
         idx += 1
 
-def salesrep_name_generator():
+def salesrep_name_generator(start=1):
     """Generate a unique account name."""
-    idx = 1
+    idx = start
     while True:
         yield f"SalesRep {idx}"
         idx += 1
 
 def draw_value_beta(val_min, val_max):
     """Draw a random sample between val_min and val_max, from beta ."""
+    from scipy.stats import beta
+
     #  Validation
     val_min, val_max = int(val_min), int(val_max)
     if val_min >= val_max:
@@ -46,11 +60,44 @@ def draw_value_beta(val_min, val_max):
 def dict_index(d, idx):
     return d[list(d.keys())[idx]]
 
+def resolve_attr(obj, path):
+    """Return the attribute at dotted `path` from `obj`, or None if any step along the path is None"""
+    for attr in path.split('.'):
+        if obj is None: return None
+        obj = getattr(obj, attr)
+    return obj
+
+def snapshot_df(objs, schema) -> 'pd.DataFrame':
+    """Build a DataFrame from a sequence of objects, with one typed column per entry in the export schema.
+
+    `schema` maps each column name to a tuple (attribute path, kind), where kind is:
+    - an Enum class: column is exported as categorical, with the enum codes and the member names as labels
+    - a numpy dtype (e.g. 'int64'): column is exported with that dtype
+    - None: column is exported as is, as an object column
+    """
+    import pandas as pd
+
+    columns = {}
+    for col, (path, kind) in schema.items():
+        if '.' in path:
+            values = [resolve_attr(o, path) for o in objs]
+        else:
+            values = [getattr(o, path) for o in objs]
+        if isinstance(kind, type) and issubclass(kind, Enum):
+            codes = enum_codes(kind)
+            codes = np.fromiter((codes.get(v, -1) for v in values), dtype=np.int16, count=len(values))
+            columns[col] = pd.Categorical.from_codes(codes, categories=enum_labels(kind))  # type: ignore
+        elif kind is not None:
+            columns[col] = np.array(values, dtype=kind)
+        else:
+            columns[col] = pd.Series(values, dtype=object)
+    return pd.DataFrame(columns, columns=list(schema.keys()))
+
     
 if __name__ == "__main__":
     account_name_gen = account_info_generator(1988)
-    # print(next(account_name_gen).tolist())
-    # print(next(account_name_gen).tolist())
+    # print(next(account_name_gen))
+    # print(next(account_name_gen))
 
     salesrep_name_gen = salesrep_name_generator()
     # print(next(salesrep_name_gen))